@@ -2,8 +2,9 @@
 from typing import Dict
 import logging
 from services.tryon_service import process_virtual_tryon
-from services.email_service import send_completion_email_sync, send_error_email_sync
+from services.email_service import queue_completion_email, queue_error_email
 from config import FRONTEND_URL
+from utils.job_context import current_job, stage
 
 logger = logging.getLogger(__name__)
 
@@ -15,19 +16,34 @@ async def process_and_send_email(
     person_image: str, 
     subscription_type: str,
     collection: str
-):
-    """Process try-on and send email (runs in background)"""
+) -> Dict[str, str]:
+    """Process try-on and send email (runs on a job queue worker).
+
+    Returns the processed image URLs; re-raises processing errors after the
+    error email is queued so the job is recorded as failed."""
+    job = current_job.get()
+    if job is not None:
+        job.tier = subscription_type  # labels this job's stage metrics
+    
     try:
-        processed_images = await process_virtual_tryon(user_id, garment_images, person_image)
+        processed_images = await process_virtual_tryon(user_id, garment_images, person_image, subscription_type)
+        failed_products = [product_id for product_id in garment_images if product_id not in processed_images]
+        if garment_images and not processed_images:
+            raise RuntimeError(f"None of the {len(garment_images)} garment(s) could be processed")
+        if failed_products:
+            logger.warning(f"Partial completion for user {user_id}: {len(failed_products)} garment(s) failed: {failed_products}")
         logger.info(f"Processing completed for user: {user_id}")
         
-        # Send completion email
-        send_completion_email_sync(email, user_id, processed_images, subscription_type, collection)
+        # Queue completion email (the outbox sender delivers it off the job's critical path)
+        with stage("email"):
+            await queue_completion_email(email, user_id, processed_images, subscription_type, collection, failed_products)
+        return processed_images
         
     except Exception as e:
         error_message = str(e)
         logger.error(f"Error processing try-on for user {user_id}: {error_message}")
         
-        # Send error email
-        send_error_email_sync(email, user_id, error_message, subscription_type, collection, FRONTEND_URL)
-
+        # Queue error email
+        with stage("email"):
+            await queue_error_email(email, user_id, error_message, subscription_type, collection, FRONTEND_URL)
+        raise
@@ -0,0 +1,222 @@
+"""Local stand-ins for the gateway's external services (one app, routed by path prefix).
+
+- `/images/{name}`                 image host (deterministic noise JPEGs, cacheable)
+- `/modal/...`                     GPU worker: /limits, /tryon/batch (ZIP), /tryon/batch/stream
+- `/openai/v1/chat/completions`    garment descriptions
+- `/cloudinary/v1_1/{cloud}/...`   uploads (point CLOUDINARY_UPLOAD_PREFIX at /cloudinary)
+- `/resend/emails/batch`           email batches (point RESEND_API_URL at /resend)
+- `/_stats`                        request counters
+
+Latencies are read from BENCH_* environment variables so the load test can
+configure them when it starts this app under uvicorn."""
+import asyncio
+import hashlib
+import json
+import os
+import random
+import struct
+import uuid
+import zipfile
+from collections import Counter
+from io import BytesIO
+from typing import Dict, Tuple
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from PIL import Image
+
+MODAL_BASE_LATENCY = float(os.getenv("BENCH_MODAL_BASE_LATENCY", "2.0"))  # preprocessing, per batch
+MODAL_GARMENT_LATENCY = float(os.getenv("BENCH_MODAL_GARMENT_LATENCY", "1.0"))  # diffusion, per garment
+MODAL_CONCURRENCY = int(os.getenv("BENCH_MODAL_CONCURRENCY", "0"))  # concurrent batches (0 = unbounded)
+MODAL_ERROR_RATE = float(os.getenv("BENCH_MODAL_ERROR_RATE", "0"))  # share of batches answered with a 503
+MODAL_STRAGGLER_RATE = float(os.getenv("BENCH_MODAL_STRAGGLER_RATE", "0"))  # share of batches that are slow
+MODAL_STRAGGLER_FACTOR = float(os.getenv("BENCH_MODAL_STRAGGLER_FACTOR", "5"))  # latency multiplier for those
+MODAL_GARMENT_ERROR_RATE = float(os.getenv("BENCH_MODAL_GARMENT_ERROR_RATE", "0"))  # share of garments failing
+OPENAI_LATENCY = float(os.getenv("BENCH_OPENAI_LATENCY", "0.8"))
+CLOUDINARY_LATENCY = float(os.getenv("BENCH_CLOUDINARY_LATENCY", "0.3"))
+RESEND_LATENCY = float(os.getenv("BENCH_RESEND_LATENCY", "0.2"))
+IMAGE_LATENCY = float(os.getenv("BENCH_IMAGE_LATENCY", "0.05"))
+IMAGE_SIZE = tuple(int(side) for side in os.getenv("BENCH_IMAGE_SIZE", "768x1024").split("x"))
+RESULT_SIZE = tuple(int(side) for side in os.getenv("BENCH_RESULT_SIZE", "768x1024").split("x"))
+
+app = FastAPI(title="Benchmark fake services")
+stats: Counter = Counter()
+_images: Dict[str, bytes] = {}
+_modal_slots = asyncio.Semaphore(MODAL_CONCURRENCY) if MODAL_CONCURRENCY > 0 else None
+
+
+def _noise_image(seed: str, size: Tuple[int, int], format: str) -> bytes:
+    """Incompressible pixels, so payload sizes resemble photos rather than flat colour"""
+    width, height = size
+    pixels = hashlib.shake_256(seed.encode("utf-8")).digest(width * height * 3)
+    buffer = BytesIO()
+    Image.frombytes("RGB", size, pixels).save(buffer, format=format, quality=90)
+    return buffer.getvalue()
+
+
+_result_png = _noise_image("result", RESULT_SIZE, "PNG")
+
+
+@app.get("/_stats")
+async def get_stats():
+    return dict(stats)
+
+
+@app.get("/images/{name}")
+async def image(name: str):
+    stats["image_requests"] += 1
+    await asyncio.sleep(IMAGE_LATENCY)
+    if name not in _images:
+        _images[name] = _noise_image(name, IMAGE_SIZE, "JPEG")
+    return Response(_images[name], media_type="image/jpeg", headers={"Cache-Control": "max-age=3600"})
+
+
+@app.get("/modal/health")
+async def modal_health():
+    return {"status": "healthy", "models_loaded": True}
+
+
+@app.get("/modal/limits")
+async def modal_limits():
+    return {
+        "max_process_side": 1024,
+        "size_multiple": 8,
+        "default_size": list(RESULT_SIZE),
+        "input_formats": ["image/png", "image/jpeg", "image/webp"],
+        "model_version": "bench",
+    }
+
+
+async def _garment_count(request: Request) -> int:
+    form = await request.form()
+    return len(form.getlist("garment_images"))
+
+
+async def _modal_slot():
+    if _modal_slots is not None:
+        await _modal_slots.acquire()
+
+
+def _release_modal_slot():
+    if _modal_slots is not None:
+        _modal_slots.release()
+
+
+def _modal_fault() -> Tuple[bool, float]:
+    """(fail this batch, latency multiplier) drawn from the error and straggler rates"""
+    if random.random() < MODAL_ERROR_RATE:
+        stats["modal_errors"] += 1
+        return True, 1.0
+    if random.random() < MODAL_STRAGGLER_RATE:
+        stats["modal_stragglers"] += 1
+        return False, MODAL_STRAGGLER_FACTOR
+    return False, 1.0
+
+
+def _garment_failed() -> bool:
+    if random.random() < MODAL_GARMENT_ERROR_RATE:
+        stats["modal_garment_errors"] += 1
+        return True
+    return False
+
+
+@app.post("/modal/tryon/batch")
+async def modal_batch(request: Request):
+    count = await _garment_count(request)
+    stats["modal_batches"] += 1
+    stats["modal_garments"] += count
+    failed, slowdown = _modal_fault()
+    if failed:
+        return JSONResponse({"detail": "GPU worker unavailable"}, status_code=503)
+    await _modal_slot()
+    try:
+        await asyncio.sleep((MODAL_BASE_LATENCY + MODAL_GARMENT_LATENCY * count) * slowdown)
+    finally:
+        _release_modal_slot()
+    buffer = BytesIO()
+    manifest = {"preprocess_cached": False, "garments": []}
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as zip_file:
+        for index in range(1, count + 1):
+            if _garment_failed():
+                manifest["garments"].append({"index": index, "status": "error", "error": "bench garment failure"})
+                continue
+            zip_file.writestr(f"output_{index}_bench.png", _result_png)
+            manifest["garments"].append({"index": index, "status": "ok", "file": f"output_{index}_bench.png"})
+        zip_file.writestr("manifest.json", json.dumps(manifest))
+    return Response(buffer.getvalue(), media_type="application/zip")
+
+
+@app.post("/modal/tryon/batch/stream")
+async def modal_batch_stream(request: Request):
+    count = await _garment_count(request)
+    stats["modal_batches"] += 1
+    stats["modal_garments"] += count
+    failed, slowdown = _modal_fault()
+    if failed:
+        return JSONResponse({"detail": "GPU worker unavailable"}, status_code=503)
+
+    def frame(header, payload=b""):
+        header_bytes = json.dumps(dict(header, length=len(payload))).encode("utf-8")
+        return struct.pack(">I", len(header_bytes)) + header_bytes + payload
+
+    async def generate():
+        await _modal_slot()
+        try:
+            await asyncio.sleep(MODAL_BASE_LATENCY * slowdown)
+            yield frame({"type": "start", "count": count, "timings": {"preprocess": MODAL_BASE_LATENCY}})
+            for index in range(1, count + 1):
+                await asyncio.sleep(MODAL_GARMENT_LATENCY * slowdown)
+                if _garment_failed():
+                    yield frame({"type": "result", "index": index, "status": "error", "error": "bench garment failure"})
+                    continue
+                yield frame(
+                    {"type": "result", "index": index, "status": "ok", "content_type": "image/png", "timings": {}},
+                    _result_png,
+                )
+        finally:
+            _release_modal_slot()
+        yield frame({"type": "end", "status": "ok", "timings": {}})
+
+    return StreamingResponse(generate(), media_type="application/x-tryon-frames")
+
+
+@app.post("/openai/v1/chat/completions")
+async def chat_completions():
+    stats["openai_requests"] += 1
+    await asyncio.sleep(OPENAI_LATENCY)
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": 0,
+        "model": "gpt-4o-mini",
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": "A plain benchmark sweater with a crew neck and long sleeves."},
+            "finish_reason": "stop",
+        }],
+        "usage": {"prompt_tokens": 100, "completion_tokens": 15, "total_tokens": 115},
+    }
+
+
+@app.post("/cloudinary/v1_1/{cloud_name}/image/upload")
+async def cloudinary_upload(cloud_name: str, request: Request):
+    form = await request.form()
+    stats["cloudinary_uploads"] += 1
+    await asyncio.sleep(CLOUDINARY_LATENCY)
+    public_id = f"{form.get('folder', '')}/{form.get('public_id', uuid.uuid4().hex)}".lstrip("/")
+    extension = form.get("format", "png")
+    return {
+        "public_id": public_id,
+        "version": 1,
+        "format": extension,
+        "resource_type": "image",
+        "secure_url": f"https://res.cloudinary.test/{cloud_name}/image/upload/v1/{public_id}.{extension}",
+    }
+
+
+@app.post("/resend/emails/batch")
+async def resend_batch(request: Request):
+    emails = await request.json()
+    stats["resend_batches"] += 1
+    stats["resend_emails"] += len(emails)
+    await asyncio.sleep(RESEND_LATENCY)
+    return JSONResponse({"data": [{"id": uuid.uuid4().hex} for _ in emails]})
@@ -0,0 +1,46 @@
+"""main.app instrumented for benchmarks: samples event-loop lag and serves /bench/stats.
+
+Run with `uvicorn benchmarks.gateway:app` (the load test does this)."""
+import asyncio
+import resource
+import time
+from contextlib import asynccontextmanager
+from typing import List
+from main import app
+
+LAG_INTERVAL = 0.05
+
+_lag_samples: List[float] = []
+
+
+async def _sample_lag():
+    """Time how late a short sleep wakes up; anything beyond the interval is loop blocking"""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(LAG_INTERVAL)
+        _lag_samples.append(max(0.0, time.perf_counter() - start - LAG_INTERVAL))
+
+
+_app_lifespan = app.router.lifespan_context
+
+
+@asynccontextmanager
+async def _lifespan(application):
+    async with _app_lifespan(application):
+        sampler = asyncio.create_task(_sample_lag())
+        yield
+        sampler.cancel()
+
+
+app.router.lifespan_context = _lifespan
+
+
+@app.get("/bench/stats")
+async def bench_stats():
+    """Event-loop lag samples since the previous call, and the process's peak RSS"""
+    samples = _lag_samples[:]
+    _lag_samples.clear()
+    return {
+        "loop_lag_samples": samples,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
@@ -0,0 +1,364 @@
+"""End-to-end load test of the gateway against local fake services (no GPU or API spend).
+
+    python -m benchmarks.load_test --requests 200 --concurrency 20 --output bench.json
+    python -m benchmarks.load_test --requests 200 --baseline bench.json --output bench-new.json
+
+Starts benchmarks.fake_services and benchmarks.gateway (main.app) under uvicorn in
+subprocesses, submits a mix of try-on requests (garment counts, tiers, duplicates),
+waits for every job and writes a JSON report: throughput, p50/p95/p99 per pipeline
+stage (from the job timings), submit latency, the gateway's event-loop lag and peak
+RSS, and the calls each fake service received. With --baseline the headline numbers
+are compared against an earlier report."""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Tuple
+import httpx
+
+API_KEY = "bench-key"
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Lower is better for every percentile; higher is better for these
+HIGHER_IS_BETTER = {"jobs_per_second", "garments_per_second"}
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    """count, mean and nearest-rank p50/p95/p99/max"""
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def rank(q: float) -> float:
+        return ordered[min(len(ordered) - 1, max(0, round(q * len(ordered)) - 1))]
+
+    return {
+        "count": len(ordered),
+        "mean": sum(ordered) / len(ordered),
+        "p50": rank(0.50),
+        "p95": rank(0.95),
+        "p99": rank(0.99),
+        "max": ordered[-1],
+    }
+
+
+def parse_weights(spec: str, cast=str) -> List[Tuple[Any, float]]:
+    """"1:0.5,4:0.5" -> [(1, 0.5), (4, 0.5)]"""
+    weights = []
+    for item in spec.split(","):
+        value, weight = item.split(":")
+        weights.append((cast(value.strip()), float(weight)))
+    return weights
+
+
+def build_requests(args: argparse.Namespace, images_url: str) -> List[Dict[str, Any]]:
+    """The request mix; duplicates reuse an earlier request's person and garments under a new user"""
+    rng = random.Random(args.seed)
+    garment_counts = parse_weights(args.garments, int)
+    tiers = parse_weights(args.tiers)
+    requests = []
+    for index in range(args.requests):
+        tier = rng.choices([tier for tier, _ in tiers], [weight for _, weight in tiers])[0]
+        if requests and rng.random() < args.duplicate_ratio:
+            source = rng.choice(requests)
+            garment_images, person_image = source["garment_images"], source["person_image"]
+        else:
+            count = rng.choices([count for count, _ in garment_counts], [weight for _, weight in garment_counts])[0]
+            garment_images = {f"p{index}-{n}": f"{images_url}/garment-{index}-{n}.jpg" for n in range(count)}
+            person_image = f"{images_url}/person-{index}.jpg"
+        requests.append({
+            "user_id": f"user-{index}",
+            "email": f"user-{index}@bench.test",
+            "garment_images": garment_images,
+            "person_image": person_image,
+            "subscription_type": tier,
+            "collection": "bench",
+        })
+    return requests
+
+
+def start_server(app: str, port: int, env: Dict[str, str], log_path: str) -> subprocess.Popen:
+    log = open(log_path, "w")
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", app, "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=REPO_ROOT,
+        env={**os.environ, **env},
+        stdout=log,
+        stderr=subprocess.STDOUT,
+    )
+
+
+async def wait_ready(client: httpx.AsyncClient, url: str, process: subprocess.Popen, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{url} exited with code {process.returncode} before becoming ready")
+        try:
+            if (await client.get(url)).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.1)
+    raise RuntimeError(f"{url} not ready after {timeout:.0f}s")
+
+
+async def submit_all(
+    client: httpx.AsyncClient, gateway_url: str, requests: List[Dict[str, Any]], concurrency: int
+) -> Tuple[List[str], List[float], Dict[str, int]]:
+    """Closed-loop submitters; returns job ids, submit latencies and rejections by status"""
+    pending = list(reversed(requests))
+    job_ids: List[str] = []
+    latencies: List[float] = []
+    rejected: Dict[str, int] = {}
+
+    async def submitter():
+        while pending:
+            body = pending.pop()
+            start = time.perf_counter()
+            response = await client.post(
+                f"{gateway_url}/api/v1/tryon", json=body, headers={"Authorization": f"Bearer {API_KEY}"}
+            )
+            latencies.append(time.perf_counter() - start)
+            if response.status_code == 200:
+                job_ids.append(response.json()["job_id"])
+            else:
+                rejected[str(response.status_code)] = rejected.get(str(response.status_code), 0) + 1
+
+    await asyncio.gather(*(submitter() for _ in range(concurrency)))
+    return job_ids, latencies, rejected
+
+
+async def wait_for_jobs(
+    client: httpx.AsyncClient, gateway_url: str, job_ids: List[str], timeout: float
+) -> Dict[str, Dict[str, Any]]:
+    """Poll until every job is completed or failed"""
+    headers = {"Authorization": f"Bearer {API_KEY}"}
+    finished: Dict[str, Dict[str, Any]] = {}
+    waiting = set(job_ids)
+    deadline = time.monotonic() + timeout
+    while waiting and time.monotonic() < deadline:
+        for job_id in list(waiting):
+            job = (await client.get(f"{gateway_url}/api/v1/jobs/{job_id}", headers=headers)).json()
+            if job["state"] in ("completed", "failed"):
+                finished[job_id] = job
+                waiting.discard(job_id)
+        if waiting:
+            await asyncio.sleep(0.5)
+    if waiting:
+        print(f"{len(waiting)} job(s) still unfinished after {timeout:.0f}s", file=sys.stderr)
+    return finished
+
+
+def summarize(
+    args: argparse.Namespace,
+    requests: List[Dict[str, Any]],
+    jobs: Dict[str, Dict[str, Any]],
+    submit_latencies: List[float],
+    rejected: Dict[str, int],
+    wall_seconds: float,
+    gateway_stats: Dict[str, Any],
+    fake_stats: Dict[str, Any],
+) -> Dict[str, Any]:
+    completed = [job for job in jobs.values() if job["state"] == "completed"]
+    garments = sum(len(job["result"] or {}) for job in completed)
+    stages: Dict[str, List[float]] = {}
+    for job in completed:
+        for name, seconds in job["timings"].items():
+            stages.setdefault(name, []).append(seconds)
+    return {
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        "created_at": time.time(),
+        "totals": {
+            "requests": len(requests),
+            "rejected": rejected,
+            "jobs": len(jobs),
+            "completed": len(completed),
+            "failed": len(jobs) - len(completed),
+            "garments": garments,
+            "wall_seconds": wall_seconds,
+            "jobs_per_second": len(completed) / wall_seconds if wall_seconds else 0.0,
+            "garments_per_second": garments / wall_seconds if wall_seconds else 0.0,
+        },
+        "submit_latency": percentiles(submit_latencies),
+        "job_latency": percentiles([job["finished_at"] - job["created_at"] for job in completed]),
+        "stages": {name: percentiles(values) for name, values in sorted(stages.items())},
+        "gateway": {
+            "peak_rss_mb": gateway_stats["peak_rss_mb"],
+            "loop_lag": percentiles(gateway_stats["loop_lag_samples"]),
+        },
+        "fake_services": fake_stats,
+    }
+
+
+def headline(report: Dict[str, Any]) -> Dict[str, float]:
+    """Flat metrics compared against a baseline"""
+    metrics = {
+        "jobs_per_second": report["totals"]["jobs_per_second"],
+        "garments_per_second": report["totals"]["garments_per_second"],
+        "submit_latency.p95": report["submit_latency"].get("p95", 0.0),
+        "job_latency.p95": report["job_latency"].get("p95", 0.0),
+        "loop_lag.p99": report["gateway"]["loop_lag"].get("p99", 0.0),
+        "peak_rss_mb": report["gateway"]["peak_rss_mb"],
+    }
+    for name, summary in report["stages"].items():
+        if "p95" in summary:
+            metrics[f"stages.{name}.p95"] = summary["p95"]
+    return metrics
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Lines describing each headline metric that got worse than the baseline by more than `tolerance`"""
+    regressions = []
+    current, previous = headline(report), headline(baseline)
+    for name, value in current.items():
+        before = previous.get(name)
+        if not before:
+            continue
+        change = (value - before) / before
+        worse = -change if name in HIGHER_IS_BETTER else change
+        print(f"  {name:<32} {before:>10.3f} -> {value:>10.3f} ({change:+.1%})")
+        if worse > tolerance:
+            regressions.append(f"{name}: {before:.3f} -> {value:.3f} ({change:+.1%})")
+    return regressions
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    fake_url = f"http://127.0.0.1:{args.fake_port}"
+    gateway_url = f"http://127.0.0.1:{args.gateway_port}"
+    workdir = tempfile.mkdtemp(prefix="tryon-bench-")
+    fake_env = {
+        "BENCH_MODAL_BASE_LATENCY": str(args.modal_base_latency),
+        "BENCH_MODAL_GARMENT_LATENCY": str(args.modal_garment_latency),
+        "BENCH_MODAL_CONCURRENCY": str(args.modal_concurrency),
+        "BENCH_MODAL_ERROR_RATE": str(args.modal_error_rate),
+        "BENCH_MODAL_STRAGGLER_RATE": str(args.modal_straggler_rate),
+        "BENCH_MODAL_STRAGGLER_FACTOR": str(args.modal_straggler_factor),
+        "BENCH_MODAL_GARMENT_ERROR_RATE": str(args.modal_garment_error_rate),
+        "BENCH_OPENAI_LATENCY": str(args.openai_latency),
+        "BENCH_CLOUDINARY_LATENCY": str(args.cloudinary_latency),
+        "BENCH_RESEND_LATENCY": str(args.resend_latency),
+        "BENCH_IMAGE_LATENCY": str(args.image_latency),
+    }
+    # Extra fake GPU workers on the following ports, each slower by --modal-replica-slowdown
+    replica_ports = [args.fake_port + index for index in range(1, args.modal_replicas)]
+    replica_env = dict(
+        fake_env,
+        BENCH_MODAL_BASE_LATENCY=str(args.modal_base_latency * args.modal_replica_slowdown),
+        BENCH_MODAL_GARMENT_LATENCY=str(args.modal_garment_latency * args.modal_replica_slowdown),
+    )
+    modal_urls = [f"{fake_url}/modal"] + [f"http://127.0.0.1:{port}/modal" for port in replica_ports]
+    gateway_env = {
+        "DATA_DIR": os.path.join(workdir, "data"),
+        "API_KEY": API_KEY,
+        "MODAL_ENDPOINTS": ",".join(modal_urls),
+        "MODAL_STREAMING": "true" if args.streaming else "false",
+        "OPENAI_API_KEY": "bench",
+        "OPENAI_BASE_URL": f"{fake_url}/openai/v1",
+        "CLOUDINARY_CLOUD_NAME": "bench",
+        "CLOUDINARY_API_KEY": "bench",
+        "CLOUDINARY_API_SECRET": "bench",
+        "CLOUDINARY_UPLOAD_PREFIX": f"{fake_url}/cloudinary",
+        "RESEND_API_KEY": "bench",
+        "RESEND_API_URL": f"{fake_url}/resend",
+        "ADMISSION_ENABLED": "false",
+        "TRACE_ENABLED": "false",
+        "LOG_LEVEL": "WARNING",
+    }
+    for item in args.gateway_env:
+        key, _, value = item.partition("=")
+        gateway_env[key] = value
+
+    fake = start_server("benchmarks.fake_services:app", args.fake_port, fake_env, os.path.join(workdir, "fake.log"))
+    replicas = [
+        start_server("benchmarks.fake_services:app", port, replica_env, os.path.join(workdir, f"fake-{port}.log"))
+        for port in replica_ports
+    ]
+    gateway = start_server("benchmarks.gateway:app", args.gateway_port, gateway_env, os.path.join(workdir, "gateway.log"))
+    print(f"Logs and data in {workdir}")
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency + 10)
+        async with httpx.AsyncClient(timeout=60.0, limits=limits) as client:
+            await wait_ready(client, f"{fake_url}/_stats", fake)
+            for port, replica in zip(replica_ports, replicas):
+                await wait_ready(client, f"http://127.0.0.1:{port}/_stats", replica)
+            await wait_ready(client, f"{gateway_url}/health", gateway)
+            await client.get(f"{gateway_url}/bench/stats")  # discard startup lag samples
+
+            requests = build_requests(args, f"{fake_url}/images")
+            start = time.perf_counter()
+            job_ids, submit_latencies, rejected = await submit_all(client, gateway_url, requests, args.concurrency)
+            jobs = await wait_for_jobs(client, gateway_url, job_ids, args.timeout)
+            wall_seconds = time.perf_counter() - start
+
+            gateway_stats = (await client.get(f"{gateway_url}/bench/stats")).json()
+            fake_stats = (await client.get(f"{fake_url}/_stats")).json()
+            if replicas:
+                fake_stats["modal_batches_per_replica"] = [fake_stats["modal_batches"]] + [
+                    (await client.get(f"http://127.0.0.1:{port}/_stats")).json()["modal_batches"]
+                    for port in replica_ports
+                ]
+        return summarize(args, requests, jobs, submit_latencies, rejected, wall_seconds, gateway_stats, fake_stats)
+    finally:
+        for process in (gateway, fake, *replicas):
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=100, help="try-on requests to submit")
+    parser.add_argument("--concurrency", type=int, default=10, help="concurrent submitters")
+    parser.add_argument("--garments", default="1:0.4,3:0.4,10:0.2", help="garment count weights, count:weight,...")
+    parser.add_argument("--tiers", default="trial:0.7,premium:0.3", help="subscription weights, tier:weight,...")
+    parser.add_argument("--duplicate-ratio", type=float, default=0.2, help="fraction reusing an earlier request's images")
+    parser.add_argument("--streaming", action=argparse.BooleanOptionalAction, default=True, help="Modal streaming endpoint")
+    parser.add_argument("--modal-base-latency", type=float, default=2.0, help="seconds per Modal batch")
+    parser.add_argument("--modal-garment-latency", type=float, default=1.0, help="seconds per garment in a batch")
+    parser.add_argument("--modal-concurrency", type=int, default=0, help="concurrent Modal batches (0 = unbounded)")
+    parser.add_argument("--modal-error-rate", type=float, default=0.0, help="share of Modal batches failing with 503")
+    parser.add_argument("--modal-straggler-rate", type=float, default=0.0, help="share of Modal batches that are slow")
+    parser.add_argument("--modal-straggler-factor", type=float, default=5.0, help="latency multiplier of slow batches")
+    parser.add_argument("--modal-garment-error-rate", type=float, default=0.0, help="share of garments the worker fails")
+    parser.add_argument("--modal-replicas", type=int, default=1, help="fake GPU workers behind MODAL_ENDPOINTS")
+    parser.add_argument("--modal-replica-slowdown", type=float, default=1.0, help="latency multiplier of extra replicas")
+    parser.add_argument("--openai-latency", type=float, default=0.8)
+    parser.add_argument("--cloudinary-latency", type=float, default=0.3)
+    parser.add_argument("--resend-latency", type=float, default=0.2)
+    parser.add_argument("--image-latency", type=float, default=0.05)
+    parser.add_argument("--gateway-env", action="append", default=[], metavar="KEY=VALUE", help="extra gateway setting")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=1800.0, help="seconds to wait for all jobs")
+    parser.add_argument("--gateway-port", type=int, default=8800)
+    parser.add_argument("--fake-port", type=int, default=8801)
+    parser.add_argument("--output", default="benchmark.json", help="JSON report path")
+    parser.add_argument("--baseline", help="earlier report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed relative regression vs the baseline")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run(args))
+    with open(args.output, "w") as output:
+        json.dump(report, output, indent=2)
+    totals = report["totals"]
+    print(
+        f"{totals['completed']}/{totals['requests']} jobs, {totals['garments']} garments in {totals['wall_seconds']:.1f}s "
+        f"({totals['garments_per_second']:.2f} garments/s); report written to {args.output}"
+    )
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(report, json.load(baseline_file), args.tolerance)
+        if regressions:
+            print("Regressions beyond tolerance:\n  " + "\n  ".join(regressions))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+"""Gateway cold-start benchmark.
+
+    python -m benchmarks.startup --runs 5 --output startup.json
+
+Reports:
+- import time per module for `import main` (from `python -X importtime`), for the
+  project's modules and the main third-party packages
+- which vendor SDKs `import main` loads (they should load lazily). httpx is not
+  in that list: the HTTP clients are opened in the app lifespan, before uvicorn
+  binds the port, so it is on the path to a first /health either way
+- time from process spawn until GET /health answers, and until it reports
+  `warm` (the vendor SDKs are loaded by the background warm-up)"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+import httpx
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROJECT_PACKAGES = ("main", "config", "schemas", "services", "utils", "actions")
+THIRD_PARTY_PACKAGES = (
+    "fastapi", "starlette", "pydantic", "httpx", "prometheus_client",
+    "openai", "cloudinary", "resend", "PIL", "uvicorn",
+)
+LAZY_SDKS = ("openai", "cloudinary", "resend", "PIL")
+
+_IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$")
+
+
+def import_profile(env: Dict[str, str]) -> Dict[str, Any]:
+    """Cumulative import milliseconds per module for `import main`, and the vendor SDKs it loaded"""
+    check = f"import json, sys; import main; print(json.dumps([m for m in {list(LAZY_SDKS)!r} if m in sys.modules]))"
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", check],
+        cwd=REPO_ROOT, env=env, capture_output=True, text=True, check=True,
+    )
+    modules: Dict[str, float] = {}
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        name = match.group(4)
+        root = name.split(".")[0]
+        # Project modules individually, third-party packages by top-level package only
+        if root in PROJECT_PACKAGES or name in THIRD_PARTY_PACKAGES:
+            modules[name] = max(modules.get(name, 0.0), int(match.group(2)) / 1000)
+    return {
+        "total_ms": modules.get("main", 0.0),
+        "modules_ms": dict(sorted(modules.items(), key=lambda item: -item[1])),
+        "sdks_loaded_at_import": json.loads(result.stdout.strip().splitlines()[-1]),
+    }
+
+
+def time_to_health(env: Dict[str, str], port: int, timeout: float) -> Dict[str, Optional[float]]:
+    """Seconds from spawning uvicorn until /health answers, and until it reports warm"""
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    healthy = warm = None
+    try:
+        with httpx.Client(timeout=1.0) as client:
+            while time.perf_counter() - start < timeout and warm is None:
+                try:
+                    body = client.get(f"http://127.0.0.1:{port}/health").json()
+                except httpx.TransportError:
+                    time.sleep(0.005)
+                    continue
+                now = time.perf_counter() - start
+                if healthy is None:
+                    healthy = now
+                if body.get("warm"):
+                    warm = now
+                else:
+                    time.sleep(0.005)
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+    return {"health_seconds": healthy, "warm_seconds": warm}
+
+
+def median(values: List[Optional[float]]) -> Optional[float]:
+    values = [value for value in values if value is not None]
+    return statistics.median(values) if values else None
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8802)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--output", default="startup.json", help="JSON report path")
+    args = parser.parse_args(argv)
+
+    env = {**os.environ, "DATA_DIR": tempfile.mkdtemp(prefix="tryon-startup-"), "TRACE_ENABLED": "false"}
+    profiles = [import_profile(env) for _ in range(args.runs)]
+    starts = [time_to_health(env, args.port, args.timeout) for _ in range(args.runs)]
+
+    modules = {
+        name: median([profile["modules_ms"].get(name) for profile in profiles])
+        for name in profiles[0]["modules_ms"]
+    }
+    report = {
+        "runs": args.runs,
+        "created_at": time.time(),
+        "import_main_ms": median([profile["total_ms"] for profile in profiles]),
+        "modules_ms": dict(sorted(modules.items(), key=lambda item: -item[1])),
+        "sdks_loaded_at_import": profiles[0]["sdks_loaded_at_import"],
+        "health_seconds": median([start["health_seconds"] for start in starts]),
+        "warm_seconds": median([start["warm_seconds"] for start in starts]),
+    }
+    with open(args.output, "w") as output:
+        json.dump(report, output, indent=2)
+
+    print(f"import main: {report['import_main_ms']:.0f} ms (median of {args.runs})")
+    for name, ms in list(report["modules_ms"].items())[:15]:
+        print(f"  {name:<40} {ms:>8.1f} ms")
+    print(f"SDKs loaded by import main: {report['sdks_loaded_at_import'] or 'none'}")
+    print(f"/health answered after {report['health_seconds']:.2f}s, warm after {report['warm_seconds'] or float('nan'):.2f}s")
+    print(f"Report written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
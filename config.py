@@ -8,6 +8,25 @@ load_dotenv()
 # Modal app endpoint
 MODAL_ENDPOINT = os.getenv("MODAL_ENDPOINT")
 
+
+def _weighted_endpoint(item: str):
+    """(url, weight) from "url=weight"; text after the last "=" that is not a number
+    belongs to the URL (e.g. a query string), and the weight defaults to 1"""
+    url, _, weight = item.rpartition("=")
+    try:
+        return url.strip().rstrip("/"), float(weight or 1)
+    except ValueError:
+        return item.strip().rstrip("/"), 1.0
+
+
+# GPU worker endpoints with weights ("url=weight,url=weight"; weight defaults to 1).
+# Defaults to MODAL_ENDPOINT alone; the first endpoint stands in for MODAL_ENDPOINT
+# (worker limits, model version) when only this list is set.
+MODAL_ENDPOINTS = dict(
+    _weighted_endpoint(item) for item in os.getenv("MODAL_ENDPOINTS", "").split(",") if item.strip()
+) or ({MODAL_ENDPOINT: 1.0} if MODAL_ENDPOINT else {})
+MODAL_ENDPOINT = MODAL_ENDPOINT or next(iter(MODAL_ENDPOINTS), None)
+
 # Frontend URL for email links
 FRONTEND_URL = os.getenv("FRONTEND_URL")
 
@@ -29,3 +48,129 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 # Logo URL
 LOGO_URL = "https://res.cloudinary.com/dnkrqpuqk/image/upload/v1763804717/logo2.2k_orepqx.png"
 
+
+# Persistent data directory (job queue, caches)
+DATA_DIR = os.getenv("DATA_DIR", "data")
+
+# Job queue configuration
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", os.path.join(DATA_DIR, "jobs.sqlite3"))
+JOB_WORKER_COUNT = int(os.getenv("JOB_WORKER_COUNT", "4"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+
+# Concurrency limits for the garment preparation fan-out
+IMAGE_HOST_CONCURRENCY = int(os.getenv("IMAGE_HOST_CONCURRENCY", "8"))  # per image host
+OPENAI_CONCURRENCY = int(os.getenv("OPENAI_CONCURRENCY", "8"))
+
+# Shared HTTP client pools
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "false").lower() == "true"  # requires the 'h2' package
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+DOWNLOAD_MAX_CONNECTIONS = int(os.getenv("DOWNLOAD_MAX_CONNECTIONS", "64"))
+DOWNLOAD_CONNECT_TIMEOUT = float(os.getenv("DOWNLOAD_CONNECT_TIMEOUT", "5"))
+DOWNLOAD_READ_TIMEOUT = float(os.getenv("DOWNLOAD_READ_TIMEOUT", "30"))
+MODAL_MAX_CONNECTIONS = int(os.getenv("MODAL_MAX_CONNECTIONS", "16"))
+MODAL_CONNECT_TIMEOUT = float(os.getenv("MODAL_CONNECT_TIMEOUT", "10"))
+MODAL_READ_TIMEOUT = float(os.getenv("MODAL_READ_TIMEOUT", "1200"))  # 20 minutes
+
+# Downloaded image cache
+IMAGE_CACHE_ENABLED = os.getenv("IMAGE_CACHE_ENABLED", "true").lower() == "true"
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", os.path.join(DATA_DIR, "image_cache"))
+IMAGE_CACHE_MEMORY_BYTES = int(os.getenv("IMAGE_CACHE_MEMORY_BYTES", str(256 * 1024 * 1024)))
+IMAGE_CACHE_DISK_BYTES = int(os.getenv("IMAGE_CACHE_DISK_BYTES", str(10 * 1024 * 1024 * 1024)))
+IMAGE_CACHE_FRESH_SECONDS = float(os.getenv("IMAGE_CACHE_FRESH_SECONDS", "3600"))  # cap on heuristic freshness (no max-age/Expires)
+
+# Garment description cache
+DESCRIPTION_CACHE_ENABLED = os.getenv("DESCRIPTION_CACHE_ENABLED", "true").lower() == "true"
+DESCRIPTION_CACHE_DB_PATH = os.getenv("DESCRIPTION_CACHE_DB_PATH", os.path.join(DATA_DIR, "descriptions.sqlite3"))
+DESCRIPTION_CACHE_TTL_SECONDS = float(os.getenv("DESCRIPTION_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+
+# Adaptive limit on concurrent Modal batch requests (AIMD)
+MODAL_INITIAL_CONCURRENCY = int(os.getenv("MODAL_INITIAL_CONCURRENCY", "2"))
+MODAL_MIN_CONCURRENCY = int(os.getenv("MODAL_MIN_CONCURRENCY", "1"))
+MODAL_MAX_CONCURRENCY = int(os.getenv("MODAL_MAX_CONCURRENCY", "16"))
+MODAL_LATENCY_TARGET_PER_GARMENT = float(os.getenv("MODAL_LATENCY_TARGET_PER_GARMENT", "180"))  # seconds
+MODAL_STREAMING = os.getenv("MODAL_STREAMING", "true").lower() == "true"  # per-garment streamed results
+
+# Hedged requests, retries and circuit breaker for Modal batch calls
+MODAL_HEDGE_ENABLED = os.getenv("MODAL_HEDGE_ENABLED", "true").lower() == "true"
+MODAL_HEDGE_PERCENTILE = float(os.getenv("MODAL_HEDGE_PERCENTILE", "95"))  # of recent latencies
+MODAL_HEDGE_MIN_SAMPLES = int(os.getenv("MODAL_HEDGE_MIN_SAMPLES", "20"))  # no hedging before this many
+MODAL_HEDGE_HISTORY = int(os.getenv("MODAL_HEDGE_HISTORY", "200"))  # latencies kept
+MODAL_MAX_ATTEMPTS = int(os.getenv("MODAL_MAX_ATTEMPTS", "3"))  # per batch, including the first
+MODAL_RETRY_BACKOFF = float(os.getenv("MODAL_RETRY_BACKOFF", "2.0"))  # seconds, doubled per retry, jittered
+MODAL_GARMENT_RETRY_BUDGET = int(os.getenv("MODAL_GARMENT_RETRY_BUDGET", "4"))  # failed garments resubmitted per job
+MODAL_BATCH_TARGET_SECONDS = float(os.getenv("MODAL_BATCH_TARGET_SECONDS", "240"))  # aimed-for request duration
+MODAL_BATCH_MAX_SIZE = int(os.getenv("MODAL_BATCH_MAX_SIZE", "6"))  # garments per request
+MODAL_BATCH_DEFAULT_SIZE = int(os.getenv("MODAL_BATCH_DEFAULT_SIZE", "2"))  # until enough timings are known
+MODAL_BATCH_MIN_SAMPLES = int(os.getenv("MODAL_BATCH_MIN_SAMPLES", "10"))  # timings needed to fit the model
+JOB_DEADLINE_SECONDS = float(os.getenv("JOB_DEADLINE_SECONDS", "1800"))  # no Modal retries after this
+MODAL_BREAKER_FAILURES = int(os.getenv("MODAL_BREAKER_FAILURES", "5"))  # consecutive, to open the circuit
+MODAL_BREAKER_RESET_SECONDS = float(os.getenv("MODAL_BREAKER_RESET_SECONDS", "30"))  # before a probe
+
+# Gateway-side input normalisation before upload to the GPU worker
+GATEWAY_PREPROCESS = os.getenv("GATEWAY_PREPROCESS", "false").lower() == "true"
+TRANSPORT_FORMATS = [f.strip().lower() for f in os.getenv("TRANSPORT_FORMATS", "webp,jpeg").split(",") if f.strip()]
+TRANSPORT_QUALITY = int(os.getenv("TRANSPORT_QUALITY", "90"))
+WORKER_LIMITS_TTL_SECONDS = float(os.getenv("WORKER_LIMITS_TTL_SECONDS", "300"))
+WORKER_LIMITS_RETRY_SECONDS = float(os.getenv("WORKER_LIMITS_RETRY_SECONDS", "15"))  # after a failed fetch
+
+# Cloudinary upload pipeline
+CLOUDINARY_CONCURRENCY = int(os.getenv("CLOUDINARY_CONCURRENCY", "8"))
+CLOUDINARY_OUTPUT_FORMAT = os.getenv("CLOUDINARY_OUTPUT_FORMAT", "png").lower()  # png, webp or jpg (jpeg accepted)
+CLOUDINARY_MAX_ATTEMPTS = int(os.getenv("CLOUDINARY_MAX_ATTEMPTS", "3"))
+CLOUDINARY_RETRY_BACKOFF = float(os.getenv("CLOUDINARY_RETRY_BACKOFF", "1.0"))  # seconds, doubled per retry
+
+# Email outbox (persistent queue drained by a background sender)
+EMAIL_OUTBOX_DB_PATH = os.getenv("EMAIL_OUTBOX_DB_PATH", os.path.join(DATA_DIR, "email_outbox.sqlite3"))
+EMAIL_SENDER_COUNT = int(os.getenv("EMAIL_SENDER_COUNT", "2"))
+EMAIL_BATCH_SIZE = min(100, int(os.getenv("EMAIL_BATCH_SIZE", "50")))  # Resend accepts up to 100 per batch
+EMAIL_MAX_ATTEMPTS = int(os.getenv("EMAIL_MAX_ATTEMPTS", "5"))
+EMAIL_RATE_LIMIT_PER_SECOND = float(os.getenv("EMAIL_RATE_LIMIT_PER_SECOND", "2"))  # Resend API requests
+EMAIL_RETRY_BACKOFF = float(os.getenv("EMAIL_RETRY_BACKOFF", "30"))  # seconds, doubled per retry
+
+# Try-on result cache (content hash -> uploaded Cloudinary URL)
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "true").lower() == "true"
+RESULT_CACHE_DB_PATH = os.getenv("RESULT_CACHE_DB_PATH", os.path.join(DATA_DIR, "result_cache.sqlite3"))
+RESULT_CACHE_TTL_SECONDS = float(os.getenv("RESULT_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "100000"))
+RESULT_CACHE_MODEL_VERSION = os.getenv("RESULT_CACHE_MODEL_VERSION", "")  # overrides the worker-reported version
+
+# Priority scheduling of GPU batches between subscription tiers
+SCHEDULER_TIER_WEIGHTS = {
+    tier.strip(): float(weight)
+    for tier, weight in (item.split(":") for item in os.getenv("SCHEDULER_TIER_WEIGHTS", "premium:4,trial:1").split(",") if item.strip())
+}
+SCHEDULER_PER_USER_CONCURRENCY = int(os.getenv("SCHEDULER_PER_USER_CONCURRENCY", "4"))  # Modal batches per user
+SCHEDULER_MAX_WAIT_SECONDS = float(os.getenv("SCHEDULER_MAX_WAIT_SECONDS", "120"))  # starvation protection
+JOB_PRIORITY_BOOST_SECONDS = float(os.getenv("JOB_PRIORITY_BOOST_SECONDS", "300"))  # head start of premium jobs
+
+# Admission control for the try-on endpoint
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+ADMISSION_KEY_RATE = float(os.getenv("ADMISSION_KEY_RATE", "10"))  # requests per second per API key
+ADMISSION_KEY_BURST = float(os.getenv("ADMISSION_KEY_BURST", "50"))
+ADMISSION_USER_RATE = float(os.getenv("ADMISSION_USER_RATE", "0.1"))  # requests per second per user
+ADMISSION_USER_BURST = float(os.getenv("ADMISSION_USER_BURST", "5"))
+ADMISSION_MAX_PENDING_GARMENTS = int(os.getenv("ADMISSION_MAX_PENDING_GARMENTS", "500"))
+ADMISSION_SLA_SECONDS = float(os.getenv("ADMISSION_SLA_SECONDS", "3600"))  # reject jobs estimated to finish later
+ADMISSION_THROUGHPUT_WINDOW_SECONDS = float(os.getenv("ADMISSION_THROUGHPUT_WINDOW_SECONDS", "900"))
+ADMISSION_MIN_THROUGHPUT_SAMPLES = int(os.getenv("ADMISSION_MIN_THROUGHPUT_SAMPLES", "10"))  # garments
+
+# Tracing (W3C trace context; spans exported as OTLP/JSON)
+TRACE_ENABLED = os.getenv("TRACE_ENABLED", "true").lower() == "true"
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH", "")  # e.g. data/traces.jsonl; "" writes no file
+TRACE_EXPORT_MAX_BYTES = int(os.getenv("TRACE_EXPORT_MAX_BYTES", str(100 * 1024 * 1024)))  # then rotated
+TRACE_EXPORT_BACKUPS = int(os.getenv("TRACE_EXPORT_BACKUPS", "3"))  # rotated files kept (.1 is the newest)
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "")  # e.g. http://localhost:4318 (OTLP/HTTP JSON)
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "tryon-gateway")
+
+# Logging (records are queued and written by a background thread)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # "text" or "json"
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))  # records beyond this are dropped, not blocked on
+# Fraction of INFO/DEBUG records kept per logger, e.g. "services.image_service:0.1,services.cloudinary_service:0.5"
+LOG_SAMPLE_RATES = {
+    name.strip(): float(rate)
+    for name, rate in (item.split(":") for item in os.getenv("LOG_SAMPLE_RATES", "").split(",") if item.strip())
+}
+
+# Vendor SDKs (openai, cloudinary, resend, PIL) load on first use; warm them up in the background after startup
+SDK_WARMUP_ENABLED = os.getenv("SDK_WARMUP_ENABLED", "true").lower() == "true"
@@ -1,74 +1,177 @@
 """FastAPI application entry point"""
-from fastapi import FastAPI, HTTPException, Request, BackgroundTasks, Depends
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, HTTPException, Request, Depends
+from fastapi.responses import JSONResponse, Response
 from fastapi.exceptions import RequestValidationError
+from contextlib import asynccontextmanager
+import asyncio
 import uvicorn
 import logging
 from pathlib import Path
 import traceback
 
 # Import schemas
-from schemas import TryOnRequest
+from schemas import TryOnRequest, JobStatusResponse
 
 # Import utilities
-from utils.auth import verify_api_key
+from utils.auth import verify_api_key, get_api_key
 
 # Import actions
 from actions.tryon_actions import process_and_send_email
 
-# Setup logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Import job queue and shared HTTP clients
+from services.job_service import JobQueue, JobStore
+from services.http_client_service import start_http_clients, close_http_clients, get_http_client_stats
+from services.image_cache_service import get_image_cache_stats
+from services.description_cache_service import get_description_cache_stats
+from services.modal_service import modal_batch_sizer, modal_limiter, modal_scheduler, get_modal_resilience_stats
+from services.email_outbox_service import get_email_outbox, get_email_outbox_stats
+from services.tryon_service import coalesce_stats
+from services.result_cache_service import get_result_cache_stats
+from services.admission_service import AdmissionController
+from services.metrics_service import METRICS_CONTENT_TYPE, render_metrics
+from utils.tracing import start_span, traceparent, shutdown_tracing
+from utils.logging_config import configure_logging, get_logging_stats
+from utils.warmup import warm_up, warmup_state
+from config import JOB_DB_PATH, JOB_WORKER_COUNT, JOB_MAX_ATTEMPTS, JOB_PRIORITY_BOOST_SECONDS, ADMISSION_ENABLED, SDK_WARMUP_ENABLED
+
+# Setup logging (queued; written by a background thread)
+configure_logging()
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+job_queue = JobQueue(
+    JobStore(JOB_DB_PATH),
+    process_and_send_email,
+    worker_count=JOB_WORKER_COUNT,
+    max_attempts=JOB_MAX_ATTEMPTS,
+    priority_boost=JOB_PRIORITY_BOOST_SECONDS,
+)
+
+admission = AdmissionController(job_queue)
+
+# Job priority per subscription type (premium jobs are claimed ahead of trial ones)
+JOB_PRIORITIES = {"trial": 0, "premium": 1}
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open shared HTTP clients and start the email sender and try-on worker pool; tear down in reverse.
+
+    Vendor SDKs are imported in the background once the app is serving (see utils.warmup)."""
+    app.state.http_clients = await start_http_clients()
+    await get_email_outbox().start()
+    await job_queue.start()
+    warmup = asyncio.create_task(warm_up()) if SDK_WARMUP_ENABLED else None
+    yield
+    if warmup is not None:
+        warmup.cancel()
+    await job_queue.stop()
+    await get_email_outbox().stop()
+    await close_http_clients()
+    shutdown_tracing()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Create output directory for processed images (temporary, before Cloudinary upload)
 OUTPUT_DIR = Path("processed_images")
 OUTPUT_DIR.mkdir(exist_ok=True)
 
+@app.get("/health")
+async def health():
+    """Liveness check (no API key); `warm` turns true once the vendor SDKs are loaded"""
+    return {"status": "healthy", "warm": warmup_state["done"]}
+
+
 # Route for endpoint
 @app.post("/api/v1/tryon")
 async def virtual_tryon(
     request: TryOnRequest, 
-    background_tasks: BackgroundTasks,
-    verified: bool = Depends(verify_api_key)
+    verified: bool = Depends(verify_api_key),
+    api_key: str = Depends(get_api_key)
 ):
     """Unified try-on endpoint - accepts subscription type and collection"""
-    # Log request details
-    logger.info(f"TRY-ON ENDPOINT HIT")
-    logger.info(f"User ID: {request.user_id}")
-    logger.info(f"User Email: {request.email}")
-    logger.info(f"Subscription Type: {request.subscription_type}")
-    logger.info(f"Collection: {request.collection}")
-    logger.info(f"Person Image URL: {request.person_image}")
-    logger.info(f"Garment Images ({len(request.garment_images)}):")
-    for product_id, image_url in request.garment_images.items():
-        logger.info(f"  - Product ID: {product_id}, Image URL: {image_url}")
-    
-    # Return success immediately (fire and forget)
-    # Processing will happen in background and email will be sent when done
-    background_tasks.add_task(
-        process_and_send_email,
-        request.user_id,
-        request.email,
-        request.garment_images,
-        request.person_image,
-        request.subscription_type,
-        request.collection
+    # Log request details (one line; the per-garment URLs only at DEBUG)
+    logger.info(
+        "Try-on request: user=%s email=%s subscription=%s collection=%s garments=%d person_image=%s",
+        request.user_id, request.email, request.subscription_type, request.collection,
+        len(request.garment_images), request.person_image,
     )
+    if logger.isEnabledFor(logging.DEBUG):
+        for product_id, image_url in request.garment_images.items():
+            logger.debug("  - Product ID: %s, Image URL: %s", product_id, image_url)
+    
+    # Root span of the job's trace; the queued job, its stages and the GPU worker continue it
+    with start_span("POST /api/v1/tryon", user_id=request.user_id, garments=len(request.garment_images)) as span:
+        payload = {
+            "user_id": request.user_id,
+            "email": request.email,
+            "garment_images": request.garment_images,
+            "person_image": request.person_image,
+            "subscription_type": request.subscription_type,
+            "collection": request.collection,
+        }
+        # Persist the job and return immediately
+        # A queue worker will process it and send the email when done
+        options = {
+            "priority": JOB_PRIORITIES.get(request.subscription_type, 0),
+            "cost": len(request.garment_images),
+            "traceparent": traceparent(),
+        }
+        if ADMISSION_ENABLED:
+            # Reject (429/503 with Retry-After) instead of queueing work that would finish hours late
+            job_id, _ = await admission.submit(api_key, request.user_id, payload, **options)
+        else:
+            job_id, _ = await job_queue.submit(payload, **options)
+        if span is not None:
+            span.set_attribute("job_id", job_id)
+    logger.info("Queued try-on job: %s", job_id)
     
     return {
         "success": True,
         "message": "Request received. Processing in background. You will receive an email with results shortly.",
+        "job_id": job_id,
         "user_id": request.user_id,
         "subscription_type": request.subscription_type,
         "collection": request.collection
     }
 
 
+@app.get("/api/v1/jobs/{job_id}", response_model=JobStatusResponse)
+async def get_job_status(job_id: str, verified: bool = Depends(verify_api_key)):
+    """Report the state and per-stage timings of a try-on job"""
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.get("/api/v1/stats")
+async def get_stats(verified: bool = Depends(verify_api_key)):
+    """Report runtime counters (deduplication, HTTP connection reuse, cache hits)"""
+    return {
+        "job_queue": job_queue.snapshot(),
+        "admission": admission.snapshot(),
+        "tryon_coalescing": coalesce_stats,
+        "http_clients": get_http_client_stats(),
+        "image_cache": get_image_cache_stats(),
+        "description_cache": get_description_cache_stats(),
+        "result_cache": get_result_cache_stats(),
+        "modal_limiter": modal_limiter.snapshot(),
+        "modal_scheduler": modal_scheduler.snapshot(),
+        "modal_resilience": get_modal_resilience_stats(),
+        "modal_batching": modal_batch_sizer.snapshot(),
+        "email_outbox": get_email_outbox_stats(),
+        "logging": get_logging_stats(),
+        "sdk_warmup": warmup_state,
+    }
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics (stage latency histograms, queue depth, bytes, cache and error counters)"""
+    return Response(content=await render_metrics(job_queue), media_type=METRICS_CONTENT_TYPE)
+
+
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
     logger.error(f"Validation error: {exc.errors()}")
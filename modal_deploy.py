@@ -6,6 +6,7 @@ Models are cached in a Modal Volume to avoid re-downloading.
 
 from pathlib import Path
 import modal
+from tryon_worker import TryOnWorker, pil_to_binary_mask
 
 def ignore_local_file(path: Path) -> bool:
     # Skip uploading local checkpoint folders so build-time downloads remain
@@ -99,6 +100,8 @@ image = (
         "wget -q https://huggingface.co/spaces/yisol/IDM-VTON/resolve/main/ckpt/openpose/ckpts/body_pose_model.pth -O body_pose_model.pth",
     )
     .add_local_dir(".", remote_path="/root/IDM-VTON", ignore=ignore_local_file)
+    # Importable before load_models() puts /root/IDM-VTON on sys.path
+    .add_local_python_source("tryon_worker")
 )
 
 @app.cls(
@@ -109,7 +112,7 @@ image = (
     volumes={"/models": model_volume},
     container_idle_timeout=300,
 )
-class TryOnModel:
+class TryOnModel(TryOnWorker):
     """Model class that loads models once on container startup."""
     
     @modal.enter()
@@ -118,11 +121,9 @@ class TryOnModel:
         import sys
         import os
         import torch
-        from PIL import Image
         from typing import List
         from torchvision import transforms
         from torchvision.transforms.functional import to_pil_image
-        import numpy as np
         from ultralytics import YOLO
 
         # Set HuggingFace cache to volume for persistence
@@ -172,19 +173,6 @@ class TryOnModel:
         # Change to project directory
         os.chdir("/root/IDM-VTON")
 
-        def pil_to_binary_mask(pil_image, threshold=0):
-            np_image = np.array(pil_image)
-            grayscale_image = Image.fromarray(np_image).convert("L")
-            binary_mask = np.array(grayscale_image) > threshold
-            mask = np.zeros(binary_mask.shape, dtype=np.uint8)
-            for i in range(binary_mask.shape[0]):
-                for j in range(binary_mask.shape[1]):
-                    if binary_mask[i, j] == True:
-                        mask[i, j] = 1
-            mask = (mask * 255).astype(np.uint8)
-            output_mask = Image.fromarray(mask)
-            return output_mask
-
         # Load models from HuggingFace (will use cache from volume if available)
         base_path = "yisol/IDM-VTON"
         print("Loading models from HuggingFace (using volume cache if available)...")
@@ -307,471 +295,7 @@ class TryOnModel:
 
         print("Models loaded successfully! Volume cache will persist across deployments.")
 
-    def _compute_target_size(self, region_size):
-        """Compute model resolution (multiples of 8) that preserves region aspect ratio."""
-        width, height = region_size
-        if width <= 0 or height <= 0:
-            return self.default_size
-
-        long_side = max(width, height)
-        scale = self.max_process_side / float(long_side)
-        scaled_w = width * scale
-        scaled_h = height * scale
-
-        target_width = max(64, int(round(scaled_w / 8.0)) * 8)
-        target_height = max(64, int(round(scaled_h / 8.0)) * 8)
-        return target_width, target_height
-
-    def _auto_crop_with_yolo(self, image):
-        """Detect the person with YOLO and return a tight crop plus metadata."""
-        import numpy as np
-
-        if not hasattr(self, "person_detector"):
-            return None
-
-        np_image = np.array(image.convert("RGB"))[:, :, ::-1]  # RGB -> BGR for YOLO
-        results = self.person_detector.predict(
-            source=np_image,
-            classes=[0],  # person class
-            conf=self.detector_confidence,
-            verbose=False,
-            device=self.device,
-        )
-
-        if not results:
-            return None
-
-        boxes = results[0].boxes
-        if boxes is None or boxes.xyxy is None or boxes.xyxy.shape[0] == 0:
-            return None
-
-        confidences = boxes.conf.detach().cpu().numpy()
-        best_idx = int(confidences.argmax())
-        x1, y1, x2, y2 = boxes.xyxy[best_idx].detach().cpu().numpy()
-
-        width, height = image.size
-        margin = 0.08
-        box_w = x2 - x1
-        box_h = y2 - y1
-        if box_w <= 0 or box_h <= 0:
-            return None
-
-        x1 -= box_w * margin
-        y1 -= box_h * margin
-        x2 += box_w * margin
-        y2 += box_h * margin
-
-        x1 = max(0, x1)
-        y1 = max(0, y1)
-        x2 = min(width, x2)
-        y2 = min(height, y2)
-
-        if (x2 - x1) < 10 or (y2 - y1) < 10:
-            return None
-
-        crop_box = (
-            int(round(x1)),
-            int(round(y1)),
-            int(round(x2)),
-            int(round(y2)),
-        )
-        cropped = image.crop(crop_box)
-
-        return cropped, {
-            "left": crop_box[0],
-            "top": crop_box[1],
-            "right": crop_box[2],
-            "bottom": crop_box[3],
-            "crop_size": cropped.size,
-            "original": image.copy(),
-        }
-
-    def preprocess_human_image(self, dict, is_checked, is_checked_crop):
-        """Preprocess human image once - segmentation, pose, mask (reusable for batch)."""
-        from PIL import Image
-        from torchvision.transforms.functional import to_pil_image
-        
-        human_img_orig = dict["background"].convert("RGB")
-        crop_info = None
-        work_img = human_img_orig
-
-        if is_checked_crop:
-            yolo_result = self._auto_crop_with_yolo(human_img_orig)
-            if yolo_result:
-                work_img, crop_info = yolo_result
-            else:
-                width, height = human_img_orig.size
-                target_width = int(min(width, height * (3 / 4)))
-                target_height = int(min(height, width * (4 / 3)))
-                left = (width - target_width) / 2
-                top = (height - target_height) / 2
-                right = (width + target_width) / 2
-                bottom = (height + target_height) / 2
-                work_img = human_img_orig.crop((left, top, right, bottom))
-                crop_info = {
-                    "left": left,
-                    "top": top,
-                    "right": right,
-                    "bottom": bottom,
-                    "crop_size": work_img.size,
-                    "original": human_img_orig.copy(),
-                }
-
-            if crop_info and "original" not in crop_info:
-                crop_info["original"] = human_img_orig.copy()
-
-        target_size = self._compute_target_size(work_img.size)
-        human_img = work_img.resize(target_size)
-        if crop_info:
-            crop_info["crop_size"] = work_img.size
-
-        if is_checked:
-            keypoints = self.openpose_model(human_img.resize((384, 512)))
-            model_parse, _ = self.parsing_model(human_img.resize((384, 512)))
-            mask, mask_gray = self.get_mask_location(
-                "hd", "upper_body", model_parse, keypoints
-            )
-            mask = mask.resize(target_size)
-        else:
-            if dict.get("layers") and len(dict["layers"]) > 0:
-                mask = self.pil_to_binary_mask(
-                    dict["layers"][0].convert("RGB").resize(target_size)
-                )
-            else:
-                # Fallback: create a simple mask if no layers provided
-                mask = Image.new("L", target_size, 255)
-
-        mask_gray = (1 - self.tensor_transform(mask)) * self.tensor_transform(human_img)
-        mask_gray = to_pil_image((mask_gray + 1.0) / 2.0)
-
-        # DensePose processing (expensive - only do once)
-        human_img_arg = self._apply_exif_orientation(human_img.resize((384, 512)))
-        human_img_arg = self.convert_PIL_to_numpy(human_img_arg, format="BGR")
-
-        args = self.apply_net.create_argument_parser().parse_args(
-            (
-                "show",
-                "./configs/densepose_rcnn_R_50_FPN_s1x.yaml",
-                "./ckpt/densepose/model_final_162be9.pkl",
-                "dp_segm",
-                "-v",
-                "--opts",
-                "MODEL.DEVICE",
-                "cuda",
-            )
-        )
-        pose_img = args.func(args, human_img_arg)
-        pose_img = pose_img[:, :, ::-1]
-        pose_img = Image.fromarray(pose_img).resize(target_size)
-
-        return {
-            "human_img": human_img,
-            "mask": mask,
-            "mask_gray": mask_gray,
-            "pose_img": pose_img,
-            "crop_info": crop_info,
-            "target_size": target_size,
-        }
-
-    def run_diffusion_only(self, preprocessed_data, garm_img, garment_des, denoise_steps, seed):
-        """Run only the diffusion part with pre-processed human data."""
-        import torch
-        from PIL import Image
-        
-        self.openpose_model.preprocessor.body_estimation.model.to(self.device)
-        self.pipe.to(self.device)
-        self.pipe.unet_encoder.to(self.device)
-
-        target_size = preprocessed_data.get("target_size", self.default_size)
-        garm_img = garm_img.convert("RGB").resize(target_size)
-        human_img = preprocessed_data["human_img"]
-        mask = preprocessed_data["mask"]
-        pose_img = preprocessed_data["pose_img"]
-        crop_info = preprocessed_data["crop_info"]
-
-        with torch.no_grad():
-            with torch.cuda.amp.autocast():
-                print(f"[run_diffusion_only] Using garment description: {garment_des[:150]}..." if len(garment_des) > 150 else f"[run_diffusion_only] Using garment description: {garment_des}")
-                prompt = "a beautiful female model wearing " + garment_des + ", professional fashion photography, high quality"
-                print(f"[run_diffusion_only] Generated prompt: {prompt[:200]}..." if len(prompt) > 200 else f"[run_diffusion_only] Generated prompt: {prompt}")
-                negative_prompt = (
-                    "monochrome, lowres, bad anatomy, worst quality, low quality, deformed, distorted, blurry"
-                )
-                with torch.inference_mode():
-                    (
-                        prompt_embeds,
-                        negative_prompt_embeds,
-                        pooled_prompt_embeds,
-                        negative_pooled_prompt_embeds,
-                    ) = self.pipe.encode_prompt(
-                        prompt,
-                        num_images_per_prompt=1,
-                        do_classifier_free_guidance=True,
-                        negative_prompt=negative_prompt,
-                    )
-
-                    prompt = "a high quality photo of " + garment_des + ", fashion photography, detailed texture"
-                    print(f"[run_diffusion_only] Generated cloth prompt: {prompt[:200]}..." if len(prompt) > 200 else f"[run_diffusion_only] Generated cloth prompt: {prompt}")
-                    negative_prompt = (
-                        "monochrome, lowres, bad anatomy, worst quality, low quality, deformed, distorted, blurry"
-                    )
-                    if not isinstance(prompt, self.List):
-                        prompt = [prompt] * 1
-                    if not isinstance(negative_prompt, self.List):
-                        negative_prompt = [negative_prompt] * 1
-                    with torch.inference_mode():
-                        (
-                            prompt_embeds_c,
-                            _,
-                            _,
-                            _,
-                        ) = self.pipe.encode_prompt(
-                            prompt,
-                            num_images_per_prompt=1,
-                            do_classifier_free_guidance=False,
-                            negative_prompt=negative_prompt,
-                        )
-
-                    pose_img_tensor = (
-                        self.tensor_transform(pose_img).unsqueeze(0).to(self.device, torch.float16)
-                    )
-                    garm_tensor = (
-                        self.tensor_transform(garm_img).unsqueeze(0).to(self.device, torch.float16)
-                    )
-                    print(f"[run_diffusion_only] Using seed: {seed}")
-                    generator = (
-                        torch.Generator(self.device).manual_seed(int(seed))
-                        if seed is not None and seed >= 0
-                        else None
-                    )
-                    if generator:
-                        print(f"[run_diffusion_only] Generator initialized with seed {seed}")
-                    else:
-                        print(f"[run_diffusion_only] Using random seed (generator=None)")
-                    images = self.pipe(
-                        prompt_embeds=prompt_embeds.to(self.device, torch.float16),
-                        negative_prompt_embeds=negative_prompt_embeds.to(
-                            self.device, torch.float16
-                        ),
-                        pooled_prompt_embeds=pooled_prompt_embeds.to(
-                            self.device, torch.float16
-                        ),
-                        negative_pooled_prompt_embeds=negative_pooled_prompt_embeds.to(
-                            self.device, torch.float16
-                        ),
-                        num_inference_steps=int(denoise_steps),
-                        generator=generator,
-                        strength=1.0,
-                        pose_img=pose_img_tensor.to(self.device, torch.float16),
-                        text_embeds_cloth=prompt_embeds_c.to(self.device, torch.float16),
-                        cloth=garm_tensor.to(self.device, torch.float16),
-                        mask_image=mask,
-                        image=human_img,
-                        height=int(target_size[1]),
-                        width=int(target_size[0]),
-                        ip_adapter_image=garm_img,
-                        guidance_scale=2.0,
-                    )[0]
-
-        if crop_info:
-            out_img = images[0].resize(crop_info["crop_size"])
-            crop_info["original"].paste(out_img, (int(crop_info["left"]), int(crop_info["top"])))
-            return crop_info["original"]
-        else:
-            return images[0]
-
-    def start_tryon(
-        self, dict, garm_img, garment_des, is_checked, is_checked_crop, denoise_steps, seed
-    ):
-        """Run the try-on pipeline (full process - for single requests)."""
-        preprocessed = self.preprocess_human_image(dict, is_checked, is_checked_crop)
-        output_image = self.run_diffusion_only(preprocessed, garm_img, garment_des, denoise_steps, seed)
-        return output_image, preprocessed["mask_gray"]
-
-
     @modal.asgi_app()
     def api(self):
         """FastAPI app that accepts file uploads and returns actual image files."""
-        from fastapi import FastAPI, File, UploadFile, Form, HTTPException
-        from fastapi.responses import Response
-        from PIL import Image
-        from io import BytesIO
-
-        api_app = FastAPI(title="IDM-VTON API", version="1.0.0")
-
-        @api_app.post("/tryon")
-        async def run_tryon(
-            human_image: UploadFile = File(..., description="Human image file (required)"),
-            garment_image: UploadFile = File(..., description="Garment image file (required)"),
-            garment_description: str = Form(None, description="Text description of the garment (optional)"),
-            auto_mask: bool = Form(None, description="Use auto-generated mask (optional, defaults to True)"),
-            auto_crop: bool = Form(None, description="Auto-crop and resize the human image (optional, defaults to False)"),
-            denoise_steps: int = Form(None, ge=20, le=40, description="Denoising steps (optional, defaults to 30)"),
-            seed: int = Form(None, ge=-1, description="Random seed (optional, defaults to 42)"),
-            mask_image: UploadFile = File(None, description="Optional mask image (only used when auto_mask is false)"),
-        ):
-            try:
-                # Apply defaults for optional parameters
-                garment_desc = garment_description if garment_description else "a beautiful sweater, professional fashion photography, high quality"
-                use_auto_mask = auto_mask if auto_mask is not None else True
-                use_auto_crop = auto_crop if auto_crop is not None else False
-                steps = denoise_steps if denoise_steps is not None else 30
-                use_seed = seed if seed is not None else 42
-                
-                # Read uploaded images
-                human_img_data = await human_image.read()
-                garment_img_data = await garment_image.read()
-                
-                human_img = Image.open(BytesIO(human_img_data)).convert("RGB")
-                garment_img = Image.open(BytesIO(garment_img_data)).convert("RGB")
-
-                input_dict = {"background": human_img}
-                
-                # Handle optional mask image (only if auto_mask is False)
-                if not use_auto_mask and mask_image and mask_image.filename:
-                    mask_img_data = await mask_image.read()
-                    mask_img = Image.open(BytesIO(mask_img_data)).convert("RGB")
-                    input_dict["layers"] = [mask_img]
-
-                # Run try-on using the shared model instance
-                output_image, _ = self.start_tryon(
-                    input_dict,
-                    garment_img,
-                    garment_desc,
-                    use_auto_mask,
-                    use_auto_crop,
-                    steps,
-                    use_seed,
-                )
-
-                # Return output image as PNG (no mask)
-                output_buffer = BytesIO()
-                output_image.save(output_buffer, format="PNG")
-                output_buffer.seek(0)
-                
-                return Response(
-                    content=output_buffer.getvalue(),
-                    media_type="image/png",
-                    headers={"Content-Disposition": "attachment; filename=output.png"}
-                )
-
-            except Exception as e:
-                raise HTTPException(status_code=500, detail=f"Error processing request: {str(e)}")
-
-        @api_app.post("/tryon/batch")
-        async def run_tryon_batch(
-            human_image: UploadFile = File(..., description="Human image file (required)"),
-            garment_images: list[UploadFile] = File(..., description="Multiple garment image files (required)"),
-            garment_descriptions: str = Form(None, description="Comma-separated descriptions for each garment, or JSON array like '[\"desc1\", \"desc2\"]' (optional)"),
-            auto_mask: bool = Form(None, description="Use auto-generated mask (optional, defaults to True)"),
-            auto_crop: bool = Form(None, description="Auto-crop and resize the human image (optional, defaults to False)"),
-            denoise_steps: int = Form(None, ge=20, le=40, description="Denoising steps (optional, defaults to 30)"),
-            seed: int = Form(None, ge=-1, description="Random seed (optional, defaults to 42)"),
-            mask_image: UploadFile = File(None, description="Optional mask image (only used when auto_mask is false)"),
-        ):
-            """Process one person image with multiple garment images and return all results.
-            OPTIMIZED: Preprocesses person image once, then runs diffusion for each garment."""
-            import zipfile
-            import json
-            
-            try:
-                # Apply defaults for optional parameters
-                use_auto_mask = auto_mask if auto_mask is not None else True
-                use_auto_crop = auto_crop if auto_crop is not None else False
-                steps = denoise_steps if denoise_steps is not None else 30
-                use_seed = seed if seed is not None else 42
-                print(f"Received parameters: seed={use_seed}, denoise_steps={steps}, auto_mask={use_auto_mask}, auto_crop={use_auto_crop}")
-                
-                # Read human image once
-                human_img_data = await human_image.read()
-                human_img = Image.open(BytesIO(human_img_data)).convert("RGB")
-                
-                input_dict = {"background": human_img}
-                
-                # Handle optional mask image (only if auto_mask is False)
-                if not use_auto_mask and mask_image and mask_image.filename:
-                    mask_img_data = await mask_image.read()
-                    mask_img = Image.open(BytesIO(mask_img_data)).convert("RGB")
-                    input_dict["layers"] = [mask_img]
-
-                # PREPROCESS HUMAN IMAGE ONCE (expensive operations: segmentation, pose, mask)
-                # This saves significant time and processing power for batch requests
-                print(f"Preprocessing human image once for {len(garment_images)} garments...")
-                preprocessed_data = self.preprocess_human_image(input_dict, use_auto_mask, use_auto_crop)
-                print("Human image preprocessing complete. Processing garments...")
-
-                # Parse garment descriptions if provided
-                # Supports both comma-separated string and JSON array format
-                descriptions_list = None
-                if garment_descriptions:
-                    print(f"Received garment_descriptions parameter: {garment_descriptions[:200]}..." if len(garment_descriptions) > 200 else f"Received garment_descriptions parameter: {garment_descriptions}")
-                    try:
-                        # Try parsing as JSON array first (handles descriptions with commas)
-                        descriptions_list = json.loads(garment_descriptions)
-                        if not isinstance(descriptions_list, list):
-                            raise ValueError("JSON must be an array")
-                        print(f"Successfully parsed {len(descriptions_list)} descriptions from JSON")
-                        for idx, desc in enumerate(descriptions_list):
-                            print(f"  Parsed description {idx + 1}: {desc[:100]}..." if len(desc) > 100 else f"  Parsed description {idx + 1}: {desc}")
-                    except (json.JSONDecodeError, ValueError) as e:
-                        print(f"Failed to parse as JSON, trying comma-separated: {e}")
-                        # Fall back to comma-separated string
-                        descriptions_list = [desc.strip() for desc in garment_descriptions.split(",")]
-                        print(f"Parsed {len(descriptions_list)} descriptions from comma-separated string")
-                else:
-                    print("No garment_descriptions provided, will use defaults")
-                
-                # Process each garment image (only diffusion, no re-preprocessing)
-                zip_buffer = BytesIO()
-                with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                    for idx, garment_file in enumerate(garment_images):
-                        try:
-                            # Read garment image
-                            garment_img_data = await garment_file.read()
-                            garment_img = Image.open(BytesIO(garment_img_data)).convert("RGB")
-                            
-                            # Get description for this garment
-                            if descriptions_list and idx < len(descriptions_list):
-                                garment_desc = descriptions_list[idx]
-                                print(f"Using provided description for garment {idx + 1}: {garment_desc[:100]}..." if len(garment_desc) > 100 else f"Using provided description for garment {idx + 1}: {garment_desc}")
-                            else:
-                                garment_desc = "a beautiful sweater, professional fashion photography, high quality"  # Default if no description provided
-                                print(f"Using DEFAULT description for garment {idx + 1} (no description provided or index out of range)")
-                            
-                            # Run ONLY diffusion (human image already preprocessed)
-                            print(f"Processing garment {idx + 1}/{len(garment_images)} with description: {garment_desc[:100]}..." if len(garment_desc) > 100 else f"Processing garment {idx + 1}/{len(garment_images)} with description: {garment_desc}")
-                            output_image = self.run_diffusion_only(
-                                preprocessed_data,
-                                garment_img,
-                                garment_desc,
-                                steps,
-                                use_seed,
-                            )
-                            
-                            # Save to zip with descriptive filename
-                            output_buffer = BytesIO()
-                            output_image.save(output_buffer, format="PNG")
-                            filename = f"output_{idx + 1}_{garment_desc.replace(' ', '_')}.png"
-                            zip_file.writestr(filename, output_buffer.getvalue())
-                            
-                        except Exception as e:
-                            # If one garment fails, continue with others
-                            error_filename = f"error_{idx + 1}.txt"
-                            zip_file.writestr(error_filename, f"Error processing garment {idx + 1}: {str(e)}")
-                
-                zip_buffer.seek(0)
-                
-                return Response(
-                    content=zip_buffer.getvalue(),
-                    media_type="application/zip",
-                    headers={"Content-Disposition": "attachment; filename=tryon_batch_results.zip"}
-                )
-
-            except Exception as e:
-                raise HTTPException(status_code=500, detail=f"Error processing batch request: {str(e)}")
-
-        @api_app.get("/health")
-        async def health():
-            return {"status": "healthy", "models_loaded": True}
-
-        return api_app
+        return self.build_api()
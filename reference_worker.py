@@ -0,0 +1,259 @@
+"""
+CPU reference mode of the IDM-VTON worker: tiny random models, no GPU, no Modal.
+
+Serves the same FastAPI app as the Modal deployment (`TryOnWorker.build_api`),
+with the same preprocessing, batching, encoding and streaming code. The SDXL try-on
+pipeline is replaced by a tiny randomly initialised UNet/VAE/CLIP text encoder
+running a real denoising loop. Human parsing, OpenPose, DensePose and the detectron2
+helpers are stubbed. The output images are noise, but the worker's hot paths and
+data plumbing can be tested and profiled on CI machines:
+
+    pip install torch torchvision diffusers transformers numpy fastapi uvicorn python-multipart Pillow
+    uvicorn reference_worker:app --port 8765
+
+Point the gateway's MODAL_ENDPOINT at it. REFERENCE_MAX_PROCESS_SIDE (default
+1024) sets the model resolution, and REFERENCE_SEED (default 0) the weight
+initialisation.
+"""
+
+import hashlib
+import os
+from types import SimpleNamespace
+from tryon_worker import TryOnWorker, pil_to_binary_mask
+
+REFERENCE_MAX_PROCESS_SIDE = int(os.getenv("REFERENCE_MAX_PROCESS_SIDE", "1024"))
+REFERENCE_SEED = int(os.getenv("REFERENCE_SEED", "0"))
+
+# Tiny text encoder: hashed words instead of a CLIP vocabulary
+TEXT_VOCAB_SIZE = 1000
+TEXT_MAX_TOKENS = 77
+TEXT_PAD_ID, TEXT_BOS_ID, TEXT_EOS_ID = 0, 1, TEXT_VOCAB_SIZE - 1
+TEXT_HIDDEN_SIZE = 32
+
+# UNet input: noisy latents + mask + masked person latents + pose latents + garment features
+LATENT_CHANNELS = 4
+UNET_IN_CHANNELS = LATENT_CHANNELS + 1 + 3 * LATENT_CHANNELS
+
+
+def _build_pipeline(seed):
+    """Tiny stand-in for the IDM-VTON TryonPipeline (same encode_prompt/__call__ interface)."""
+    import torch
+    import torch.nn.functional as F
+    from diffusers import AutoencoderKL, DDPMScheduler, UNet2DConditionModel
+    from torchvision.transforms.functional import to_pil_image, to_tensor
+    from transformers import CLIPTextConfig, CLIPTextModelWithProjection
+
+    class TinyTryonPipeline(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            torch.manual_seed(seed)
+            self.text_encoder = CLIPTextModelWithProjection(CLIPTextConfig(
+                vocab_size=TEXT_VOCAB_SIZE,
+                hidden_size=TEXT_HIDDEN_SIZE,
+                intermediate_size=64,
+                num_hidden_layers=2,
+                num_attention_heads=4,
+                max_position_embeddings=TEXT_MAX_TOKENS,
+                projection_dim=TEXT_HIDDEN_SIZE,
+                pad_token_id=TEXT_PAD_ID,
+                bos_token_id=TEXT_BOS_ID,
+                eos_token_id=TEXT_EOS_ID,  # the pooled embedding is taken at this token
+            ))
+            # Four blocks: latents are 1/8 of the image size, as with the SDXL VAE
+            self.vae = AutoencoderKL(
+                in_channels=3,
+                out_channels=3,
+                down_block_types=("DownEncoderBlock2D",) * 4,
+                up_block_types=("UpDecoderBlock2D",) * 4,
+                block_out_channels=(8, 8, 8, 8),
+                layers_per_block=1,
+                latent_channels=LATENT_CHANNELS,
+                norm_num_groups=4,
+            )
+            self.unet = UNet2DConditionModel(
+                in_channels=UNET_IN_CHANNELS,
+                out_channels=LATENT_CHANNELS,
+                layers_per_block=1,
+                block_out_channels=(32, 64),
+                down_block_types=("DownBlock2D", "CrossAttnDownBlock2D"),
+                up_block_types=("CrossAttnUpBlock2D", "UpBlock2D"),
+                cross_attention_dim=TEXT_HIDDEN_SIZE,
+                attention_head_dim=4,
+                norm_num_groups=8,
+            )
+            # Garment encoder (the real pipeline runs a second UNet over the garment latents)
+            self.unet_encoder = torch.nn.Conv2d(LATENT_CHANNELS, LATENT_CHANNELS, 3, padding=1)
+            self.scheduler = DDPMScheduler(num_train_timesteps=1000)
+
+        def _token_ids(self, prompts):
+            rows = []
+            for prompt in prompts:
+                words = [
+                    2 + int(hashlib.md5(word.encode("utf-8")).hexdigest(), 16) % (TEXT_VOCAB_SIZE - 3)
+                    for word in prompt.lower().split()
+                ][: TEXT_MAX_TOKENS - 2]
+                row = [TEXT_BOS_ID] + words + [TEXT_EOS_ID]
+                rows.append(row + [TEXT_PAD_ID] * (TEXT_MAX_TOKENS - len(row)))
+            return torch.tensor(rows, dtype=torch.long)
+
+        def _encode_text(self, prompts, num_images_per_prompt):
+            output = self.text_encoder(input_ids=self._token_ids(prompts))
+            return (
+                output.last_hidden_state.repeat_interleave(num_images_per_prompt, dim=0),
+                output.text_embeds.repeat_interleave(num_images_per_prompt, dim=0),
+            )
+
+        def encode_prompt(self, prompt, num_images_per_prompt=1, do_classifier_free_guidance=True, negative_prompt=None):
+            prompts = prompt if isinstance(prompt, list) else [prompt]
+            prompt_embeds, pooled_prompt_embeds = self._encode_text(prompts, num_images_per_prompt)
+            if not do_classifier_free_guidance:
+                return prompt_embeds, None, pooled_prompt_embeds, None
+            negative_prompts = negative_prompt if isinstance(negative_prompt, list) else [negative_prompt or ""] * len(prompts)
+            negative_prompt_embeds, negative_pooled_prompt_embeds = self._encode_text(negative_prompts, num_images_per_prompt)
+            return prompt_embeds, negative_prompt_embeds, pooled_prompt_embeds, negative_pooled_prompt_embeds
+
+        def _latents(self, pixels):
+            return self.vae.encode(pixels).latent_dist.mode() * self.vae.config.scaling_factor
+
+        def forward(
+            self,
+            prompt_embeds,
+            negative_prompt_embeds,
+            pooled_prompt_embeds,
+            negative_pooled_prompt_embeds,
+            num_inference_steps,
+            generator,
+            strength,
+            pose_img,
+            text_embeds_cloth,
+            cloth,
+            mask_image,
+            image,
+            height,
+            width,
+            ip_adapter_image,
+            guidance_scale,
+        ):
+            # fp16 on CPU is slow or unsupported for some ops; everything runs in float32
+            person = to_tensor(image.convert("RGB").resize((width, height))).unsqueeze(0) * 2.0 - 1.0
+            mask = (to_tensor(mask_image.convert("L").resize((width, height))).unsqueeze(0) > 0.5).float()
+            latent_size = (height // 8, width // 8)
+
+            condition = torch.cat([
+                F.interpolate(mask, size=latent_size),
+                self._latents(person * (1.0 - mask)),
+                self._latents(pose_img.float()),
+                self.unet_encoder(self._latents(cloth.float())),
+            ], dim=1)
+            text = torch.cat([prompt_embeds.float(), text_embeds_cloth.float()], dim=1)
+            negative_text = torch.cat([negative_prompt_embeds.float(), text_embeds_cloth.float()], dim=1)
+
+            self.scheduler.set_timesteps(num_inference_steps)
+            latents = torch.randn((1, LATENT_CHANNELS, *latent_size), generator=generator) * self.scheduler.init_noise_sigma
+            for timestep in self.scheduler.timesteps:
+                model_input = torch.cat([latents, condition], dim=1).repeat(2, 1, 1, 1)
+                noise_uncond, noise_text = self.unet(
+                    model_input, timestep, encoder_hidden_states=torch.cat([negative_text, text])
+                ).sample.chunk(2)
+                noise = noise_uncond + guidance_scale * (noise_text - noise_uncond)
+                latents = self.scheduler.step(noise, timestep, latents, generator=generator).prev_sample
+
+            decoded = self.vae.decode(latents / self.vae.config.scaling_factor).sample
+            decoded = F.interpolate(decoded, size=(height, width))
+            return ([to_pil_image(((decoded[0].clamp(-1.0, 1.0) + 1.0) / 2.0))],)
+
+    return TinyTryonPipeline().eval()
+
+
+class _StubOpenPose:
+    """Stands in for preprocess.openpose.run_openpose.OpenPose (no keypoint model)."""
+
+    def __init__(self):
+        import torch
+
+        self.preprocessor = SimpleNamespace(body_estimation=SimpleNamespace(model=torch.nn.Identity()))
+
+    def __call__(self, image):
+        return {"pose_keypoints_2d": []}
+
+
+class _StubParsing:
+    """Stands in for preprocess.humanparsing.run_parsing.Parsing (every pixel is background)."""
+
+    def __call__(self, image):
+        from PIL import Image
+
+        return Image.new("L", image.size, 0), None
+
+
+def _stub_mask_location(model_type, category, model_parse, keypoint):
+    """Stands in for utils_mask.get_mask_location: a fixed upper-body box."""
+    from PIL import Image, ImageDraw
+
+    width, height = model_parse.size
+    mask = Image.new("L", (width, height), 0)
+    ImageDraw.Draw(mask).rectangle((width * 0.2, height * 0.15, width * 0.8, height * 0.6), fill=255)
+    return mask, mask.copy()
+
+
+def _stub_densepose_segment(args, image):
+    """Stands in for `apply_net show ... dp_segm`: a posterised copy of the BGR input."""
+    import numpy as np
+
+    return (np.asarray(image, dtype=np.uint8) // 64 * 64).astype(np.uint8)
+
+
+_stub_apply_net = SimpleNamespace(
+    create_argument_parser=lambda: SimpleNamespace(
+        parse_args=lambda argv: SimpleNamespace(func=_stub_densepose_segment)
+    )
+)
+
+
+def _convert_PIL_to_numpy(image, format):
+    """detectron2.data.detection_utils.convert_PIL_to_numpy for RGB/BGR."""
+    import numpy as np
+
+    array = np.asarray(image.convert("RGB"))
+    return array[:, :, ::-1] if format == "BGR" else array
+
+
+class ReferenceTryOnModel(TryOnWorker):
+    """TryOnWorker with tiny random models on CPU."""
+
+    model_version = "reference-tiny-random"
+
+    def load_models(self):
+        from typing import List
+        from PIL import ImageOps
+        from torchvision import transforms
+        from torchvision.transforms.functional import to_pil_image
+
+        self.device = "cpu"
+        self.pipe = _build_pipeline(REFERENCE_SEED)
+        self.parsing_model = _StubParsing()
+        self.openpose_model = _StubOpenPose()
+
+        self.tensor_transform = transforms.Compose(
+            [
+                transforms.ToTensor(),
+                transforms.Normalize([0.5], [0.5]),
+            ]
+        )
+
+        self.pil_to_binary_mask = pil_to_binary_mask
+        self.get_mask_location = _stub_mask_location
+        self.apply_net = _stub_apply_net
+        self.convert_PIL_to_numpy = _convert_PIL_to_numpy
+        self._apply_exif_orientation = ImageOps.exif_transpose
+        self.to_pil_image = to_pil_image
+        self.List = List
+
+        # No person detector: auto-crop falls back to the centred 3:4 crop
+        self.max_process_side = REFERENCE_MAX_PROCESS_SIDE
+        self.default_size = (768, 1024)
+
+
+worker = ReferenceTryOnModel()
+worker.load_models()
+app = worker.build_api()
@@ -1,6 +1,6 @@
 """Pydantic models for request/response"""
 from pydantic import BaseModel, Field
-from typing import Dict, Literal
+from typing import Dict, Literal, Optional
 
 
 class TryOnRequest(BaseModel):
@@ -11,3 +11,14 @@ class TryOnRequest(BaseModel):
     subscription_type: Literal["trial", "premium"] = Field(..., description="Subscription type: trial or premium")
     collection: str = Field(..., description="Collection name to process and mention in email")
 
+
+class JobStatusResponse(BaseModel):
+    job_id: str
+    state: Literal["queued", "running", "completed", "failed"]
+    attempts: int
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    timings: Dict[str, float] = Field(default_factory=dict, description="Seconds spent per pipeline stage")
+    result: Optional[Dict[str, str]] = Field(None, description="Processed image URLs by product ID")
+    error: Optional[str] = None
@@ -0,0 +1,125 @@
+"""Admission control for try-on submissions (rate limits, backlog limit, SLA check)"""
+import asyncio
+import hashlib
+import logging
+import math
+from typing import Any, Dict, Optional, Tuple
+from fastapi import HTTPException
+from config import (
+    ADMISSION_KEY_RATE,
+    ADMISSION_KEY_BURST,
+    ADMISSION_USER_RATE,
+    ADMISSION_USER_BURST,
+    ADMISSION_MAX_PENDING_GARMENTS,
+    ADMISSION_SLA_SECONDS,
+    ADMISSION_THROUGHPUT_WINDOW_SECONDS,
+    ADMISSION_MIN_THROUGHPUT_SAMPLES,
+)
+from services.job_service import JobQueue
+from utils.rate_limit import KeyedTokenBuckets
+
+logger = logging.getLogger(__name__)
+
+
+def _reject(status_code: int, detail: str, retry_after: float) -> HTTPException:
+    return HTTPException(
+        status_code=status_code,
+        detail=detail,
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+
+class AdmissionController:
+    """Decides whether a try-on job may be queued.
+
+    503 when the backlog of pending garments is full or the job is estimated
+    (from recent throughput) to finish later than the SLA; 429 when the API key
+    or the user is over its token bucket. Both carry Retry-After. Tokens are only
+    taken once the capacity checks passed, and a request that turns out not to
+    create a job (deduplicated, or rejected by the user bucket) gets them back.
+
+    Submissions go through submit(), which checks and queues under one lock, so
+    concurrent requests cannot all pass the backlog check before any of them is
+    counted in it."""
+
+    def __init__(self, job_queue: JobQueue):
+        self.job_queue = job_queue
+        self._key_buckets = KeyedTokenBuckets(ADMISSION_KEY_RATE, ADMISSION_KEY_BURST)
+        self._user_buckets = KeyedTokenBuckets(ADMISSION_USER_RATE, ADMISSION_USER_BURST)
+        self.last_estimate: Dict[str, float] = {}
+        self._lock = asyncio.Lock()
+        self.stats = {
+            "admitted": 0, "rejected_key_rate": 0, "rejected_user_rate": 0, "rejected_backlog": 0, "rejected_sla": 0,
+            "refunded": 0,
+        }
+
+    @staticmethod
+    def _key_id(api_key: str) -> str:
+        return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+    async def submit(
+        self,
+        api_key: str,
+        user_id: str,
+        payload: Dict[str, Any],
+        priority: int = 0,
+        cost: int = 1,
+        traceparent: Optional[str] = None,
+    ) -> Tuple[str, bool]:
+        """JobQueue.submit behind the admission checks; raises HTTPException (429/503) instead of queueing.
+
+        A resubmission of a job still queued or running adds no work, so it is
+        attached to without checks or charge."""
+        async with self._lock:
+            admitted = False
+            if await self.job_queue.find_duplicate(payload) is None:
+                await self._admit(api_key, user_id, cost)
+                admitted = True
+            job_id, created = await self.job_queue.submit(payload, priority=priority, cost=cost, traceparent=traceparent)
+            if admitted and not created:
+                # Another process queued an identical job between the check and the submit
+                self.refund(api_key, user_id)
+            return job_id, created
+
+    async def _admit(self, api_key: str, user_id: str, garments: int):
+        """Raise HTTPException (429/503 with Retry-After) if the job must not be queued; call with the lock held"""
+        pending = await self.job_queue.pending_cost()
+        finished, throughput = await self.job_queue.throughput(ADMISSION_THROUGHPUT_WINDOW_SECONDS)
+        if pending + garments > ADMISSION_MAX_PENDING_GARMENTS:
+            self.stats["rejected_backlog"] += 1
+            # Time for the backlog to drain enough to fit this job, if throughput is known
+            excess = pending + garments - ADMISSION_MAX_PENDING_GARMENTS
+            retry_after = excess / throughput if throughput > 0 else 60
+            logger.warning(f"Rejecting job of {garments} garment(s): {pending} garments already pending")
+            raise _reject(503, "Try-on queue is full, please retry later", retry_after)
+
+        # Estimated completion: everything ahead plus this job at the recent throughput
+        if finished >= ADMISSION_MIN_THROUGHPUT_SAMPLES and throughput > 0:
+            estimated = (pending + garments) / throughput
+            self.last_estimate = {"pending_garments": pending, "garments_per_second": round(throughput, 4), "estimated_seconds": round(estimated, 1)}
+            if estimated > ADMISSION_SLA_SECONDS:
+                self.stats["rejected_sla"] += 1
+                retry_after = (pending + garments - ADMISSION_SLA_SECONDS * throughput) / throughput
+                logger.warning(f"Rejecting job of {garments} garment(s): estimated {estimated:.0f}s exceeds SLA of {ADMISSION_SLA_SECONDS:.0f}s")
+                raise _reject(503, f"Try-on queue is too long to finish within {ADMISSION_SLA_SECONDS:.0f}s, please retry later", retry_after)
+
+        key_id = self._key_id(api_key)
+        wait = self._key_buckets.try_take(key_id)
+        if wait > 0:
+            self.stats["rejected_key_rate"] += 1
+            raise _reject(429, "Too many requests for this API key", wait)
+        wait = self._user_buckets.try_take(user_id)
+        if wait > 0:
+            self._key_buckets.refund(key_id)
+            self.stats["rejected_user_rate"] += 1
+            raise _reject(429, "Too many requests for this user", wait)
+        self.stats["admitted"] += 1
+
+    def refund(self, api_key: str, user_id: str):
+        """Return the tokens of an admitted request that created no job (e.g. a duplicate submission)"""
+        self._key_buckets.refund(self._key_id(api_key))
+        self._user_buckets.refund(user_id)
+        self.stats["refunded"] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {**self.stats, **self.last_estimate}
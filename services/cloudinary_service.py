@@ -1,47 +1,110 @@
 """Cloudinary service for image uploads"""
-import cloudinary
-import cloudinary.uploader
-from PIL import Image
+import asyncio
+import random
+import threading
 from io import BytesIO
 from fastapi import HTTPException
 import logging
-from config import CLOUDINARY_CLOUD_NAME, CLOUDINARY_API_KEY, CLOUDINARY_API_SECRET
+from config import (
+    CLOUDINARY_CLOUD_NAME,
+    CLOUDINARY_API_KEY,
+    CLOUDINARY_API_SECRET,
+    CLOUDINARY_CONCURRENCY,
+    CLOUDINARY_OUTPUT_FORMAT,
+    CLOUDINARY_MAX_ATTEMPTS,
+    CLOUDINARY_RETRY_BACKOFF,
+)
+from services.image_service import ImageBlob
+from utils.job_context import record_error
+from utils.metrics import BYTES_TRANSFERRED
 
 logger = logging.getLogger(__name__)
 
-# Configure Cloudinary
-cloudinary.config(
-    cloud_name=CLOUDINARY_CLOUD_NAME,
-    api_key=CLOUDINARY_API_KEY,
-    api_secret=CLOUDINARY_API_SECRET
-)
+# Delivery formats Cloudinary stores the result in (it converts server-side)
+OUTPUT_FORMATS = {"png", "webp", "jpg"}
+OUTPUT_FORMAT_ALIASES = {"jpeg": "jpg"}
+OUTPUT_FORMAT = OUTPUT_FORMAT_ALIASES.get(CLOUDINARY_OUTPUT_FORMAT, CLOUDINARY_OUTPUT_FORMAT)
+
+# Bounds concurrent uploads (each one occupies a thread while the SDK blocks)
+_upload_semaphore = asyncio.Semaphore(CLOUDINARY_CONCURRENCY)
+
+_config_lock = threading.Lock()
+_configured = False
+
+
+def _cloudinary():
+    """The Cloudinary SDK, imported and configured on first use rather than at startup"""
+    global _configured
+    import cloudinary
+    import cloudinary.exceptions
+    import cloudinary.uploader
+
+    if not _configured:
+        with _config_lock:
+            if not _configured:
+                # Configure Cloudinary
+                cloudinary.config(
+                    cloud_name=CLOUDINARY_CLOUD_NAME,
+                    api_key=CLOUDINARY_API_KEY,
+                    api_secret=CLOUDINARY_API_SECRET
+                )
+                if OUTPUT_FORMAT not in OUTPUT_FORMATS:
+                    logger.warning(
+                        f"Unknown CLOUDINARY_OUTPUT_FORMAT {CLOUDINARY_OUTPUT_FORMAT!r} "
+                        f"(expected one of {', '.join(sorted(OUTPUT_FORMATS))}); uploading as png"
+                    )
+                _configured = True
+    return cloudinary
+
+
+def _is_transient(error: Exception) -> bool:
+    """Rate limits, Cloudinary 5xx and network errors are worth retrying; 4xx are not"""
+    cloudinary = _cloudinary()
+    if isinstance(error, (cloudinary.exceptions.RateLimited, cloudinary.exceptions.GeneralError)):
+        return True
+    return not isinstance(error, cloudinary.exceptions.Error)
+
+
+def public_id_for(user_id: str, product_id: str) -> str:
+    """public_id format: {product_id}_{user_id}"""
+    return f"{product_id}_{user_id}"
+
+
+def _upload(data: bytes, public_id: str) -> dict:
+    return _cloudinary().uploader.upload(
+        BytesIO(data),
+        folder="ecommerce-products/users",
+        public_id=public_id,
+        resource_type="image",
+        format=OUTPUT_FORMAT if OUTPUT_FORMAT in OUTPUT_FORMATS else "png"
+    )
 
 
-async def upload_to_cloudinary(image: Image.Image, user_id: str, product_id: str) -> str:
-    """Upload processed image to Cloudinary and return secure URL"""
-    try:
-        # Save image to temporary buffer
-        buffer = BytesIO()
-        image.save(buffer, format="PNG")
-        buffer.seek(0)
-        
-        # Upload to Cloudinary
-        # public_id format: {product_id}_{user_id}
-        public_id = f"{product_id}_{user_id}"
-        
-        logger.info(f"Uploading to Cloudinary: public_id={public_id}")
-        response = cloudinary.uploader.upload(
-            buffer,
-            folder="ecommerce-products/users",
-            public_id=public_id,
-            resource_type="image",
-            format="png"
-        )
-        
-        secure_url = response["secure_url"]
-        logger.info(f"Uploaded to Cloudinary: {secure_url}")
-        return secure_url
-    except Exception as e:
-        logger.error(f"Error uploading to Cloudinary: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Failed to upload image to Cloudinary: {str(e)}")
+async def upload_to_cloudinary(image: ImageBlob, user_id: str, product_id: str) -> str:
+    """Upload processed image bytes to Cloudinary and return secure URL.
 
+    The encoded bytes from the worker are uploaded as-is; Cloudinary converts
+    them to CLOUDINARY_OUTPUT_FORMAT. The blocking SDK call runs in a thread and
+    transient failures are retried with exponential backoff."""
+    public_id = public_id_for(user_id, product_id)
+    attempt = 1
+    while True:
+        try:
+            async with _upload_semaphore:
+                logger.debug("Uploading to Cloudinary: public_id=%s (%d bytes, attempt %d)", public_id, len(image.data), attempt)
+                response = await asyncio.to_thread(_upload, image.data, public_id)
+            
+            BYTES_TRANSFERRED.labels("out", "cloudinary").inc(len(image.data))
+            secure_url = response["secure_url"]
+            logger.info("Uploaded to Cloudinary: %s", secure_url)
+            return secure_url
+        except Exception as e:
+            if attempt < CLOUDINARY_MAX_ATTEMPTS and _is_transient(e):
+                record_error("upload")  # the final failure is counted by the caller's stage
+                delay = CLOUDINARY_RETRY_BACKOFF * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+                logger.warning(f"Cloudinary upload of {public_id} failed ({str(e)}); retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            logger.error(f"Error uploading to Cloudinary: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Failed to upload image to Cloudinary: {str(e)}")
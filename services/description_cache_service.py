@@ -0,0 +1,81 @@
+"""Persistent cache of garment descriptions keyed by image content hash and prompt version"""
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+from config import DESCRIPTION_CACHE_DB_PATH, DESCRIPTION_CACHE_TTL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class DescriptionCache:
+    """SQLite table of (image sha256, prompt version) -> description, with a TTL"""
+
+    def __init__(self, db_path: str, ttl_seconds: float):
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS descriptions (
+                image_sha256 TEXT NOT NULL,
+                prompt_version TEXT NOT NULL,
+                description TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (image_sha256, prompt_version)
+            )
+            """
+        )
+        self.stats = {"hits": 0, "misses": 0, "stores": 0}
+
+    def _get(self, image_sha256: str, prompt_version: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT description, created_at FROM descriptions WHERE image_sha256 = ? AND prompt_version = ?",
+                (image_sha256, prompt_version),
+            ).fetchone()
+            if row is not None and time.time() - row[1] > self.ttl_seconds:
+                self._conn.execute(
+                    "DELETE FROM descriptions WHERE image_sha256 = ? AND prompt_version = ?",
+                    (image_sha256, prompt_version),
+                )
+                row = None
+        return row[0] if row is not None else None
+
+    def _put(self, image_sha256: str, prompt_version: str, description: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO descriptions (image_sha256, prompt_version, description, created_at) VALUES (?, ?, ?, ?)",
+                (image_sha256, prompt_version, description, time.time()),
+            )
+
+    async def get(self, image_sha256: str, prompt_version: str) -> Optional[str]:
+        description = await asyncio.to_thread(self._get, image_sha256, prompt_version)
+        self.stats["hits" if description is not None else "misses"] += 1
+        return description
+
+    async def put(self, image_sha256: str, prompt_version: str, description: str):
+        await asyncio.to_thread(self._put, image_sha256, prompt_version, description)
+        self.stats["stores"] += 1
+
+
+_cache: Optional[DescriptionCache] = None
+
+
+def get_description_cache() -> DescriptionCache:
+    global _cache
+    if _cache is None:
+        _cache = DescriptionCache(DESCRIPTION_CACHE_DB_PATH, DESCRIPTION_CACHE_TTL_SECONDS)
+    return _cache
+
+
+def get_description_cache_stats() -> Dict[str, int]:
+    return dict(_cache.stats) if _cache is not None else {}
@@ -0,0 +1,328 @@
+"""Persistent email outbox (SQLite) drained by background senders via the Resend batch API"""
+import asyncio
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+from utils.job_context import record_error, stage
+from utils.metrics import STAGE_SECONDS
+from config import (
+    RESEND_API_KEY,
+    EMAIL_OUTBOX_DB_PATH,
+    EMAIL_SENDER_COUNT,
+    EMAIL_BATCH_SIZE,
+    EMAIL_MAX_ATTEMPTS,
+    EMAIL_RATE_LIMIT_PER_SECOND,
+    EMAIL_RETRY_BACKOFF,
+)
+
+logger = logging.getLogger(__name__)
+
+EMAIL_PENDING = "pending"
+EMAIL_SENDING = "sending"
+EMAIL_SENT = "sent"
+EMAIL_FAILED = "failed"
+
+# How long an idle sender sleeps before polling the outbox again
+IDLE_POLL_SECONDS = 1.0
+
+# How long a sender pauses after an unexpected error (e.g. the database is locked)
+SENDER_ERROR_BACKOFF_SECONDS = 5.0
+
+
+class EmailOutboxStore:
+    """SQLite-backed outbox table. All methods are blocking; call them via asyncio.to_thread."""
+
+    def __init__(self, db_path: str):
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS emails (
+                id TEXT PRIMARY KEY,
+                state TEXT NOT NULL,
+                params TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                created_at REAL NOT NULL,
+                sent_at REAL,
+                resend_id TEXT,
+                error TEXT,
+                batch_id TEXT
+            )
+            """
+        )
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(emails)")}
+        if "batch_id" not in columns:
+            self._conn.execute("ALTER TABLE emails ADD COLUMN batch_id TEXT")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_emails_state_due ON emails (state, next_attempt_at)")
+
+    def enqueue(self, key: str, params: Dict[str, Any]) -> bool:
+        """Add an email; returns False if one with the same key was already queued"""
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO emails (id, state, params, next_attempt_at, created_at) VALUES (?, ?, ?, ?, ?)",
+                (key, EMAIL_PENDING, json.dumps(params), now, now),
+            )
+        return cursor.rowcount == 1
+
+    def claim_batch(self, limit: int) -> Tuple[Optional[str], List[sqlite3.Row]]:
+        """Atomically move due emails to sending and return (batch id, rows).
+
+        An email keeps the batch id it was first sent with, and a batch being
+        retried is claimed again as exactly the same emails in the same order.
+        Its request is then identical to the earlier one, so Resend can
+        de-duplicate it. Otherwise up to `limit` emails form a new batch."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                retry = self._conn.execute(
+                    "SELECT batch_id FROM emails WHERE state = ? AND next_attempt_at <= ? AND batch_id IS NOT NULL "
+                    "ORDER BY next_attempt_at LIMIT 1",
+                    (EMAIL_PENDING, now),
+                ).fetchone()
+                if retry is not None:
+                    batch_id = retry["batch_id"]
+                    rows = self._conn.execute(
+                        "SELECT * FROM emails WHERE state = ? AND batch_id = ? ORDER BY created_at, id",
+                        (EMAIL_PENDING, batch_id),
+                    ).fetchall()
+                else:
+                    batch_id = uuid.uuid4().hex
+                    rows = self._conn.execute(
+                        "SELECT * FROM emails WHERE state = ? AND next_attempt_at <= ? AND batch_id IS NULL "
+                        "ORDER BY next_attempt_at LIMIT ?",
+                        (EMAIL_PENDING, now, limit),
+                    ).fetchall()
+                    rows.sort(key=lambda row: (row["created_at"], row["id"]))
+                self._conn.executemany(
+                    "UPDATE emails SET state = ?, attempts = attempts + 1, batch_id = ? WHERE id = ?",
+                    [(EMAIL_SENDING, batch_id, row["id"]) for row in rows],
+                )
+                self._conn.execute("COMMIT")
+                return (batch_id if rows else None), rows
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def mark_sent(self, key: str, resend_id: Optional[str]):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE emails SET state = ?, sent_at = ?, resend_id = ?, error = NULL WHERE id = ?",
+                (EMAIL_SENT, time.time(), resend_id, key),
+            )
+
+    def mark_failed(self, key: str, error: str):
+        with self._lock:
+            self._conn.execute("UPDATE emails SET state = ?, error = ? WHERE id = ?", (EMAIL_FAILED, error, key))
+
+    def reschedule(self, key: str, error: str, delay: float, refund_attempt: bool = False):
+        """Put an email back in the queue after `delay` seconds (refunding the attempt for rate limits)"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE emails SET state = ?, error = ?, next_attempt_at = ?, attempts = attempts - ? WHERE id = ?",
+                (EMAIL_PENDING, error, time.time() + delay, 1 if refund_attempt else 0, key),
+            )
+
+    def recover_interrupted(self) -> int:
+        """Requeue emails left sending by a previous process"""
+        with self._lock:
+            cursor = self._conn.execute("UPDATE emails SET state = ? WHERE state = ?", (EMAIL_PENDING, EMAIL_SENDING))
+            return cursor.rowcount
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class EmailOutbox:
+    """Drains the outbox with `sender_count` concurrent senders, at most `rate_per_second` API calls.
+
+    Delivery is at-least-once: an email claimed by a process that dies before
+    recording the result is sent again after restart."""
+
+    def __init__(
+        self,
+        store: EmailOutboxStore,
+        sender_count: int,
+        batch_size: int,
+        max_attempts: int,
+        rate_per_second: float,
+        retry_backoff: float,
+    ):
+        self.store = store
+        self.sender_count = max(1, sender_count)
+        self.batch_size = max(1, batch_size)
+        self.max_attempts = max_attempts
+        self.interval = 1.0 / rate_per_second if rate_per_second > 0 else 0.0
+        self.retry_backoff = retry_backoff
+        self._next_call_at = 0.0
+        self._wakeup = asyncio.Event()
+        self._senders: List[asyncio.Task] = []
+        self.stats = {
+            "queued": 0, "duplicates": 0, "batches": 0, "sent": 0, "retried": 0, "failed": 0, "rate_limited": 0,
+            "sender_errors": 0,
+        }
+
+    async def start(self):
+        recovered = await asyncio.to_thread(self.store.recover_interrupted)
+        if recovered:
+            logger.info(f"Requeued {recovered} email(s) interrupted by a previous shutdown")
+        self._senders = [
+            asyncio.create_task(self._sender(), name=f"email-sender-{index}")
+            for index in range(self.sender_count)
+        ]
+        logger.info(f"Started {self.sender_count} email sender(s)")
+
+    async def stop(self):
+        """Cancel senders; unsent emails stay in the outbox for the next start"""
+        for task in self._senders:
+            task.cancel()
+        await asyncio.gather(*self._senders, return_exceptions=True)
+        self._senders = []
+        await asyncio.to_thread(self.store.close)
+
+    async def enqueue(self, key: str, params: Dict[str, Any]):
+        if await asyncio.to_thread(self.store.enqueue, key, params):
+            self.stats["queued"] += 1
+            self._wakeup.set()
+        else:
+            self.stats["duplicates"] += 1
+            logger.info(f"Email {key} already queued; not sending it twice")
+
+    async def _throttle(self):
+        """Reserve the next API call slot so all senders together stay under the rate limit"""
+        now = time.monotonic()
+        slot = max(now, self._next_call_at)
+        self._next_call_at = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def _sender(self):
+        # An unexpected error must not end the sender: its emails would stay
+        # claimed and nothing more would be sent until a restart
+        while True:
+            try:
+                await self._send_next()
+            except Exception:
+                self.stats["sender_errors"] += 1
+                logger.exception(f"Email sender failed; retrying in {SENDER_ERROR_BACKOFF_SECONDS:.0f}s")
+                await asyncio.sleep(SENDER_ERROR_BACKOFF_SECONDS)
+
+    async def _send_next(self):
+        """Claim and send one batch, or wait a while for emails to be queued"""
+        # Throttle before claiming so emails queued meanwhile join the batch
+        await self._throttle()
+        batch_id, rows = await asyncio.to_thread(self.store.claim_batch, self.batch_size)
+        if not rows:
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=IDLE_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            return
+        try:
+            await self._send(batch_id, rows)
+        except Exception as e:
+            # Put the claimed emails back in the queue before the sender backs off
+            await self._retry_or_fail(rows, f"Sender error: {str(e)}")
+            raise
+
+    async def _send(self, batch_id: str, rows: List[sqlite3.Row]):
+        resend = await asyncio.to_thread(_import_resend)
+        resend.api_key = RESEND_API_KEY
+        keys = [row["id"] for row in rows]
+        params = [json.loads(row["params"]) for row in rows]
+        # Resend de-duplicates retried requests carrying the same idempotency key; a
+        # retried batch holds the same emails (see claim_batch), so its request matches
+        options = {"batch_validation": "permissive", "idempotency_key": batch_id}
+        try:
+            self.stats["batches"] += 1
+            with stage("email_send"):
+                response = await asyncio.to_thread(resend.Batch.send, params, options)
+        except resend.exceptions.RateLimitError as e:
+            retry_after = float(e.headers.get("retry-after", 1) or 1)
+            self._next_call_at = max(self._next_call_at, time.monotonic() + retry_after)
+            self.stats["rate_limited"] += 1
+            logger.warning(f"Resend rate limit hit; retrying {len(rows)} email(s) in {retry_after:.0f}s")
+            for key in keys:
+                await asyncio.to_thread(self.store.reschedule, key, str(e), retry_after, True)
+            return
+        except Exception as e:
+            logger.error(f"Failed to send batch of {len(rows)} email(s): {str(e)}")
+            await self._retry_or_fail(rows, str(e))
+            return
+
+        # In permissive mode invalid emails are reported by index and the rest are sent
+        errors = {error["index"]: error["message"] for error in response.get("errors") or []}
+        sent = iter(response.get("data") or [])
+        for index, row in enumerate(rows):
+            to = json.loads(row["params"])["to"]
+            if index in errors:
+                record_error("email_send")
+                logger.error(f"Resend rejected email to {to}: {errors[index]}")
+                await asyncio.to_thread(self.store.mark_failed, row["id"], errors[index])
+                self.stats["failed"] += 1
+                continue
+            email_id = next(sent, {}).get("id")
+            await asyncio.to_thread(self.store.mark_sent, row["id"], email_id)
+            self.stats["sent"] += 1
+            STAGE_SECONDS.labels("email_delivery", "none").observe(time.time() - row["created_at"])
+            logger.info(f"Email sent successfully to {to}. Email ID: {email_id}")
+
+    async def _retry_or_fail(self, rows: List[sqlite3.Row], error: str):
+        """Retry or give up on a failed batch as a whole, so it is resent as the same request"""
+        attempts = max(row["attempts"] for row in rows) + 1
+        if attempts >= self.max_attempts:
+            for row in rows:
+                await asyncio.to_thread(self.store.mark_failed, row["id"], error)
+            self.stats["failed"] += len(rows)
+            logger.error(f"Giving up on {len(rows)} email(s) after {attempts} attempts: {[row['id'] for row in rows]}")
+            return
+        delay = self.retry_backoff * (2 ** (attempts - 1)) * random.uniform(0.5, 1.5)
+        for row in rows:
+            await asyncio.to_thread(self.store.reschedule, row["id"], error, delay)
+        self.stats["retried"] += len(rows)
+
+
+def _import_resend():
+    """The Resend SDK, imported on first send rather than at startup"""
+    import resend
+    import resend.exceptions
+
+    return resend
+
+
+_outbox: Optional[EmailOutbox] = None
+
+
+def get_email_outbox() -> EmailOutbox:
+    """Return the shared email outbox (created on first use)"""
+    global _outbox
+    if _outbox is None:
+        _outbox = EmailOutbox(
+            EmailOutboxStore(EMAIL_OUTBOX_DB_PATH),
+            sender_count=EMAIL_SENDER_COUNT,
+            batch_size=EMAIL_BATCH_SIZE,
+            max_attempts=EMAIL_MAX_ATTEMPTS,
+            rate_per_second=EMAIL_RATE_LIMIT_PER_SECOND,
+            retry_backoff=EMAIL_RETRY_BACKOFF,
+        )
+    return _outbox
+
+
+def get_email_outbox_stats() -> Dict[str, int]:
+    return dict(_outbox.stats) if _outbox is not None else {}
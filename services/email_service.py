@@ -1,52 +1,47 @@
 """Email service for sending notifications"""
-import resend
-from typing import Dict
+import uuid
+from string import Template
+from typing import TYPE_CHECKING, Dict, List, Optional
 import logging
 from config import RESEND_API_KEY, RESEND_FROM_EMAIL, FRONTEND_URL, LOGO_URL
+from services.email_outbox_service import get_email_outbox
+from utils.job_context import current_job
+
+if TYPE_CHECKING:
+    import resend
 
 logger = logging.getLogger(__name__)
 
+# Templates are compiled once at import; rendering an email is a single substitute() call
 
-def get_email_template(user_id: str, email: str, processed_images: Dict[str, str], subscription_type: str, collection: str, frontend_url: str) -> str:
-    """Generate HTML email template for try-on completion matching website theme"""
-    
-    # Customize content based on subscription type
-    if subscription_type == "premium":
-        plan_description = "Premium subscribers get priority processing and access to exclusive collections!"
-        plan_color = "#ff6b9d"
-    else:
-        plan_description = "Try our premium plan for faster processing and more features!"
-        plan_color = "#ff6b9d"
-    
-    # Generate product images grid (no individual buttons) - using table for email compatibility
-    products_html = '<table width="100%" cellpadding="0" cellspacing="0" style="margin: 20px 0;"><tr>'
-    product_count = 0
-    for product_id, image_url in processed_images.items():
-        if product_count > 0 and product_count % 2 == 0:
-            products_html += '</tr><tr>'
-        products_html += f"""
+PRODUCT_CELL_TEMPLATE = Template("""
         <td width="50%" style="padding: 10px; vertical-align: top;">
             <table width="100%" cellpadding="0" cellspacing="0" style="background: #fff; border-radius: 8px; overflow: hidden; border: 1px solid #f0f0f0; box-shadow: 0 2px 8px rgba(0,0,0,0.05);">
                 <tr>
                     <td style="padding: 0;">
-                        <img src="{image_url}" alt="Try-On Result for {product_id}" style="width: 100%; height: auto; display: block; max-width: 100%;" />
+                        <img src="${image_url}" alt="Try-On Result for ${product_id}" style="width: 100%; height: auto; display: block; max-width: 100%;" />
                     </td>
                 </tr>
                 <tr>
                     <td style="padding: 12px; text-align: center;">
-                        <p style="margin: 0; color: #333; font-size: 14px; font-weight: 600;">{product_id}</p>
+                        <p style="margin: 0; color: #333; font-size: 14px; font-weight: 600;">${product_id}</p>
                     </td>
                 </tr>
             </table>
         </td>
-        """
-        product_count += 1
-    # Fill remaining cells if odd number of products
-    if product_count % 2 == 1:
-        products_html += '<td width="50%" style="padding: 10px;"></td>'
-    products_html += '</tr></table>'
-    
-    html = f"""
+        """)
+
+# Shown in the completion email when some garments could not be processed
+FAILED_PRODUCTS_TEMPLATE = Template("""
+                                <div style="background: #fff5f7; padding: 15px; border-radius: 8px; margin: 20px 0; border-left: 4px solid #ff4757;">
+                                    <p style="margin: 0; color: #1a1a2e; font-size: 14px;">
+                                        <strong>${failed_count} garment(s) could not be processed:</strong> ${product_ids}<br>
+                                        Please try these again later.
+                                    </p>
+                                </div>
+""")
+
+COMPLETION_EMAIL_TEMPLATE = Template("""
     <!DOCTYPE html>
     <html>
     <head>
@@ -63,7 +58,7 @@ def get_email_template(user_id: str, email: str, processed_images: Dict[str, str
                         <tr>
                             <td style="background: linear-gradient(135deg, #fff5f7 0%, #ffeef2 100%); padding: 40px 30px; text-align: center; border-bottom: 2px solid #ff6b9d;">
                                 <div style="margin-bottom: 20px;">
-                                    <img src="{LOGO_URL}" alt="DRAPELY.ai Logo" style="max-width: 180px; height: auto; display: block; margin: 0 auto;" />
+                                    <img src="${logo_url}" alt="DRAPELY.ai Logo" style="max-width: 180px; height: auto; display: block; margin: 0 auto;" />
                                 </div>
                                 <div style="display: inline-block; background: #ff6b9d; color: white; padding: 6px 16px; border-radius: 20px; font-size: 12px; font-weight: 600; letter-spacing: 0.5px; margin-bottom: 10px;">
                                     // FUTURISTIC
@@ -82,31 +77,32 @@ def get_email_template(user_id: str, email: str, processed_images: Dict[str, str
                                 </p>
                                 
                                 <p style="font-size: 16px; color: #555; margin: 0 0 25px 0; line-height: 1.8;">
-                                    Fashion that learns you. We've successfully processed <strong style="color: #ff6b9d;">{len(processed_images)}</strong> garment(s) from the <strong style="color: #ff6b9d;">{collection}</strong> collection for your personalized try-on experience.
+                                    Fashion that learns you. We've successfully processed <strong style="color: #ff6b9d;">${processed_count}</strong> garment(s) from the <strong style="color: #ff6b9d;">${collection}</strong> collection for your personalized try-on experience.
                                 </p>
                                 
                                 <!-- Plan Badge -->
-                                <div style="background: linear-gradient(135deg, #ffeef2 0%, #fff5f7 100%); padding: 12px 20px; border-radius: 8px; margin: 25px 0; border-left: 4px solid {plan_color};">
+                                <div style="background: linear-gradient(135deg, #ffeef2 0%, #fff5f7 100%); padding: 12px 20px; border-radius: 8px; margin: 25px 0; border-left: 4px solid ${plan_color};">
                                     <p style="margin: 0; color: #1a1a2e; font-size: 14px; font-weight: 600;">
-                                        Plan: <span style="color: {plan_color}; text-transform: capitalize;">{subscription_type}</span> • Collection: <span style="color: {plan_color};">{collection}</span> • Total Processed: <span style="color: {plan_color};">{len(processed_images)}</span>
+                                        Plan: <span style="color: ${plan_color}; text-transform: capitalize;">${subscription_type}</span> • Collection: <span style="color: ${plan_color};">${collection}</span> • Total Processed: <span style="color: ${plan_color};">${processed_count}</span>
                                     </p>
                                 </div>
                                 
                                 <p style="font-size: 14px; color: #666; margin: 0 0 25px 0; line-height: 1.6;">
-                                    {plan_description}
+                                    ${plan_description}
                                 </p>
+                                ${failed_html}
                                 
                                 <!-- Try-On Results Section -->
                                 <div style="margin: 30px 0;">
                                     <h2 style="color: #1a1a2e; font-size: 22px; font-weight: 700; margin: 0 0 20px 0; padding-bottom: 10px; border-bottom: 2px solid #ffeef2;">
-                                        Your Try-On Results from {collection}
+                                        Your Try-On Results from ${collection}
                                     </h2>
-                                    {products_html}
+                                    ${products_html}
                                 </div>
                                 
                                 <!-- CTA Button -->
                                 <div style="text-align: center; margin: 40px 0 30px 0;">
-                                    <a href="{frontend_url}/products?category={collection}" style="display: inline-block; padding: 16px 40px; background: linear-gradient(135deg, #ff6b9d 0%, #ff4757 100%); color: white; text-decoration: none; border-radius: 8px; font-weight: 700; font-size: 16px; box-shadow: 0 4px 15px rgba(255, 107, 157, 0.3); transition: transform 0.2s;">
+                                    <a href="${frontend_url}/products?category=${collection}" style="display: inline-block; padding: 16px 40px; background: linear-gradient(135deg, #ff6b9d 0%, #ff4757 100%); color: white; text-decoration: none; border-radius: 8px; font-weight: 700; font-size: 16px; box-shadow: 0 4px 15px rgba(255, 107, 157, 0.3); transition: transform 0.2s;">
                                         View Collection
                                     </a>
                                 </div>
@@ -128,50 +124,9 @@ def get_email_template(user_id: str, email: str, processed_images: Dict[str, str
         </table>
     </body>
     </html>
-    """
-    return html
-
+    """)
 
-def send_completion_email_sync(email: str, user_id: str, processed_images: Dict[str, str], subscription_type: str, collection: str):
-    """Send email notification when try-on processing is complete (synchronous for background task)"""
-    if not RESEND_API_KEY:
-        logger.warning("RESEND_API_KEY not configured. Skipping email notification.")
-        return
-    
-    try:
-        # Set API key (per Resend docs)
-        resend.api_key = RESEND_API_KEY
-        
-        subject = f"Your Virtual Try-On Results Are Ready! ({subscription_type.title()} Plan - {collection})"
-        html_content = get_email_template(user_id, email, processed_images, subscription_type, collection, FRONTEND_URL)
-        
-        # Send email via Resend (per FastAPI docs)
-        params: resend.Emails.SendParams = {
-            "from": RESEND_FROM_EMAIL,
-            "to": [email],
-            "subject": subject,
-            "html": html_content,
-        }
-        
-        email_response = resend.Emails.send(params)
-        logger.info(f"Email sent successfully to {email}. Email ID: {email_response.get('id')}")
-        
-    except Exception as e:
-        logger.error(f"Failed to send email to {email}: {str(e)}")
-        # Don't raise exception - email failure shouldn't break the API response
-
-
-def send_error_email_sync(email: str, user_id: str, error_message: str, subscription_type: str, collection: str, frontend_url: str):
-    """Send error email notification when try-on processing fails"""
-    if not RESEND_API_KEY:
-        logger.warning("RESEND_API_KEY not configured. Skipping error email notification.")
-        return
-    
-    try:
-        # Set API key (per Resend docs)
-        resend.api_key = RESEND_API_KEY
-        
-        html_content = f"""
+ERROR_EMAIL_TEMPLATE = Template("""
         <!DOCTYPE html>
         <html>
         <head>
@@ -188,7 +143,7 @@ def send_error_email_sync(email: str, user_id: str, error_message: str, subscrip
                         <tr>
                             <td style="background: linear-gradient(135deg, #fff5f7 0%, #ffeef2 100%); padding: 40px 30px; text-align: center; border-bottom: 2px solid #ff6b9d;">
                                 <div style="margin-bottom: 20px;">
-                                    <img src="{LOGO_URL}" alt="DRAPELY.ai Logo" style="max-width: 180px; height: auto; display: block; margin: 0 auto;" />
+                                    <img src="${logo_url}" alt="DRAPELY.ai Logo" style="max-width: 180px; height: auto; display: block; margin: 0 auto;" />
                                 </div>
                                 <h1 style="color: #1a1a2e; margin: 10px 0; font-size: 28px; font-weight: 700;">⚠️ Processing Error</h1>
                             </td>
@@ -201,21 +156,21 @@ def send_error_email_sync(email: str, user_id: str, error_message: str, subscrip
                 <p style="font-size: 16px; color: #555;">Hello,</p>
                 
                 <p style="font-size: 16px; color: #555;">
-                    We encountered an error while processing your virtual try-on request for the <strong>{collection}</strong> collection. 
+                    We encountered an error while processing your virtual try-on request for the <strong>${collection}</strong> collection. 
                     Please try again or contact support if the issue persists.
                 </p>
                 
                 <div style="background: #fff5f7; padding: 15px; border-radius: 8px; margin: 20px 0; border-left: 4px solid #ff6b9d;">
                     <p style="margin: 0; color: #1a1a2e;">
-                        <strong>Plan:</strong> <span style="color: #ff6b9d; text-transform: capitalize;">{subscription_type}</span><br>
-                        <strong>Collection:</strong> <span style="color: #ff6b9d;">{collection}</span><br>
-                        <strong>Error:</strong> {error_message}
+                        <strong>Plan:</strong> <span style="color: #ff6b9d; text-transform: capitalize;">${subscription_type}</span><br>
+                        <strong>Collection:</strong> <span style="color: #ff6b9d;">${collection}</span><br>
+                        <strong>Error:</strong> ${error_message}
                     </p>
                 </div>
                 
                                 <!-- CTA Button -->
                                 <div style="text-align: center; margin: 30px 0;">
-                                    <a href="{frontend_url}/products?category={collection}" style="display: inline-block; padding: 16px 40px; background: linear-gradient(135deg, #ff6b9d 0%, #ff4757 100%); color: white; text-decoration: none; border-radius: 8px; font-weight: 700; font-size: 16px; box-shadow: 0 4px 15px rgba(255, 107, 157, 0.3);">
+                                    <a href="${frontend_url}/products?category=${collection}" style="display: inline-block; padding: 16px 40px; background: linear-gradient(135deg, #ff6b9d 0%, #ff4757 100%); color: white; text-decoration: none; border-radius: 8px; font-weight: 700; font-size: 16px; box-shadow: 0 4px 15px rgba(255, 107, 157, 0.3);">
                                         Try Again
                                     </a>
                                 </div>
@@ -237,18 +192,127 @@ def send_error_email_sync(email: str, user_id: str, error_message: str, subscrip
         </table>
         </body>
         </html>
-        """
+        """)
+
+
+def _products_html(processed_images: Dict[str, str]) -> str:
+    """Product images grid (no individual buttons) - using table for email compatibility"""
+    parts = ['<table width="100%" cellpadding="0" cellspacing="0" style="margin: 20px 0;"><tr>']
+    for product_count, (product_id, image_url) in enumerate(processed_images.items()):
+        if product_count > 0 and product_count % 2 == 0:
+            parts.append('</tr><tr>')
+        parts.append(PRODUCT_CELL_TEMPLATE.substitute(image_url=image_url, product_id=product_id))
+    # Fill remaining cells if odd number of products
+    if len(processed_images) % 2 == 1:
+        parts.append('<td width="50%" style="padding: 10px;"></td>')
+    parts.append('</tr></table>')
+    return "".join(parts)
+
+
+def get_email_template(
+    user_id: str,
+    email: str,
+    processed_images: Dict[str, str],
+    subscription_type: str,
+    collection: str,
+    frontend_url: str,
+    failed_products: Optional[List[str]] = None,
+) -> str:
+    """Generate HTML email template for try-on completion matching website theme
+
+    `failed_products` (partial completion) are listed in a notice above the results."""
+    
+    # Customize content based on subscription type
+    if subscription_type == "premium":
+        plan_description = "Premium subscribers get priority processing and access to exclusive collections!"
+        plan_color = "#ff6b9d"
+    else:
+        plan_description = "Try our premium plan for faster processing and more features!"
+        plan_color = "#ff6b9d"
+    
+    return COMPLETION_EMAIL_TEMPLATE.substitute(
+        logo_url=LOGO_URL,
+        processed_count=len(processed_images),
+        collection=collection,
+        plan_color=plan_color,
+        subscription_type=subscription_type,
+        plan_description=plan_description,
+        products_html=_products_html(processed_images),
+        failed_html=FAILED_PRODUCTS_TEMPLATE.substitute(
+            failed_count=len(failed_products), product_ids=", ".join(failed_products)
+        ) if failed_products else "",
+        frontend_url=frontend_url,
+    )
+
+
+def get_error_email_template(error_message: str, subscription_type: str, collection: str, frontend_url: str) -> str:
+    """Generate HTML email template for a failed try-on"""
+    return ERROR_EMAIL_TEMPLATE.substitute(
+        logo_url=LOGO_URL,
+        collection=collection,
+        subscription_type=subscription_type,
+        error_message=error_message,
+        frontend_url=frontend_url,
+    )
+
+
+def _outbox_key(kind: str) -> str:
+    """Deduplication key: one email of each kind per job, so a requeued job does not email twice"""
+    job = current_job.get()
+    return f"{job.job_id}:{kind}" if job is not None else f"{uuid.uuid4().hex}:{kind}"
+
+
+async def queue_completion_email(
+    email: str,
+    user_id: str,
+    processed_images: Dict[str, str],
+    subscription_type: str,
+    collection: str,
+    failed_products: Optional[List[str]] = None,
+):
+    """Queue the email notification for a completed try-on (delivered by the outbox sender).
+
+    `failed_products` lists the garments that produced no result (partial completion)."""
+    if not RESEND_API_KEY:
+        logger.warning("RESEND_API_KEY not configured. Skipping email notification.")
+        return
+    
+    try:
+        params: resend.Emails.SendParams = {
+            "from": RESEND_FROM_EMAIL,
+            "to": [email],
+            "subject": (
+                f"Some of Your Virtual Try-On Results Are Ready ({subscription_type.title()} Plan - {collection})"
+                if failed_products else
+                f"Your Virtual Try-On Results Are Ready! ({subscription_type.title()} Plan - {collection})"
+            ),
+            "html": get_email_template(
+                user_id, email, processed_images, subscription_type, collection, FRONTEND_URL, failed_products
+            ),
+        }
+        await get_email_outbox().enqueue(_outbox_key("completion"), params)
+        logger.info(f"Queued completion email to {email}" + (f" ({len(failed_products)} garment(s) failed)" if failed_products else ""))
         
+    except Exception as e:
+        logger.error(f"Failed to queue email to {email}: {str(e)}")
+        # Don't raise exception - email failure shouldn't fail the job
+
+
+async def queue_error_email(email: str, user_id: str, error_message: str, subscription_type: str, collection: str, frontend_url: str):
+    """Queue the email notification for a failed try-on (delivered by the outbox sender)"""
+    if not RESEND_API_KEY:
+        logger.warning("RESEND_API_KEY not configured. Skipping error email notification.")
+        return
+    
+    try:
         params: resend.Emails.SendParams = {
             "from": RESEND_FROM_EMAIL,
             "to": [email],
             "subject": f"Virtual Try-On Processing Error ({subscription_type.title()} Plan - {collection})",
-            "html": html_content,
+            "html": get_error_email_template(error_message, subscription_type, collection, frontend_url),
         }
-        
-        email_response = resend.Emails.send(params)
-        logger.info(f"Error email sent successfully to {email}. Email ID: {email_response.get('id')}")
+        await get_email_outbox().enqueue(_outbox_key("error"), params)
+        logger.info(f"Queued error email to {email}")
         
     except Exception as e:
-        logger.error(f"Failed to send error email to {email}: {str(e)}")
-
+        logger.error(f"Failed to queue error email to {email}: {str(e)}")
@@ -1,36 +1,29 @@
 """Service for generating garment descriptions using OpenAI"""
-from openai import OpenAI
-from PIL import Image
 from io import BytesIO
+import asyncio
 import base64
+import hashlib
 import logging
-from config import OPENAI_API_KEY
+import re
+from typing import TYPE_CHECKING, Dict
+from config import OPENAI_API_KEY, OPENAI_CONCURRENCY, DESCRIPTION_CACHE_ENABLED
+from services.description_cache_service import get_description_cache
+from services.image_service import ImageBlob
+from utils.job_context import record_error
+from utils.metrics import BYTES_TRANSFERRED
 
-logger = logging.getLogger(__name__)
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+    from PIL import Image
 
+logger = logging.getLogger(__name__)
 
-def image_to_base64(image: Image.Image) -> str:
-    """Convert PIL Image to base64 string"""
-    buffer = BytesIO()
-    image.save(buffer, format="PNG")
-    img_bytes = buffer.getvalue()
-    return base64.b64encode(img_bytes).decode("utf-8")
+DEFAULT_DESCRIPTION = "a beautiful garment, professional fashion photography, high quality"
 
+DESCRIPTION_MODEL = "gpt-4o-mini"
 
-async def generate_garment_description(image: Image.Image) -> str:
-    """Generate detailed garment description using OpenAI Vision API"""
-    try:
-        if not OPENAI_API_KEY:
-            logger.warning("OPENAI_API_KEY not configured. Using default description.")
-            return "a beautiful garment, professional fashion photography, high quality"
-        
-        client = OpenAI(api_key=OPENAI_API_KEY)
-        
-        # Convert image to base64
-        base64_image = image_to_base64(image)
-        
-        # Create prompt for concise garment description (must be under 50 words to fit CLIP's 77 token limit)
-        prompt = """Analyze this garment image and provide a concise, natural language description for virtual try-on generation.
+# Create prompt for concise garment description (must be under 50 words to fit CLIP's 77 token limit)
+DESCRIPTION_PROMPT = """Analyze this garment image and provide a concise, natural language description for virtual try-on generation.
         
         Describe in 2-3 sentences: garment type, color, style, material/texture, and key features (collar, sleeves, pattern, fit).
         
@@ -41,53 +34,139 @@ async def generate_garment_description(image: Image.Image) -> str:
         - Focus on visual details that matter for try-on
         
         Example format: "A gray cable knit sweater with a turtleneck collar, loose fit, chunky knit texture, and ribbed cuffs." """
-        
-        # Use standard OpenAI Chat Completions API with vision
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
+
+# Quality descriptors appended to every generated description
+DESCRIPTION_SUFFIX = ", professional fashion photography, high quality, detailed texture"
+
+# Cached descriptions are only reused while the model, prompt and post-processing are unchanged
+PROMPT_VERSION = hashlib.sha256(
+    f"{DESCRIPTION_MODEL}\n{DESCRIPTION_PROMPT}\n{DESCRIPTION_SUFFIX}".encode("utf-8")
+).hexdigest()[:16]
+
+# Encodings the OpenAI vision API accepts as-is; anything else is re-encoded as PNG
+OPENAI_IMAGE_TYPES = {"image/png", "image/jpeg", "image/webp", "image/gif"}
+
+# Bounds concurrent OpenAI calls across all jobs in this process
+_openai_semaphore = asyncio.Semaphore(OPENAI_CONCURRENCY)
+_client = None
+
+# Descriptions currently being generated, by image sha256 (deduplicates concurrent misses)
+_in_flight: Dict[str, "asyncio.Future[str]"] = {}
+
+
+def get_openai_client() -> "AsyncOpenAI":
+    """Return the shared async OpenAI client (the SDK is imported and the client created on first use)"""
+    global _client
+    if _client is None:
+        from openai import AsyncOpenAI
+
+        _client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+    return _client
+
+
+def image_to_base64(image: "Image.Image") -> str:
+    """Convert PIL Image to base64 string"""
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")
+    img_bytes = buffer.getvalue()
+    return base64.b64encode(img_bytes).decode("utf-8")
+
+
+def image_data_url(garment: ImageBlob) -> str:
+    """Data URL of the garment's original bytes (decoded and re-encoded only if OpenAI can't read them)"""
+    if garment.content_type in OPENAI_IMAGE_TYPES:
+        return f"data:{garment.content_type};base64,{base64.b64encode(garment.data).decode('utf-8')}"
+    return f"data:image/png;base64,{image_to_base64(garment.image)}"
+
+
+async def _describe(garment: ImageBlob) -> str:
+    """Call OpenAI Vision API and clean up the answer (raises on failure)"""
+    # The first call imports the SDK; keep that off the event loop
+    client = _client or await asyncio.to_thread(get_openai_client)
+    data_url = image_data_url(garment)
+    BYTES_TRANSFERRED.labels("out", "openai").inc(len(data_url))
+
+    # Use standard OpenAI Chat Completions API with vision
+    async with _openai_semaphore:
+        response = await client.chat.completions.create(
+            model=DESCRIPTION_MODEL,
             messages=[{
                 "role": "user",
                 "content": [
-                    {"type": "text", "text": prompt},
+                    {"type": "text", "text": DESCRIPTION_PROMPT},
                     {
                         "type": "image_url",
                         "image_url": {
-                            "url": f"data:image/png;base64,{base64_image}"
+                            "url": data_url
                         }
                     },
                 ],
             }],
             max_tokens=100  # Reduced from 300 to encourage conciseness
         )
-        
-        description = response.choices[0].message.content.strip()
-        
-        # Clean up markdown formatting if present
-        import re
-        # Remove markdown bold/italic
-        description = re.sub(r'\*\*([^*]+)\*\*', r'\1', description)
-        description = re.sub(r'\*([^*]+)\*', r'\1', description)
-        # Remove markdown headers
-        description = re.sub(r'^#+\s*', '', description, flags=re.MULTILINE)
-        # Remove bullet points and dashes at start of lines
-        description = re.sub(r'^[\-\*]\s*', '', description, flags=re.MULTILINE)
-        # Remove extra whitespace
-        description = ' '.join(description.split())
-        
-        logger.info(f"Generated garment description: {description}")
-        print(f"Generated garment description: {description}")  # Print as requested
-        
-        # Return clean description without redundant prefixes (prompt already adds "a beautiful female model wearing")
-        # Just add quality descriptors at the end
-        enhanced_description = f"{description}, professional fashion photography, high quality, detailed texture"
-        
-        return enhanced_description
-        
+
+    description = response.choices[0].message.content.strip()
+
+    # Clean up markdown formatting if present
+    # Remove markdown bold/italic
+    description = re.sub(r'\*\*([^*]+)\*\*', r'\1', description)
+    description = re.sub(r'\*([^*]+)\*', r'\1', description)
+    # Remove markdown headers
+    description = re.sub(r'^#+\s*', '', description, flags=re.MULTILINE)
+    # Remove bullet points and dashes at start of lines
+    description = re.sub(r'^[\-\*]\s*', '', description, flags=re.MULTILINE)
+    # Remove extra whitespace
+    description = ' '.join(description.split())
+    if not description:
+        raise ValueError("OpenAI returned an empty description")
+
+    logger.info(f"Generated garment description: {description}")
+    print(f"Generated garment description: {description}")  # Print as requested
+
+    # Return clean description without redundant prefixes (prompt already adds "a beautiful female model wearing")
+    # Just add quality descriptors at the end
+    return f"{description}{DESCRIPTION_SUFFIX}"
+
+
+async def _describe_and_cache(garment: ImageBlob) -> str:
+    description = await _describe(garment)
+    if DESCRIPTION_CACHE_ENABLED:
+        await get_description_cache().put(garment.sha256, PROMPT_VERSION, description)
+    return description
+
+
+async def generate_garment_description(garment: ImageBlob) -> str:
+    """Generate detailed garment description using OpenAI Vision API.
+
+    Descriptions are cached by the sha256 of the garment image bytes; concurrent
+    requests for the same image share one OpenAI call. The default description
+    returned on failure is never cached."""
+    try:
+        if DESCRIPTION_CACHE_ENABLED:
+            cached = await get_description_cache().get(garment.sha256, PROMPT_VERSION)
+            if cached is not None:
+                logger.info(f"Description cache hit for image {garment.sha256[:12]}")
+                return cached
+
+        if not OPENAI_API_KEY:
+            logger.warning("OPENAI_API_KEY not configured. Using default description.")
+            return DEFAULT_DESCRIPTION
+
+        pending = _in_flight.get(garment.sha256)
+        if pending is None:
+            pending = asyncio.ensure_future(_describe_and_cache(garment))
+            _in_flight[garment.sha256] = pending
+            pending.add_done_callback(lambda _: _in_flight.pop(garment.sha256, None))
+        else:
+            logger.info(f"Joining in-flight description for image {garment.sha256[:12]}")
+
+        # Shield so one cancelled waiter does not cancel the call the others share
+        return await asyncio.shield(pending)
+
     except Exception as e:
+        record_error("describe")
         logger.error(f"Error generating garment description: {str(e)}")
         # Fallback to default description
-        default_description = "a beautiful garment, professional fashion photography, high quality"
-        logger.warning(f"Using default description: {default_description}")
-        print(f"Error generating description, using default: {default_description}")
-        return default_description
-
+        logger.warning(f"Using default description: {DEFAULT_DESCRIPTION}")
+        print(f"Error generating description, using default: {DEFAULT_DESCRIPTION}")
+        return DEFAULT_DESCRIPTION
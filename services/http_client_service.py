@@ -0,0 +1,123 @@
+"""Shared, connection-pooled HTTP clients (opened and closed with the app lifespan)"""
+import importlib.util
+import logging
+from dataclasses import asdict, dataclass
+from typing import Dict
+# Imported eagerly, unlike the vendor SDKs: the clients are built in the app
+# lifespan, which uvicorn finishes before it binds the port, so a lazy import
+# would only move the cost, not take it off the path to a first /health
+import httpx
+from config import (
+    HTTP2_ENABLED,
+    HTTP_KEEPALIVE_EXPIRY,
+    DOWNLOAD_MAX_CONNECTIONS,
+    DOWNLOAD_CONNECT_TIMEOUT,
+    DOWNLOAD_READ_TIMEOUT,
+    MODAL_MAX_CONNECTIONS,
+    MODAL_CONNECT_TIMEOUT,
+    MODAL_READ_TIMEOUT,
+)
+
+logger = logging.getLogger(__name__)
+
+DOWNLOAD_PROFILE = "download"
+MODAL_PROFILE = "modal"
+
+
+@dataclass
+class ConnectionStats:
+    """Per-client counters; requests - new_connections = requests that reused a connection"""
+    requests: int = 0
+    new_connections: int = 0
+    tls_handshakes: int = 0
+
+    def as_dict(self) -> Dict[str, int]:
+        stats = asdict(self)
+        stats["reused_connections"] = max(0, self.requests - self.new_connections)
+        return stats
+
+
+_clients: Dict[str, httpx.AsyncClient] = {}
+_stats: Dict[str, ConnectionStats] = {}
+
+
+def _http2_available() -> bool:
+    if not HTTP2_ENABLED:
+        return False
+    if importlib.util.find_spec("h2") is None:
+        logger.warning("HTTP2_ENABLED is set but the 'h2' package is not installed. Falling back to HTTP/1.1.")
+        return False
+    return True
+
+
+def _build_client(profile: str) -> httpx.AsyncClient:
+    stats = _stats.setdefault(profile, ConnectionStats())
+
+    async def trace(event_name: str, info: dict):
+        # httpcore emits these only when it opens a new connection for the request
+        if event_name.endswith("connect_tcp.complete"):
+            stats.new_connections += 1
+        elif event_name.endswith("start_tls.complete"):
+            stats.tls_handshakes += 1
+
+    async def on_request(request: httpx.Request):
+        stats.requests += 1
+        request.extensions["trace"] = trace
+
+    if profile == DOWNLOAD_PROFILE:
+        limits = httpx.Limits(
+            max_connections=DOWNLOAD_MAX_CONNECTIONS,
+            max_keepalive_connections=DOWNLOAD_MAX_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        )
+        timeout = httpx.Timeout(DOWNLOAD_READ_TIMEOUT, connect=DOWNLOAD_CONNECT_TIMEOUT)
+    else:
+        limits = httpx.Limits(
+            max_connections=MODAL_MAX_CONNECTIONS,
+            max_keepalive_connections=MODAL_MAX_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        )
+        # GPU batches can take many minutes; read, write and pool waits share the long timeout
+        timeout = httpx.Timeout(MODAL_READ_TIMEOUT, connect=MODAL_CONNECT_TIMEOUT)
+
+    return httpx.AsyncClient(
+        limits=limits,
+        timeout=timeout,
+        http2=_http2_available(),
+        event_hooks={"request": [on_request]},
+    )
+
+
+def get_http_client(profile: str) -> httpx.AsyncClient:
+    """Return the shared client for a profile, creating it if the lifespan has not"""
+    client = _clients.get(profile)
+    if client is None or client.is_closed:
+        client = _build_client(profile)
+        _clients[profile] = client
+    return client
+
+
+def get_download_client() -> httpx.AsyncClient:
+    return get_http_client(DOWNLOAD_PROFILE)
+
+
+def get_modal_client() -> httpx.AsyncClient:
+    return get_http_client(MODAL_PROFILE)
+
+
+async def start_http_clients() -> Dict[str, httpx.AsyncClient]:
+    """Open the shared clients (called from the FastAPI lifespan)"""
+    for profile in (DOWNLOAD_PROFILE, MODAL_PROFILE):
+        get_http_client(profile)
+    logger.info(f"Opened shared HTTP clients: {list(_clients)} (http2={_http2_available()})")
+    return dict(_clients)
+
+
+async def close_http_clients():
+    for client in _clients.values():
+        await client.aclose()
+    _clients.clear()
+
+
+def get_http_client_stats() -> Dict[str, Dict[str, int]]:
+    return {profile: stats.as_dict() for profile, stats in _stats.items()}
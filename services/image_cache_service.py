@@ -0,0 +1,252 @@
+"""Content-addressed cache for downloaded images (memory LRU in front of a disk store)"""
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+from config import (
+    IMAGE_CACHE_DIR,
+    IMAGE_CACHE_DISK_BYTES,
+    IMAGE_CACHE_MEMORY_BYTES,
+    IMAGE_CACHE_FRESH_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class CachedImage:
+    """Original encoded bytes of a URL plus the validators needed to revalidate it"""
+    url: str
+    sha256: str
+    content_type: str
+    data: bytes
+    etag: Optional[str]
+    last_modified: Optional[str]
+    expires_at: float
+
+    def is_fresh(self) -> bool:
+        return time.time() < self.expires_at
+
+    def validators(self) -> Dict[str, str]:
+        """Conditional request headers for revalidating a stale entry"""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+def _http_date(value: Optional[str]) -> Optional[float]:
+    try:
+        return parsedate_to_datetime(value).timestamp() if value else None
+    except (TypeError, ValueError):
+        return None
+
+
+def freshness_lifetime(
+    cache_control: Optional[str],
+    expires: Optional[str] = None,
+    date: Optional[str] = None,
+    last_modified: Optional[str] = None,
+) -> Optional[float]:
+    """Seconds a response may be served without revalidation, or None if it must not be stored.
+
+    Explicit freshness (max-age, then Expires) wins. Otherwise the RFC 9111
+    heuristic applies: 10% of the time since Last-Modified, capped at
+    IMAGE_CACHE_FRESH_SECONDS. Without any of them the entry is stored but
+    revalidated on every use."""
+    directives = [d.strip().lower() for d in (cache_control or "").split(",") if d.strip()]
+    if "no-store" in directives:
+        return None
+    if "no-cache" in directives:
+        return 0.0
+    for directive in directives:
+        if directive.startswith("max-age="):
+            try:
+                return max(0.0, float(directive.split("=", 1)[1]))
+            except ValueError:
+                break
+    served_at = _http_date(date) or time.time()
+    if expires is not None:
+        # An invalid Expires (e.g. "0") means already expired
+        expires_at = _http_date(expires)
+        return max(0.0, expires_at - served_at) if expires_at is not None else 0.0
+    modified_at = _http_date(last_modified)
+    if modified_at is not None:
+        return min(max(0.0, (served_at - modified_at) * 0.1), IMAGE_CACHE_FRESH_SECONDS)
+    return 0.0
+
+
+class _DiskStore:
+    """Blobs stored under their SHA-256; a SQLite index maps URLs to blobs. Blocking API."""
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.blob_dir = os.path.join(directory, "blobs")
+        os.makedirs(self.blob_dir, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(directory, "index.sqlite3"), check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS blobs (sha256 TEXT PRIMARY KEY, size INTEGER NOT NULL)")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                url TEXT PRIMARY KEY,
+                sha256 TEXT NOT NULL,
+                content_type TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                expires_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_accessed ON entries (accessed_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_sha256 ON entries (sha256)")
+
+    def _blob_path(self, sha256: str) -> str:
+        return os.path.join(self.blob_dir, sha256[:2], sha256)
+
+    def get(self, url: str) -> Optional[CachedImage]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM entries WHERE url = ?", (url,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE entries SET accessed_at = ? WHERE url = ?", (time.time(), url))
+        try:
+            with open(self._blob_path(row["sha256"]), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            logger.warning(f"Image cache blob missing for {url}; dropping entry")
+            with self._lock:
+                self._conn.execute("DELETE FROM entries WHERE url = ?", (url,))
+            return None
+        return CachedImage(
+            url=url,
+            sha256=row["sha256"],
+            content_type=row["content_type"],
+            data=data,
+            etag=row["etag"],
+            last_modified=row["last_modified"],
+            expires_at=row["expires_at"],
+        )
+
+    def put(self, entry: CachedImage):
+        path = self._blob_path(entry.sha256)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(entry.data)
+            os.replace(tmp_path, path)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO blobs (sha256, size) VALUES (?, ?)", (entry.sha256, len(entry.data))
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (url, sha256, content_type, etag, last_modified, expires_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (entry.url, entry.sha256, entry.content_type, entry.etag, entry.last_modified, entry.expires_at, time.time()),
+            )
+            self._evict()
+
+    def refresh(self, url: str, expires_at: float):
+        with self._lock:
+            self._conn.execute("UPDATE entries SET expires_at = ?, accessed_at = ? WHERE url = ?", (expires_at, time.time(), url))
+
+    def _evict(self):
+        """Drop least recently used URLs until the blobs fit the size cap (lock held)"""
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+        while total > self.max_bytes:
+            row = self._conn.execute("SELECT url, sha256 FROM entries ORDER BY accessed_at LIMIT 1").fetchone()
+            if row is None:
+                break
+            self._conn.execute("DELETE FROM entries WHERE url = ?", (row["url"],))
+            still_referenced = self._conn.execute(
+                "SELECT 1 FROM entries WHERE sha256 = ? LIMIT 1", (row["sha256"],)
+            ).fetchone()
+            if still_referenced:
+                continue
+            size = self._conn.execute("SELECT size FROM blobs WHERE sha256 = ?", (row["sha256"],)).fetchone()
+            self._conn.execute("DELETE FROM blobs WHERE sha256 = ?", (row["sha256"],))
+            try:
+                os.remove(self._blob_path(row["sha256"]))
+            except FileNotFoundError:
+                pass
+            total -= size["size"] if size else 0
+
+
+class ImageCache:
+    """In-memory LRU (bounded by bytes) in front of the disk store"""
+
+    def __init__(self, directory: str, memory_bytes: int, disk_bytes: int):
+        self._disk = _DiskStore(directory, disk_bytes)
+        self._memory: "OrderedDict[str, CachedImage]" = OrderedDict()
+        self._memory_bytes = 0
+        self._memory_limit = memory_bytes
+        # memory/disk hits count found entries (fresh or stale); stale entries then end up
+        # either revalidated (304) or refetched (changed upstream)
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "revalidated": 0, "refetched": 0, "stores": 0}
+
+    def _remember(self, entry: CachedImage):
+        previous = self._memory.pop(entry.url, None)
+        if previous is not None:
+            self._memory_bytes -= len(previous.data)
+        if len(entry.data) > self._memory_limit:
+            return
+        self._memory[entry.url] = entry
+        self._memory_bytes += len(entry.data)
+        while self._memory_bytes > self._memory_limit:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted.data)
+
+    async def lookup(self, url: str) -> Optional[CachedImage]:
+        """Return the cached entry for a URL (fresh or stale), or None"""
+        entry = self._memory.get(url)
+        if entry is not None:
+            self._memory.move_to_end(url)
+            self.stats["memory_hits"] += 1
+            return entry
+        entry = await asyncio.to_thread(self._disk.get, url)
+        if entry is not None:
+            self.stats["disk_hits"] += 1
+            self._remember(entry)
+        else:
+            self.stats["misses"] += 1
+        return entry
+
+    async def store(self, entry: CachedImage):
+        self._remember(entry)
+        self.stats["stores"] += 1
+        await asyncio.to_thread(self._disk.put, entry)
+
+    async def revalidated(self, entry: CachedImage, lifetime: float) -> CachedImage:
+        """Record a 304 Not Modified: extend freshness without touching the bytes"""
+        refreshed = replace(entry, expires_at=time.time() + lifetime)
+        self._remember(refreshed)
+        self.stats["revalidated"] += 1
+        await asyncio.to_thread(self._disk.refresh, entry.url, refreshed.expires_at)
+        return refreshed
+
+
+_cache: Optional[ImageCache] = None
+
+
+def get_image_cache() -> ImageCache:
+    global _cache
+    if _cache is None:
+        _cache = ImageCache(IMAGE_CACHE_DIR, IMAGE_CACHE_MEMORY_BYTES, IMAGE_CACHE_DISK_BYTES)
+    return _cache
+
+
+def get_image_cache_stats() -> Dict[str, int]:
+    return dict(_cache.stats) if _cache is not None else {}
@@ -1,23 +1,138 @@
 """Image downloading and processing service"""
-import httpx
-from PIL import Image
+import asyncio
+import hashlib
+import time
+from dataclasses import dataclass, field
 from io import BytesIO
+from typing import TYPE_CHECKING, Dict, Optional
+from urllib.parse import urlsplit
 from fastapi import HTTPException
 import logging
+from config import IMAGE_HOST_CONCURRENCY, IMAGE_CACHE_ENABLED
+from services.http_client_service import get_download_client
+from services.image_cache_service import CachedImage, freshness_lifetime, get_image_cache
+from utils.metrics import BYTES_TRANSFERRED
+
+if TYPE_CHECKING:
+    from PIL import Image
 
 logger = logging.getLogger(__name__)
 
+# One semaphore per image host so a slow CDN cannot starve the others
+_host_semaphores: Dict[str, asyncio.Semaphore] = {}
 
-async def download_image(url: str) -> Image.Image:
-    """Download image from URL and return PIL Image"""
+# Leading bytes of the encodings we expect from image hosts
+_MAGIC_NUMBERS = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+
+_EXTENSIONS = {"image/png": "png", "image/jpeg": "jpg", "image/gif": "gif", "image/webp": "webp"}
+
+
+@dataclass
+class ImageBlob:
+    """Original encoded image bytes; pixels are decoded only when `image` is first read"""
+    data: bytes
+    content_type: str
+    sha256: str
+    _image: Optional["Image.Image"] = field(default=None, repr=False, compare=False)
+
+    @classmethod
+    def from_bytes(cls, data: bytes, content_type: Optional[str] = None) -> "ImageBlob":
+        return cls(data=data, content_type=sniff_content_type(data, content_type), sha256=hashlib.sha256(data).hexdigest())
+
+    def filename(self, stem: str) -> str:
+        """Upload filename whose extension matches the encoded bytes"""
+        return f"{stem}.{_EXTENSIONS.get(self.content_type, 'bin')}"
+
+    @property
+    def image(self) -> "Image.Image":
+        if self._image is None:
+            from PIL import Image
+
+            self._image = Image.open(BytesIO(self.data)).convert("RGB")
+        return self._image
+
+
+def sniff_content_type(data: bytes, declared: Optional[str] = None) -> str:
+    """Content type from the image's magic number, falling back to the declared header"""
+    for magic, content_type in _MAGIC_NUMBERS:
+        if data.startswith(magic):
+            return content_type
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if declared:
+        return declared.split(";", 1)[0].strip().lower()
+    return "application/octet-stream"
+
+
+def _host_semaphore(url: str) -> asyncio.Semaphore:
+    host = urlsplit(url).netloc
+    semaphore = _host_semaphores.get(host)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(IMAGE_HOST_CONCURRENCY)
+        _host_semaphores[host] = semaphore
+    return semaphore
+
+
+def _verify_image(data: bytes):
+    """Cheap validity check: parses the header only, no pixel decode"""
+    from PIL import Image
+
+    Image.open(BytesIO(data)).verify()
+
+
+async def fetch_image(url: str) -> ImageBlob:
+    """Download image bytes from URL (through the cache) without decoding pixels"""
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.get(url)
-            response.raise_for_status()
-            img = Image.open(BytesIO(response.content)).convert("RGB")
-            logger.info(f"Downloaded image from: {url}")
-            return img
+        cache = get_image_cache() if IMAGE_CACHE_ENABLED else None
+        cached: Optional[CachedImage] = await cache.lookup(url) if cache else None
+        if cached is not None and cached.is_fresh():
+            logger.info("Image cache hit for: %s", url)
+            return ImageBlob(data=cached.data, content_type=cached.content_type, sha256=cached.sha256)
+
+        async with _host_semaphore(url):
+            headers = cached.validators() if cached is not None else {}
+            response = await get_download_client().get(url, headers=headers)
+
+        lifetime = freshness_lifetime(
+            response.headers.get("cache-control"),
+            expires=response.headers.get("expires"),
+            date=response.headers.get("date"),
+            last_modified=response.headers.get("last-modified") or (cached.last_modified if cached is not None else None),
+        )
+        if response.status_code == 304 and cached is not None:
+            await cache.revalidated(cached, lifetime or 0.0)
+            logger.info("Image cache revalidated (304) for: %s", url)
+            return ImageBlob(data=cached.data, content_type=cached.content_type, sha256=cached.sha256)
+        response.raise_for_status()
+
+        data = response.content
+        BYTES_TRANSFERRED.labels("in", "image_host").inc(len(data))
+        _verify_image(data)
+        blob = ImageBlob.from_bytes(data, response.headers.get("content-type"))
+        if cache is not None and lifetime is not None:
+            if cached is not None:
+                cache.stats["refetched"] += 1
+            await cache.store(CachedImage(
+                url=url,
+                sha256=blob.sha256,
+                content_type=blob.content_type,
+                data=data,
+                etag=response.headers.get("etag"),
+                last_modified=response.headers.get("last-modified"),
+                expires_at=time.time() + lifetime,
+            ))
+        logger.info("Downloaded image from: %s (%d bytes, %s)", url, len(data), blob.content_type)
+        return blob
     except Exception as e:
         logger.error(f"Error downloading image from {url}: {str(e)}")
         raise HTTPException(status_code=400, detail=f"Failed to download image from URL: {str(e)}")
 
+
+async def download_image(url: str) -> "Image.Image":
+    """Download image from URL and return PIL Image"""
+    return (await fetch_image(url)).image
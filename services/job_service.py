@@ -0,0 +1,352 @@
+"""Persistent try-on job queue (SQLite) with a pool of async workers"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+from utils.job_context import JobContext, current_job
+from utils.metrics import JOBS_FINISHED, STAGE_SECONDS
+from utils.scheduler import wait_summary
+from utils.tracing import start_span
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+
+# How long an idle worker sleeps before polling the store again (covers jobs
+# enqueued by another process sharing the same database file)
+IDLE_POLL_SECONDS = 1.0
+# Pause after an unexpected worker error (e.g. the database is locked or the
+# disk is full) before the worker tries the store again
+WORKER_ERROR_BACKOFF_SECONDS = 5.0
+
+
+def _dedupe_key(payload: Dict[str, Any]) -> str:
+    """Identical submissions share a key and attach to the same in-flight job"""
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class JobStore:
+    """SQLite-backed job table. All methods are blocking; call them via asyncio.to_thread."""
+
+    def __init__(self, db_path: str):
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                state TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                timings TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                dedupe_key TEXT,
+                priority INTEGER NOT NULL DEFAULT 0,
+                cost INTEGER NOT NULL DEFAULT 1,
+                traceparent TEXT
+            )
+            """
+        )
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        if "dedupe_key" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN dedupe_key TEXT")
+        if "priority" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN priority INTEGER NOT NULL DEFAULT 0")
+        if "cost" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN cost INTEGER NOT NULL DEFAULT 1")
+        if "traceparent" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN traceparent TEXT")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_state_created ON jobs (state, created_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_dedupe_key ON jobs (dedupe_key, state)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_finished ON jobs (finished_at)")
+
+    def find_active(self, dedupe_key: str) -> Optional[str]:
+        """Id of the queued or running job with this dedupe key, if any"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id FROM jobs WHERE dedupe_key = ? AND state IN (?, ?) ORDER BY created_at LIMIT 1",
+                (dedupe_key, JOB_QUEUED, JOB_RUNNING),
+            ).fetchone()
+        return row["id"] if row is not None else None
+
+    def create(
+        self,
+        payload: Dict[str, Any],
+        dedupe_key: Optional[str] = None,
+        priority: int = 0,
+        cost: int = 1,
+        traceparent: Optional[str] = None,
+    ) -> Tuple[str, bool]:
+        """Insert a queued job, or return the queued/running job with the same dedupe key.
+
+        Returns (job_id, created)."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if dedupe_key is not None:
+                    row = self._conn.execute(
+                        "SELECT id FROM jobs WHERE dedupe_key = ? AND state IN (?, ?) ORDER BY created_at LIMIT 1",
+                        (dedupe_key, JOB_QUEUED, JOB_RUNNING),
+                    ).fetchone()
+                    if row is not None:
+                        self._conn.execute("COMMIT")
+                        return row["id"], False
+                job_id = uuid.uuid4().hex
+                self._conn.execute(
+                    "INSERT INTO jobs (id, state, payload, created_at, dedupe_key, priority, cost, traceparent) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (job_id, JOB_QUEUED, json.dumps(payload), time.time(), dedupe_key, priority, cost, traceparent),
+                )
+                self._conn.execute("COMMIT")
+                return job_id, True
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def claim_next(self, priority_boost: float = 0.0) -> Optional[sqlite3.Row]:
+        """Atomically move the next queued job to running and return it.
+
+        Jobs run oldest first, each priority level counting as `priority_boost`
+        seconds of extra age, so higher priorities go ahead by a bounded amount."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT id FROM jobs WHERE state = ? ORDER BY created_at - priority * ? LIMIT 1",
+                    (JOB_QUEUED, priority_boost),
+                ).fetchone()
+                if row is None:
+                    self._conn.execute("COMMIT")
+                    return None
+                self._conn.execute(
+                    "UPDATE jobs SET state = ?, started_at = ?, attempts = attempts + 1 WHERE id = ?",
+                    (JOB_RUNNING, time.time(), row["id"]),
+                )
+                claimed = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone()
+                self._conn.execute("COMMIT")
+                return claimed
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def finish(self, job_id: str, state: str, result: Any, error: Optional[str], timings: Dict[str, float]):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET state = ?, result = ?, error = ?, timings = ?, finished_at = ? WHERE id = ?",
+                (state, json.dumps(result) if result is not None else None, error, json.dumps(timings), time.time(), job_id),
+            )
+
+    def recover_interrupted(self, max_attempts: int) -> int:
+        """Requeue jobs left running by a previous process; fail those out of attempts"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET state = ?, error = ?, finished_at = ? WHERE state = ? AND attempts >= ?",
+                (JOB_FAILED, "Job interrupted too many times", time.time(), JOB_RUNNING, max_attempts),
+            )
+            cursor = self._conn.execute(
+                "UPDATE jobs SET state = ?, started_at = NULL WHERE state = ?", (JOB_QUEUED, JOB_RUNNING)
+            )
+            return cursor.rowcount
+
+    def count_by_state(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT state, COUNT(*) FROM jobs WHERE state IN (?, ?) GROUP BY state", (JOB_QUEUED, JOB_RUNNING)).fetchall()
+        return {JOB_QUEUED: 0, JOB_RUNNING: 0, **{row[0]: row[1] for row in rows}}
+
+    def pending_cost(self) -> int:
+        """Total cost (e.g. garments) of queued and running jobs"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COALESCE(SUM(cost), 0) FROM jobs WHERE state IN (?, ?)", (JOB_QUEUED, JOB_RUNNING)
+            ).fetchone()
+        return row[0]
+
+    def completed_cost_since(self, since: float) -> int:
+        """Total cost of jobs that finished (either way) after `since`"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COALESCE(SUM(cost), 0) FROM jobs WHERE state IN (?, ?) AND finished_at >= ?",
+                (JOB_COMPLETED, JOB_FAILED, since),
+            ).fetchone()
+        return row[0]
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        return {
+            "job_id": row["id"],
+            "state": row["state"],
+            "attempts": row["attempts"],
+            "created_at": row["created_at"],
+            "started_at": row["started_at"],
+            "finished_at": row["finished_at"],
+            "timings": json.loads(row["timings"]) if row["timings"] else {},
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "error": row["error"],
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class JobQueue:
+    """Runs queued jobs through `handler` with at most `worker_count` jobs in flight"""
+
+    def __init__(
+        self,
+        store: JobStore,
+        handler: Callable[..., Awaitable[Any]],
+        worker_count: int,
+        max_attempts: int,
+        priority_boost: float = 0.0,
+    ):
+        self.store = store
+        self.handler = handler
+        self.worker_count = max(1, worker_count)
+        self.max_attempts = max_attempts
+        self.priority_boost = priority_boost
+        self._wakeup = asyncio.Event()
+        self._workers: List[asyncio.Task] = []
+        self.stats = {"submitted": 0, "deduplicated": 0, "worker_errors": 0}
+        self.running = 0
+        self._queue_waits: Dict[int, Deque[float]] = defaultdict(lambda: deque(maxlen=1000))
+
+    async def start(self):
+        recovered = await asyncio.to_thread(self.store.recover_interrupted, self.max_attempts)
+        if recovered:
+            logger.info(f"Requeued {recovered} job(s) interrupted by a previous shutdown")
+        self._workers = [
+            asyncio.create_task(self._worker(index), name=f"tryon-worker-{index}")
+            for index in range(self.worker_count)
+        ]
+        logger.info(f"Started {self.worker_count} try-on worker(s)")
+
+    async def stop(self):
+        """Cancel workers; running jobs stay marked running and are requeued on next start"""
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        await asyncio.to_thread(self.store.close)
+
+    async def submit(
+        self,
+        payload: Dict[str, Any],
+        priority: int = 0,
+        cost: int = 1,
+        traceparent: Optional[str] = None,
+    ) -> Tuple[str, bool]:
+        """Queue a job; an identical payload that is still queued or running is attached to instead.
+        Returns (job_id, whether a new job was created).
+
+        `traceparent` (W3C) makes the job's spans part of the submitting request's trace."""
+        job_id, created = await asyncio.to_thread(self.store.create, payload, _dedupe_key(payload), priority, cost, traceparent)
+        if created:
+            self.stats["submitted"] += 1
+            self._wakeup.set()
+        else:
+            self.stats["deduplicated"] += 1
+            logger.info(f"Duplicate submission attached to in-flight job {job_id}")
+        return job_id, created
+
+    async def find_duplicate(self, payload: Dict[str, Any]) -> Optional[str]:
+        """Id of a queued or running job that submit(payload) would attach to"""
+        return await asyncio.to_thread(self.store.find_active, _dedupe_key(payload))
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self.store.get, job_id)
+
+    async def count_by_state(self) -> Dict[str, int]:
+        return await asyncio.to_thread(self.store.count_by_state)
+
+    async def pending_cost(self) -> int:
+        return await asyncio.to_thread(self.store.pending_cost)
+
+    async def throughput(self, window: float) -> Tuple[int, float]:
+        """(cost finished in the last `window` seconds, cost per second over the window)"""
+        finished = await asyncio.to_thread(self.store.completed_cost_since, time.time() - window)
+        return finished, finished / window
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Submission counters and queue wait percentiles per priority"""
+        return {
+            **self.stats,
+            "queue_wait_by_priority": {priority: wait_summary(waits) for priority, waits in sorted(self._queue_waits.items())},
+        }
+
+    async def _worker(self, index: int):
+        # An unexpected error must not end the worker: log it, back off and keep
+        # serving the queue. A job left running is requeued on the next start.
+        while True:
+            try:
+                await self._run_next()
+            except Exception:
+                self.stats["worker_errors"] += 1
+                logger.exception(f"Job worker {index} failed; retrying in {WORKER_ERROR_BACKOFF_SECONDS:.0f}s")
+                await asyncio.sleep(WORKER_ERROR_BACKOFF_SECONDS)
+
+    async def _run_next(self):
+        row = await asyncio.to_thread(self.store.claim_next, self.priority_boost)
+        if row is None:
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=IDLE_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            return
+        await self._run(row)
+
+    async def _run(self, row: sqlite3.Row):
+        job = JobContext(job_id=row["id"])
+        job.timings["queue_wait"] = row["started_at"] - row["created_at"]
+        self._queue_waits[row["priority"]].append(job.timings["queue_wait"])
+        token = current_job.set(job)
+        start = time.perf_counter()
+        self.running += 1
+        try:
+            logger.info(f"Job {job.job_id} started (attempt {row['attempts']})")
+            with start_span(
+                "tryon.job",
+                parent=row["traceparent"],
+                job_id=job.job_id,
+                attempt=row["attempts"],
+                queue_wait_seconds=job.timings["queue_wait"],
+            ):
+                result = await self.handler(**json.loads(row["payload"]))
+            state, error = JOB_COMPLETED, None
+        except asyncio.CancelledError:
+            # Shutdown: leave the job running so the next process requeues it
+            raise
+        except Exception as e:
+            result, state, error = None, JOB_FAILED, str(e)
+        finally:
+            self.running -= 1
+            current_job.reset(token)
+        job.timings["total"] = time.perf_counter() - start
+        STAGE_SECONDS.labels("queue_wait", job.tier).observe(job.timings["queue_wait"])
+        STAGE_SECONDS.labels("total", job.tier).observe(job.timings["total"])
+        JOBS_FINISHED.labels(job.tier, state).inc()
+        await asyncio.to_thread(self.store.finish, job.job_id, state, result, error, job.timings)
+        logger.info(f"Job {job.job_id} {state} in {job.timings['total']:.2f}s")
@@ -0,0 +1,74 @@
+"""Prometheus exposition: pipeline metrics plus gauges read from the running services"""
+from typing import Dict, Iterable
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Gauge, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from services.job_service import JobQueue
+from services.image_cache_service import get_image_cache_stats
+from services.description_cache_service import get_description_cache_stats
+from services.result_cache_service import get_result_cache_stats
+from services.email_outbox_service import get_email_outbox_stats
+from services.modal_service import modal_batch_sizer, modal_limiter, modal_scheduler
+
+JOBS = Gauge("tryon_jobs", "Jobs in the queue by state (all processes sharing the job database)", ["state"])
+JOBS_IN_FLIGHT = Gauge("tryon_jobs_in_flight", "Jobs running in this process")
+MODAL_LIMIT = Gauge("tryon_modal_concurrency_limit", "Current adaptive limit on concurrent Modal batches")
+MODAL_IN_FLIGHT = Gauge("tryon_modal_batches_in_flight", "Modal batches currently running")
+MODAL_WAITING = Gauge("tryon_modal_batches_waiting", "Modal batches waiting for a slot", ["tier"])
+MODAL_BATCH_MODEL = Gauge(
+    "tryon_modal_batch_model_seconds", "Fitted Modal request time: per-request overhead and per-garment time", ["term"]
+)
+
+METRICS_CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+
+def _hit_ratio(hits: int, misses: int) -> float:
+    return hits / (hits + misses) if hits + misses else 0.0
+
+
+class _CacheCollector:
+    """Exports the caches' and email outbox's own counters at scrape time (no per-request cost)"""
+
+    def collect(self) -> Iterable:
+        events = CounterMetricFamily("tryon_cache_events", "Cache lookups and stores", labels=["cache", "event"])
+        ratios = GaugeMetricFamily("tryon_cache_hit_ratio", "Cache hits / lookups since start", labels=["cache"])
+        caches: Dict[str, Dict] = {
+            "image": get_image_cache_stats(),
+            "description": get_description_cache_stats(),
+            "result": get_result_cache_stats(),
+        }
+        for cache, stats in caches.items():
+            for event, value in stats.items():
+                if event != "hit_ratio":
+                    events.add_metric([cache, event], value)
+        image = caches["image"]
+        if image:
+            ratios.add_metric(["image"], _hit_ratio(image["memory_hits"] + image["disk_hits"], image["misses"]))
+        for cache in ("description", "result"):
+            if caches[cache]:
+                ratios.add_metric([cache], _hit_ratio(caches[cache]["hits"], caches[cache]["misses"]))
+        yield events
+        yield ratios
+
+        emails = CounterMetricFamily("tryon_email_outbox_events", "Email outbox activity", labels=["event"])
+        for event, value in get_email_outbox_stats().items():
+            emails.add_metric([event], value)
+        yield emails
+
+
+REGISTRY.register(_CacheCollector())
+
+
+async def render_metrics(job_queue: JobQueue) -> bytes:
+    """Refresh the point-in-time gauges and render every metric in the text format"""
+    for state, count in (await job_queue.count_by_state()).items():
+        JOBS.labels(state).set(count)
+    JOBS_IN_FLIGHT.set(job_queue.running)
+    MODAL_LIMIT.set(modal_limiter.limit)
+    MODAL_IN_FLIGHT.set(modal_limiter.in_flight)
+    for tier, tier_stats in modal_scheduler.snapshot().items():
+        MODAL_WAITING.labels(tier).set(tier_stats["waiting"])
+    fitted = modal_batch_sizer.model()
+    if fitted is not None:
+        MODAL_BATCH_MODEL.labels("overhead").set(fitted[0])
+        MODAL_BATCH_MODEL.labels("per_garment").set(fitted[1])
+    return generate_latest()
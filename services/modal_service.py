@@ -1,113 +1,649 @@
 """Modal API service for virtual try-on processing"""
+import asyncio
+import hashlib
 import httpx
+import json
+import struct
+import time
 import zipfile
 import random
-from PIL import Image
+from contextlib import asynccontextmanager
+from functools import partial
 from io import BytesIO
-from typing import Dict
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
 from fastapi import HTTPException
 import logging
-from config import MODAL_ENDPOINT
+from services.image_service import ImageBlob
+from config import (
+    MODAL_ENDPOINTS,
+    MODAL_INITIAL_CONCURRENCY,
+    MODAL_MIN_CONCURRENCY,
+    MODAL_MAX_CONCURRENCY,
+    MODAL_LATENCY_TARGET_PER_GARMENT,
+    MODAL_STREAMING,
+    MODAL_HEDGE_ENABLED,
+    MODAL_HEDGE_PERCENTILE,
+    MODAL_HEDGE_MIN_SAMPLES,
+    MODAL_HEDGE_HISTORY,
+    MODAL_MAX_ATTEMPTS,
+    MODAL_GARMENT_RETRY_BUDGET,
+    MODAL_BATCH_TARGET_SECONDS,
+    MODAL_BATCH_MAX_SIZE,
+    MODAL_BATCH_DEFAULT_SIZE,
+    MODAL_BATCH_MIN_SAMPLES,
+    MODAL_RETRY_BACKOFF,
+    JOB_DEADLINE_SECONDS,
+    MODAL_BREAKER_FAILURES,
+    MODAL_BREAKER_RESET_SECONDS,
+    MODAL_CONNECT_TIMEOUT,
+    MODAL_READ_TIMEOUT,
+    WORKER_LIMITS_TTL_SECONDS,
+    WORKER_LIMITS_RETRY_SECONDS,
+    SCHEDULER_TIER_WEIGHTS,
+    SCHEDULER_PER_USER_CONCURRENCY,
+    SCHEDULER_MAX_WAIT_SECONDS,
+)
+from services.http_client_service import get_modal_client
+from utils.balancer import EndpointBalancer
+from utils.batch_sizer import BatchSizer
+from utils.circuit_breaker import CircuitBreaker, CircuitOpenError
+from utils.hedging import HedgeLost, LatencyHistory, hedged
+from utils.job_context import current_job, job_time_left, record_error, stage
+from utils.limiter import AdaptiveLimiter
+from utils.metrics import (
+    BYTES_TRANSFERRED,
+    MODAL_BATCH_SIZE,
+    MODAL_ENDPOINT_IN_FLIGHT,
+    MODAL_ENDPOINT_SECONDS,
+    MODAL_RESILIENCE,
+)
+from utils.scheduler import PriorityScheduler
+from utils.tracing import export_remote_spans, traceparent
 
 logger = logging.getLogger(__name__)
 
+# Shared by every job: caps concurrent /tryon/batch requests and adapts the cap
+# to Modal's behaviour (grows while batches are fast, halves on 429/5xx/timeouts)
+modal_limiter = AdaptiveLimiter(
+    initial=MODAL_INITIAL_CONCURRENCY,
+    minimum=MODAL_MIN_CONCURRENCY,
+    maximum=MODAL_MAX_CONCURRENCY,
+    latency_target=MODAL_LATENCY_TARGET_PER_GARMENT,
+)
 
-async def process_tryon_batch_with_modal(
-    person_img: Image.Image, 
-    garment_images: Dict[str, Image.Image], 
-    endpoint: str,
-    garment_descriptions: Dict[str, str] = None
-) -> Dict[str, Image.Image]:
-    """Call Modal batch endpoint to process multiple garments with one person image"""
+# Decides which waiting batch gets the next limiter slot: weighted-fair between
+# subscription tiers, capped per user, with aging so trial batches never starve
+modal_scheduler = PriorityScheduler(
+    modal_limiter,
+    weights=SCHEDULER_TIER_WEIGHTS,
+    per_user_limit=SCHEDULER_PER_USER_CONCURRENCY,
+    max_wait=SCHEDULER_MAX_WAIT_SECONDS,
+)
+
+# Garments per batch request, from a model of recent request timings. The target stays
+# well inside the read timeout so a slow batch is not cut off (which would waste its work).
+modal_batch_sizer = BatchSizer(
+    target_seconds=min(MODAL_BATCH_TARGET_SECONDS, MODAL_READ_TIMEOUT / 2),
+    max_size=MODAL_BATCH_MAX_SIZE,
+    default_size=MODAL_BATCH_DEFAULT_SIZE,
+    min_samples=MODAL_BATCH_MIN_SAMPLES,
+)
+
+
+def plan_batch_size(garment_count: int) -> int:
+    """Garments per Modal request for a job of `garment_count` garments"""
+    if garment_count < 1:
+        return 1  # everything came from the result cache or an identical in-flight job
+    size, basis = modal_batch_sizer.size_for(garment_count)
+    MODAL_BATCH_SIZE.labels(basis).observe(size)
+    return size
+
+
+# Inference parameters sent with every batch (the seed is drawn per request,
+# so any two results for the same key are equally valid)
+SEED_POLICY = "random"
+TRYON_PARAMS = {
+    "auto_mask": "true",
+    "auto_crop": "false",
+    "denoise_steps": "30",
+}
+
+
+def tryon_key(person: ImageBlob, garment: ImageBlob, description: str) -> str:
+    """Content hash identifying one garment's try-on: identical keys give interchangeable results"""
+    parts = [person.sha256, garment.sha256, description, json.dumps(TRYON_PARAMS, sort_keys=True), SEED_POLICY]
+    return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()
+
+
+def _is_overload(error: Exception) -> bool:
+    """429, 5xx and timeouts mean Modal is saturated (or scaling) rather than the request being bad"""
+    if isinstance(error, httpx.TimeoutException):
+        return True
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code == 429 or error.response.status_code >= 500
+    return False
+
+
+# Assumed for workers that predate GET /limits or could not be asked (matches the
+# modal_deploy.py defaults). There is deliberately no model_version: without one the
+# result cache is bypassed rather than keyed by a made-up version.
+DEFAULT_WORKER_LIMITS = {
+    "max_process_side": 1024,
+    "size_multiple": 8,
+    "default_size": [768, 1024],
+    "input_formats": ["image/png", "image/jpeg"],
+}
+
+# endpoint -> (expires_at, limits)
+_worker_limits: Dict[str, Tuple[float, dict]] = {}
+
+
+async def get_worker_limits(endpoint: str) -> dict:
+    """Resolution limits advertised by the worker's GET /limits (cached for WORKER_LIMITS_TTL_SECONDS).
+
+    A failed fetch (e.g. a timeout during a cold start) falls back to the last known
+    limits, else DEFAULT_WORKER_LIMITS, and is retried after WORKER_LIMITS_RETRY_SECONDS."""
+    cached = _worker_limits.get(endpoint)
+    if cached is not None and time.monotonic() < cached[0]:
+        return cached[1]
     try:
-        # Convert person image to bytes (read content, not buffer object)
-        person_buffer = BytesIO()
-        person_img.save(person_buffer, format="PNG")
-        person_bytes = person_buffer.getvalue()
-        
-        # Convert all garment images to bytes
-        garment_files = []
-        for product_id, garment_img in garment_images.items():
-            garment_buffer = BytesIO()
-            garment_img.save(garment_buffer, format="PNG")
-            garment_bytes = garment_buffer.getvalue()
-            garment_files.append((product_id, garment_bytes))
-        
-        # Prepare files for multipart form data (matching test_tryon_api.py format)
-        # httpx needs tuple format: (field_name, (filename, file_content, content_type))
-        # IMPORTANT: human_image first, then garment_images (same order as test file)
-        files = [("human_image", ("person.png", person_bytes, "image/png"))]
-        logger.info(f"Prepared human_image (person/avatar): {len(person_bytes)} bytes")
-        
-        for product_id, garment_bytes in garment_files:
-            files.append(("garment_images", (f"{product_id}.png", garment_bytes, "image/png")))
-            logger.info(f"Prepared garment_image for product {product_id}: {len(garment_bytes)} bytes")
-        
-        # Generate random seed for each request (ensures unique results)
-        random_seed = random.randint(0, 2**31 - 1)
-        
-        # Prepare form data (as strings, matching test file format)
-        data = {
-            "auto_mask": "true",
-            "auto_crop": "false",
-            "denoise_steps": "30",
-            "seed": str(random_seed)
-        }
-        logger.info(f"Request parameters: seed={data['seed']} (random), denoise_steps={data['denoise_steps']}, auto_mask={data['auto_mask']}, auto_crop={data['auto_crop']}")
-        
-        # Add garment descriptions if provided
-        if garment_descriptions:
-            # Convert descriptions dict to JSON array format (matching modal_deploy.py format)
-            import json
-            # Create descriptions list in the same order as garment_files
-            descriptions_list = []
-            product_id_order = []
-            for product_id, _ in garment_files:
-                product_id_order.append(product_id)
-                if product_id in garment_descriptions:
-                    descriptions_list.append(garment_descriptions[product_id])
-                    logger.info(f"Mapped description for product {product_id}: {garment_descriptions[product_id][:80]}..." if len(garment_descriptions[product_id]) > 80 else f"Mapped description for product {product_id}: {garment_descriptions[product_id]}")
-                else:
-                    # Fallback to default if description missing
-                    default_desc = "a beautiful garment, professional fashion photography, high quality"
-                    descriptions_list.append(default_desc)
-                    logger.warning(f"No description found for product {product_id}, using default")
-            
-            # Send as JSON array string (modal_deploy.py expects this format)
-            data["garment_descriptions"] = json.dumps(descriptions_list)
-            logger.info(f"Added {len(descriptions_list)} garment descriptions to request in order: {product_id_order}")
-            for idx, (product_id, desc) in enumerate(zip(product_id_order, descriptions_list)):
-                logger.info(f"  [{idx + 1}] Product {product_id}: {desc[:100]}..." if len(desc) > 100 else f"  [{idx + 1}] Product {product_id}: {desc}")
-        
-        logger.info(f"Sending to Modal: 1 human_image + {len(garment_files)} garment_images")
-        logger.info(f"Request data being sent: {data}")
-        
-        # Make request to Modal batch endpoint (matching test file timeout)
-        async with httpx.AsyncClient(timeout=1200.0) as client:  # 20 minutes like test file
-            logger.info(f"Calling Modal batch endpoint: {endpoint}/tryon/batch")
-            response = await client.post(f"{endpoint}/tryon/batch", files=files, data=data)
-            response.raise_for_status()
-            
-            logger.info(f"Received response from Modal, extracting ZIP file")
-            # Extract zip file
-            zip_buffer = BytesIO(response.content)
-            result_images = {}
-            
-            with zipfile.ZipFile(zip_buffer, 'r') as zip_file:
-                # Map each file in zip to product_id
-                file_list = zip_file.namelist()
-                logger.info(f"ZIP contains {len(file_list)} files: {file_list}")
-                for idx, (product_id, _) in enumerate(garment_files):
-                    # Find corresponding output file (usually output_1_*.png, output_2_*.png, etc.)
-                    matching_files = [f for f in file_list if f.startswith(f"output_{idx + 1}_") and f.endswith(".png")]
-                    if matching_files:
-                        img_data = zip_file.read(matching_files[0])
-                        result_images[product_id] = Image.open(BytesIO(img_data)).convert("RGB")
-                        logger.info(f"Extracted image for product {product_id} from {matching_files[0]}")
-                    else:
-                        logger.warning(f"Could not find output image for product {product_id} (index {idx + 1})")
+        response = await get_modal_client().get(f"{endpoint}/limits", timeout=MODAL_CONNECT_TIMEOUT)
+        response.raise_for_status()
+        limits = {**DEFAULT_WORKER_LIMITS, **response.json()}
+        ttl = WORKER_LIMITS_TTL_SECONDS
+    except Exception as e:
+        limits = cached[1] if cached is not None else DEFAULT_WORKER_LIMITS
+        ttl = WORKER_LIMITS_RETRY_SECONDS
+        logger.warning(f"Could not fetch worker limits from {endpoint}: {str(e)}. Using {limits}")
+    _worker_limits[endpoint] = (time.monotonic() + ttl, limits)
+    return limits
+
+
+class StreamingNotSupported(Exception):
+    """The worker has no /tryon/batch/stream endpoint (older deployment)"""
+
+
+class StreamInterrupted(Exception):
+    """The worker's frame stream broke off before its end frame"""
+
+
+class ModalBatchError(Exception):
+    """The worker reported the whole batch as failed (end frame with status "error")"""
+
+
+# Endpoints that answered 404/405 on the streaming route; they only get ZIP batches from then on
+_streaming_unsupported: Dict[str, bool] = {}
+
+
+@asynccontextmanager
+async def _limiter_slot(garment_count: int, tier: Optional[str], user_id: Optional[str]):
+    """Hold a slot of the adaptive Modal limiter for one batch request (granted by the scheduler)"""
+    with stage("gpu_wait"):
+        await modal_scheduler.acquire(tier, user_id)
+    start = time.perf_counter()
+    try:
+        with stage("modal"):
+            yield
+    except BaseException as e:
+        # Also covers cancellation, which must not leak the slot
+        modal_scheduler.release(tier, user_id, overloaded=isinstance(e, Exception) and _is_overload(e))
+        raise
+    elapsed = time.perf_counter() - start
+    modal_scheduler.release(tier, user_id, latency=elapsed / max(1, garment_count))
+    logger.info(f"Modal batch of {garment_count} garment(s) took {elapsed:.1f}s (limit now {modal_limiter.limit:.2f})")
+
+
+async def _read_frames(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[dict, bytes]]:
+    """Parse the worker's frame stream: 4-byte big-endian header length, JSON header, payload"""
+    buffer = bytearray()
+    async for chunk in chunks:
+        buffer.extend(chunk)
+        while len(buffer) >= 4:
+            header_length = struct.unpack(">I", buffer[:4])[0]
+            if len(buffer) < 4 + header_length:
+                break
+            header = json.loads(bytes(buffer[4:4 + header_length]))
+            frame_end = 4 + header_length + header.get("length", 0)
+            if len(buffer) < frame_end:
+                break
+            payload = bytes(buffer[4 + header_length:frame_end])
+            del buffer[:frame_end]
+            yield header, payload
+    if buffer:
+        raise StreamInterrupted(f"Modal stream ended inside a frame ({len(buffer)} bytes left)")
+
+
+# Service name the worker's spans are exported under
+WORKER_SERVICE_NAME = "tryon-worker"
+
+# ZIP entry holding the worker's spans (OTLP/JSON list) for the non-streaming endpoint
+TRACE_SPANS_ENTRY = "trace_spans.json"
+
+# ZIP entry listing each garment's status ({"garments": [{"index", "status", "file" | "error"}]})
+MANIFEST_ENTRY = "manifest.json"
+
+
+def _trace_headers() -> Dict[str, str]:
+    """traceparent header continuing the current span on the worker (empty outside a trace)"""
+    header = traceparent()
+    return {"traceparent": header} if header else {}
+
+
+# Recent latencies of successful calls: time to the first streamed result, and
+# seconds per garment of ZIP batches. A call still unanswered at the hedge
+# percentile of these gets a duplicate request.
+_hedge_history = {
+    "stream": LatencyHistory(MODAL_HEDGE_HISTORY, MODAL_HEDGE_MIN_SAMPLES),
+    "zip": LatencyHistory(MODAL_HEDGE_HISTORY, MODAL_HEDGE_MIN_SAMPLES),
+}
+
+# endpoint -> circuit breaker guarding its batch routes
+_circuit_breakers: Dict[str, CircuitBreaker] = {}
+
+# Spreads batch requests over the GPU endpoints (MODAL_ENDPOINTS) by weight, load and
+# latency. An endpoint whose circuit is open is ejected until its probe succeeds.
+modal_balancer = EndpointBalancer(MODAL_ENDPOINTS)
+
+resilience_stats = {"hedges": 0, "hedges_won": 0, "retries": 0, "garment_retries": 0, "circuit_rejections": 0}
+
+# A request to one endpoint: attempt(endpoint, claim) (see utils.hedging.hedged for claim)
+EndpointAttempt = Callable[[str, Callable[[], bool]], Awaitable[Any]]
+
+
+def circuit_breaker(endpoint: str) -> CircuitBreaker:
+    breaker = _circuit_breakers.get(endpoint)
+    if breaker is None:
+        breaker = CircuitBreaker(endpoint, MODAL_BREAKER_FAILURES, MODAL_BREAKER_RESET_SECONDS)
+        _circuit_breakers[endpoint] = breaker
+    return breaker
+
+
+def _count(event: str, stat: str, amount: int = 1):
+    resilience_stats[stat] += amount
+    MODAL_RESILIENCE.labels(event).inc(amount)
+
+
+def _is_retryable(error: Exception) -> bool:
+    """Failures of the endpoint rather than of the request: worth a retry, and counted by the breaker"""
+    return _is_overload(error) or isinstance(error, (httpx.TransportError, StreamInterrupted, ModalBatchError))
+
+
+def _hedge_delay(mode: str, garment_count: int) -> Optional[float]:
+    if not MODAL_HEDGE_ENABLED:
+        return None
+    delay = _hedge_history[mode].percentile(MODAL_HEDGE_PERCENTILE)
+    if delay is None:
+        return None
+    return delay * garment_count if mode == "zip" else delay
+
+
+def _pick_endpoint(mode: str, avoid: Tuple[str, ...] = ()) -> Optional[str]:
+    """Endpoint for the next `mode` request whose circuit lets it through (None if there is none)"""
+    def available(endpoint: str) -> bool:
+        if mode == "stream" and _streaming_unsupported.get(endpoint):
+            return False
+        return circuit_breaker(endpoint).available()
+    return modal_balancer.pick(available, avoid)
+
+
+def _no_endpoint() -> CircuitOpenError:
+    _count("circuit_rejected", "circuit_rejections")
+    return CircuitOpenError(f"No GPU endpoint available (circuits open for {list(modal_balancer.urls())})")
+
+
+async def _endpoint_attempt(attempt: EndpointAttempt, endpoint: str, garment_count: int, claim: Callable[[], bool]):
+    """Send one request to `endpoint` through its circuit breaker, recording the outcome
+    in the breaker, the balancer and the per-endpoint metrics"""
+    breaker = circuit_breaker(endpoint)
+    breaker.before_call()
+    modal_balancer.start(endpoint)
+    MODAL_ENDPOINT_IN_FLIGHT.labels(endpoint).inc()
+    start = time.perf_counter()
+    latency, failed = None, False
+    try:
+        result = await attempt(endpoint, claim)
+        elapsed = time.perf_counter() - start
+        latency = elapsed / max(1, garment_count)
+        modal_batch_sizer.record(garment_count, elapsed)
+        breaker.record_success()
+        return result
+    except HedgeLost:
+        breaker.record_abandoned()
+        raise
+    except Exception as e:
+        if _is_retryable(e):
+            failed = True
+            breaker.record_failure()
+        else:
+            breaker.record_success()  # the endpoint answered; the request itself was refused
+        raise
+    except BaseException:
+        breaker.record_abandoned()
+        raise
+    finally:
+        modal_balancer.finish(endpoint, latency, failed)
+        MODAL_ENDPOINT_IN_FLIGHT.labels(endpoint).dec()
+        outcome = "ok" if latency is not None else "error" if failed else "abandoned"
+        MODAL_ENDPOINT_SECONDS.labels(endpoint, outcome).observe(time.perf_counter() - start)
+
+
+async def _hedge_attempt(attempt: EndpointAttempt, endpoint: str, claim: Callable[[], bool], garment_count: int, tier: Optional[str]):
+    """Run a duplicate attempt in the spare limiter slot taken by _start_hedge"""
+    start = time.perf_counter()
+    try:
+        with stage("modal_hedge"):
+            result = await _endpoint_attempt(attempt, endpoint, garment_count, claim)
+    except BaseException as e:
+        modal_scheduler.release(tier, overloaded=isinstance(e, Exception) and _is_overload(e))
+        raise
+    modal_scheduler.release(tier, latency=(time.perf_counter() - start) / max(1, garment_count))
+    return result
+
+
+def _start_hedge(
+    attempt: EndpointAttempt,
+    mode: str,
+    garment_count: int,
+    tier: Optional[str],
+    primary_endpoint: str,
+    claim: Callable[[], bool],
+):
+    """Duplicate a slow call, preferably on another endpoint, but only with spare GPU
+    capacity and an endpoint whose circuit is closed"""
+    endpoint = _pick_endpoint(mode, avoid=(primary_endpoint,))
+    if endpoint is None or circuit_breaker(endpoint).state != "closed" or not modal_scheduler.try_acquire_spare():
+        return None
+    _count("hedge", "hedges")
+    logger.info("Modal batch of %d garment(s) on %s is slow; sending a hedged duplicate to %s", garment_count, primary_endpoint, endpoint)
+    return _hedge_attempt(attempt, endpoint, claim, garment_count, tier)
+
+
+async def _call_modal(
+    mode: str,
+    attempt: EndpointAttempt,
+    garment_count: int,
+    tier: Optional[str],
+    user_id: Optional[str],
+    can_retry: Callable[[], bool],
+):
+    """Run `attempt` on an endpoint chosen by the balancer within a limiter slot, hedged
+    once it gets slower than recent calls, and retried with jittered backoff on endpoint
+    failures (up to MODAL_MAX_ATTEMPTS, while `can_retry()` and the job deadline allow).
+    Retries and hedges prefer another endpoint."""
+    failed_endpoints: Tuple[str, ...] = ()
+    for attempt_number in range(1, MODAL_MAX_ATTEMPTS + 1):
+        # Fail fast rather than queue for a slot when every endpoint is ejected
+        if _pick_endpoint(mode) is None:
+            raise _no_endpoint()
+        endpoint = None
+        try:
+            async with _limiter_slot(garment_count, tier, user_id):
+                endpoint = _pick_endpoint(mode, avoid=failed_endpoints)
+                if endpoint is None:
+                    raise _no_endpoint()
+                result, hedge_won = await hedged(
+                    partial(_endpoint_attempt, attempt, endpoint, garment_count),
+                    _hedge_delay(mode, garment_count),
+                    partial(_start_hedge, attempt, mode, garment_count, tier, endpoint),
+                )
+        except Exception as e:
+            if not _is_retryable(e):
+                raise
+            if endpoint is not None:
+                failed_endpoints += (endpoint,)
+            # Fail over to an endpoint that has not failed yet at once; back off only
+            # once every endpoint has failed
+            fresh = _pick_endpoint(mode, avoid=failed_endpoints)
+            if fresh is not None and fresh not in failed_endpoints:
+                delay = 0.0
+            else:
+                delay = MODAL_RETRY_BACKOFF * 2 ** (attempt_number - 1) * random.uniform(0.5, 1.5)
+            if attempt_number == MODAL_MAX_ATTEMPTS or not can_retry() or job_time_left(JOB_DEADLINE_SECONDS) < delay:
+                raise
+            _count("retry", "retries")
+            logger.warning(
+                "Modal batch attempt %d/%d on %s failed (%s); retrying in %.1fs",
+                attempt_number, MODAL_MAX_ATTEMPTS, endpoint, e, delay,
+            )
+            await asyncio.sleep(delay)
+            continue
+        if hedge_won:
+            _count("hedge_won", "hedges_won")
+        return result
+
+
+def get_modal_resilience_stats() -> Dict[str, Any]:
+    """Hedge/retry counters, current hedge delays, circuit breaker states and per-endpoint load"""
+    return {
+        **resilience_stats,
+        "hedge_delay_seconds": {
+            "stream_first_result": _hedge_delay("stream", 1),
+            "zip_per_garment": _hedge_delay("zip", 1),
+        },
+        "circuit_breakers": {endpoint: breaker.snapshot() for endpoint, breaker in _circuit_breakers.items()},
+        "endpoints": modal_balancer.snapshot(),
+    }
+
+
+async def _stream_batch(
+    files: list,
+    data: dict,
+    product_ids: List[str],
+    on_result: Optional[Callable[[str, ImageBlob], None]],
+    tier: Optional[str] = None,
+    user_id: Optional[str] = None,
+) -> Tuple[Dict[str, ImageBlob], Dict[str, str]]:
+    """Call /tryon/batch/stream and hand each garment result over as soon as its frame arrives.
+
+    Returns the results and an error per garment that has none. If the stream breaks
+    after some results were handed over, the rest are reported as failed."""
+    result_images = {}
+    errors = {}
+
+    def deliver(product_id: str, result_img: ImageBlob):
+        result_images[product_id] = result_img
+        if on_result is not None:
+            on_result(product_id, result_img)
+
+    async def attempt(endpoint: str, claim: Callable[[], bool]) -> Dict[str, ImageBlob]:
+        start = time.perf_counter()
+        claimed = False
+        logger.info(f"Calling Modal streaming batch endpoint: {endpoint}/tryon/batch/stream")
+        async with get_modal_client().stream(
+            "POST", f"{endpoint}/tryon/batch/stream", files=files, data=data, headers=_trace_headers()
+        ) as response:
+            if response.status_code in (404, 405):
+                raise StreamingNotSupported(endpoint)
+            if response.is_error:
+                await response.aread()
+                response.raise_for_status()
             
-            return result_images
+            finished = False
+            async for header, payload in _read_frames(response.aiter_bytes()):
+                frame_type = header.get("type")
+                if frame_type == "start":
+                    logger.info(
+                        "Modal preprocessed person image in %.1fs (cached: %s)",
+                        header.get("timings", {}).get("preprocess", 0), header.get("preprocess_cached", False),
+                    )
+                elif frame_type == "result":
+                    product_id = product_ids[header["index"] - 1]
+                    if header.get("status") != "ok":
+                        record_error("modal")
+                        errors[product_id] = header.get("error") or "Garment failed"
+                        logger.warning(f"Modal failed garment for product {product_id}: {header.get('error')}")
+                        continue
+                    # The first result commits this attempt (a hedged duplicate is cancelled)
+                    if not claimed:
+                        if not claim():
+                            raise HedgeLost()
+                        claimed = True
+                        _hedge_history["stream"].record(time.perf_counter() - start)
+                    BYTES_TRANSFERRED.labels("in", "modal").inc(len(payload))
+                    deliver(product_id, ImageBlob.from_bytes(payload))
+                    logger.info("Received streamed result for product %s (timings: %s)", product_id, header.get("timings"))
+                elif frame_type == "end":
+                    export_remote_spans(WORKER_SERVICE_NAME, header.get("spans", []))
+                    if header.get("status") == "error":
+                        raise ModalBatchError(header.get("error", "Modal batch failed"))
+                    finished = True
+            if not finished:
+                raise StreamInterrupted("Modal stream closed before the end frame")
+        if not claim():
+            raise HedgeLost()
+        return result_images
+
+    # Once a result was handed over the batch cannot be resent as a whole
+    try:
+        await _call_modal("stream", attempt, len(product_ids), tier, user_id, can_retry=lambda: not result_images)
+    except Exception as e:
+        if not result_images:
+            raise
+        logger.warning(f"Modal stream failed after {len(result_images)} of {len(product_ids)} result(s): {str(e)}")
+        for product_id in product_ids:
+            errors.setdefault(product_id, f"Batch interrupted: {str(e)}")
+    return result_images, {product_id: error for product_id, error in errors.items() if product_id not in result_images}
+
+
+async def _zip_batch(
+    files: list,
+    data: dict,
+    product_ids: List[str],
+    tier: Optional[str] = None,
+    user_id: Optional[str] = None,
+) -> Tuple[Dict[str, ImageBlob], Dict[str, str]]:
+    """Call /tryon/batch and extract the ZIP returned once every garment is done.
+
+    Returns the results and an error per garment that has none, read from the
+    worker's manifest.json (or its error_N.txt entries, for older workers)."""
+    async def attempt(endpoint: str, claim: Callable[[], bool]) -> bytes:
+        start = time.perf_counter()
+        # MODAL_READ_TIMEOUT defaults to 20 minutes like the test file
+        logger.info(f"Calling Modal batch endpoint: {endpoint}/tryon/batch")
+        response = await get_modal_client().post(
+            f"{endpoint}/tryon/batch", files=files, data=data, headers=_trace_headers()
+        )
+        response.raise_for_status()
+        if not claim():
+            raise HedgeLost()
+        _hedge_history["zip"].record((time.perf_counter() - start) / max(1, len(product_ids)))
+        return response.content
+
+    content = await _call_modal("zip", attempt, len(product_ids), tier, user_id, can_retry=lambda: True)
+    
+    logger.info(f"Received response from Modal, extracting ZIP file")
+    BYTES_TRANSFERRED.labels("in", "modal").inc(len(content))
+    # Extract zip file
+    zip_buffer = BytesIO(content)
+    result_images = {}
+    errors = {}
+    
+    with stage("zip_extract"), zipfile.ZipFile(zip_buffer, 'r') as zip_file:
+        # Map each file in zip to product_id
+        file_list = zip_file.namelist()
+        logger.debug("ZIP contains %d files: %s", len(file_list), file_list)
+        if TRACE_SPANS_ENTRY in file_list:
+            export_remote_spans(WORKER_SERVICE_NAME, json.loads(zip_file.read(TRACE_SPANS_ENTRY)))
+        if MANIFEST_ENTRY in file_list:
+            manifest = json.loads(zip_file.read(MANIFEST_ENTRY))
+            logger.info("Modal batch manifest: preprocess cached %s", manifest.get("preprocess_cached", False))
+            garments = {garment["index"]: garment for garment in manifest.get("garments", [])}
+        else:
+            garments = {}
+        for idx, product_id in enumerate(product_ids):
+            garment = garments.get(idx + 1)
+            if garment is not None and garment.get("status") != "ok":
+                errors[product_id] = garment.get("error") or "Garment failed"
+                continue
+            if garment is not None:
+                matching_files = [garment["file"]]
+            else:
+                # Older workers: find output_1_*.png, output_2_*.png, etc.
+                matching_files = [f for f in file_list if f.startswith(f"output_{idx + 1}_") and f.endswith(".png")]
+            if matching_files and matching_files[0] in file_list:
+                img_data = zip_file.read(matching_files[0])
+                result_images[product_id] = ImageBlob.from_bytes(img_data)
+                logger.info("Extracted image for product %s from %s", product_id, matching_files[0])
+            elif f"error_{idx + 1}.txt" in file_list:
+                errors[product_id] = zip_file.read(f"error_{idx + 1}.txt").decode("utf-8", "replace")
+            else:
+                errors[product_id] = "No output image in the batch response"
+    for product_id, error in errors.items():
+        record_error("modal")
+        logger.warning(f"Modal failed garment for product {product_id}: {error}")
+    
+    return result_images, errors
+
+
+def _take_garment_retries(wanted: int, used_by_call: int) -> int:
+    """How many failed garments may be resubmitted, from the job's MODAL_GARMENT_RETRY_BUDGET
+    (per call outside a job); none once the job deadline has passed"""
+    if job_time_left(JOB_DEADLINE_SECONDS) <= 0:
+        return 0
+    job = current_job.get()
+    used = job.garment_retries if job is not None else used_by_call
+    granted = max(0, min(wanted, MODAL_GARMENT_RETRY_BUDGET - used))
+    if job is not None:
+        job.garment_retries += granted
+    return granted
+
+
+async def process_tryon_batch_with_modal(
+    person: ImageBlob, 
+    garment_images: Dict[str, ImageBlob], 
+    garment_descriptions: Dict[str, str] = None,
+    on_result: Optional[Callable[[str, ImageBlob], None]] = None,
+    tier: Optional[str] = None,
+    user_id: Optional[str] = None
+) -> Dict[str, ImageBlob]:
+    """Call Modal batch endpoint to process multiple garments with one person image.
+
+    Images are sent as their original encoded bytes and results are returned
+    as the worker's encoded bytes (no decode/re-encode either way).
+    With MODAL_STREAMING the streaming endpoint is used and `on_result` is called
+    for each garment as soon as it arrives; otherwise it is called for every
+    result once the ZIP is extracted. `tier` (subscription type) and `user_id`
+    decide the batch's place in the Modal scheduler. Requests are spread over
+    MODAL_ENDPOINTS by `modal_balancer`.
+
+    Garments the worker reports as failed are resubmitted on their own (the worker
+    reuses the preprocessed person if the retry lands on the same container), within
+    the job's garment retry budget. Garments still failed, or whose resubmit failed
+    outright, are missing from the result."""
+    try:
+        result_images = {}
+        pending = garment_images
+        retried = 0
+        while True:
+            try:
+                results, errors = await _send_batch(person, pending, garment_descriptions, on_result, tier, user_id)
+            except Exception as e:
+                if not retried:
+                    raise
+                # The first pass's results are already being uploaded: keep them
+                logger.warning(
+                    "Resubmit of %d failed garment(s) failed (%s), giving up on: %s",
+                    len(pending), e, list(pending),
+                )
+                return result_images
+            result_images.update(results)
+            failed = [product_id for product_id in pending if product_id not in results]
+            if not failed:
+                return result_images
+            granted = _take_garment_retries(len(failed), retried)
+            if granted == 0:
+                logger.warning(
+                    "Giving up on %d failed garment(s) (retry budget spent): %s",
+                    len(failed), {product_id: errors.get(product_id) for product_id in failed},
+                )
+                return result_images
+            retried += granted
+            _count("garment_retry", "garment_retries", granted)
+            pending = {product_id: garment_images[product_id] for product_id in failed[:granted]}
+            logger.warning(f"Resubmitting {len(pending)} failed garment(s) of the batch: {list(pending)}")
+    except CircuitOpenError as e:
+        logger.error(f"Modal call rejected: {str(e)}")
+        raise HTTPException(status_code=503, detail=f"Try-on backend unavailable: {str(e)}")
     except httpx.HTTPStatusError as e:
         logger.error(f"HTTP error from Modal: {e.response.status_code} - {e.response.text}")
         raise HTTPException(status_code=e.response.status_code, detail=f"Modal API error: {e.response.text}")
@@ -115,3 +651,80 @@ async def process_tryon_batch_with_modal(
         logger.error(f"HTTP call to Modal batch endpoint failed: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Try-on processing failed: {str(e)}")
 
+
+async def _send_batch(
+    person: ImageBlob,
+    garment_images: Dict[str, ImageBlob],
+    garment_descriptions: Optional[Dict[str, str]],
+    on_result: Optional[Callable[[str, ImageBlob], None]],
+    tier: Optional[str],
+    user_id: Optional[str],
+) -> Tuple[Dict[str, ImageBlob], Dict[str, str]]:
+    """One batch request (streaming, or ZIP); returns the results and the per-garment errors"""
+    # Prepare files for multipart form data (matching test_tryon_api.py format)
+    # httpx needs tuple format: (field_name, (filename, file_content, content_type))
+    # IMPORTANT: human_image first, then garment_images (same order as test file)
+    files = [("human_image", (person.filename("person"), person.data, person.content_type))]
+    logger.debug("Prepared human_image (person/avatar): %d bytes (%s)", len(person.data), person.content_type)
+    
+    garment_files = []
+    for product_id, garment in garment_images.items():
+        garment_files.append((product_id, garment))
+        files.append(("garment_images", (garment.filename(product_id), garment.data, garment.content_type)))
+        logger.debug("Prepared garment_image for product %s: %d bytes (%s)", product_id, len(garment.data), garment.content_type)
+    
+    # Generate random seed for each request (ensures unique results)
+    random_seed = random.randint(0, 2**31 - 1)
+    
+    # Prepare form data (as strings, matching test file format)
+    data = {
+        **TRYON_PARAMS,
+        "seed": str(random_seed)
+    }
+    logger.debug(
+        "Request parameters: seed=%s (random), denoise_steps=%s, auto_mask=%s, auto_crop=%s",
+        data["seed"], data["denoise_steps"], data["auto_mask"], data["auto_crop"],
+    )
+    
+    # Add garment descriptions if provided
+    if garment_descriptions:
+        # Convert descriptions dict to JSON array format (matching modal_deploy.py format)
+        # Create descriptions list in the same order as garment_files
+        descriptions_list = []
+        product_id_order = []
+        for product_id, _ in garment_files:
+            product_id_order.append(product_id)
+            if product_id in garment_descriptions:
+                descriptions_list.append(garment_descriptions[product_id])
+                logger.debug("Mapped description for product %s: %.80s", product_id, garment_descriptions[product_id])
+            else:
+                # Fallback to default if description missing
+                default_desc = "a beautiful garment, professional fashion photography, high quality"
+                descriptions_list.append(default_desc)
+                logger.warning(f"No description found for product {product_id}, using default")
+        
+        # Send as JSON array string (modal_deploy.py expects this format)
+        data["garment_descriptions"] = json.dumps(descriptions_list)
+        logger.info("Added %d garment descriptions to request in order: %s", len(descriptions_list), product_id_order)
+        if logger.isEnabledFor(logging.DEBUG):
+            for idx, (product_id, desc) in enumerate(zip(product_id_order, descriptions_list)):
+                logger.debug("  [%d] Product %s: %.100s", idx + 1, product_id, desc)
+    
+    logger.info("Sending to Modal: 1 human_image + %d garment_images", len(garment_files))
+    logger.debug("Request data being sent: %s", data)
+    
+    product_ids = [product_id for product_id, _ in garment_files]
+    BYTES_TRANSFERRED.labels("out", "modal").inc(sum(len(upload[1][1]) for upload in files))
+    if MODAL_STREAMING and not all(_streaming_unsupported.get(endpoint) for endpoint in modal_balancer.urls()):
+        try:
+            return await _stream_batch(files, data, product_ids, on_result, tier, user_id)
+        except StreamingNotSupported as e:
+            endpoint = e.args[0]
+            logger.warning(f"Modal endpoint {endpoint} has no streaming route; it gets ZIP batches from now on")
+            _streaming_unsupported[endpoint] = True
+    
+    result_images, errors = await _zip_batch(files, data, product_ids, tier, user_id)
+    if on_result is not None:
+        for product_id, result_img in result_images.items():
+            on_result(product_id, result_img)
+    return result_images, errors
@@ -0,0 +1,108 @@
+"""Gateway-side input normalisation (EXIF orientation, downscaling, transport encoding)"""
+import asyncio
+import logging
+import math
+from io import BytesIO
+from typing import Dict, Optional, Tuple
+from config import TRANSPORT_FORMATS, TRANSPORT_QUALITY
+from services.image_service import ImageBlob
+
+logger = logging.getLogger(__name__)
+
+EXIF_ORIENTATION = 0x0112
+
+# Transport format name -> (PIL format, content type)
+_FORMATS = {
+    "webp": ("WEBP", "image/webp"),
+    "jpeg": ("JPEG", "image/jpeg"),
+    "png": ("PNG", "image/png"),
+}
+
+
+def compute_target_size(size: Tuple[int, int], limits: dict) -> Tuple[int, int]:
+    """Model resolution the worker will use for an image of this size (mirrors _compute_target_size)"""
+    width, height = size
+    if width <= 0 or height <= 0:
+        return tuple(limits["default_size"])
+    multiple = limits["size_multiple"]
+    scale = limits["max_process_side"] / float(max(width, height))
+    target_width = max(64, int(round(width * scale / multiple)) * multiple)
+    target_height = max(64, int(round(height * scale / multiple)) * multiple)
+    return target_width, target_height
+
+
+def negotiate_format(limits: dict) -> Optional[str]:
+    """First preferred transport format the worker accepts, or None to keep PNG"""
+    accepted = set(limits.get("input_formats", []))
+    for name in TRANSPORT_FORMATS:
+        if name in _FORMATS and _FORMATS[name][1] in accepted:
+            return name
+    return None
+
+
+def _header(blob: ImageBlob) -> Tuple[Tuple[int, int], int]:
+    """Oriented size and EXIF orientation, read from the header without decoding pixels"""
+    from PIL import Image
+
+    with Image.open(BytesIO(blob.data)) as img:
+        orientation = img.getexif().get(EXIF_ORIENTATION, 1)
+        width, height = img.size
+    if orientation in (5, 6, 7, 8):
+        width, height = height, width
+    return (width, height), orientation
+
+
+def _normalize(blob: ImageBlob, min_size: Tuple[int, int], transport: Optional[str]) -> ImageBlob:
+    """Apply EXIF orientation and downscale so the image still covers `min_size` in both dimensions.
+
+    Returns the original blob untouched when it is already upright and no larger than needed."""
+    from PIL import Image, ImageOps
+
+    (width, height), orientation = _header(blob)
+    scale = max(min_size[0] / width, min_size[1] / height)
+    if orientation == 1 and scale >= 1.0:
+        return blob
+
+    img = ImageOps.exif_transpose(Image.open(BytesIO(blob.data))).convert("RGB")
+    if scale < 1.0:
+        # Round up so rounding can never take a side below the required size
+        new_size = (max(min_size[0], math.ceil(width * scale)), max(min_size[1], math.ceil(height * scale)))
+        img = img.resize(new_size, Image.LANCZOS)
+
+    pil_format, content_type = _FORMATS[transport or "png"]
+    buffer = BytesIO()
+    if pil_format == "PNG":
+        img.save(buffer, format=pil_format)
+    else:
+        img.save(buffer, format=pil_format, quality=TRANSPORT_QUALITY)
+    normalized = ImageBlob.from_bytes(buffer.getvalue(), content_type)
+    logger.info(
+        f"Normalized image {width}x{height} (orientation {orientation}) -> {img.size[0]}x{img.size[1]} "
+        f"{content_type}: {len(blob.data)} -> {len(normalized.data)} bytes"
+    )
+    return normalized
+
+
+def _normalize_all(person: ImageBlob, garments: Dict[str, ImageBlob], limits: dict) -> Tuple[ImageBlob, Dict[str, ImageBlob]]:
+    transport = negotiate_format(limits)
+    person_size, _ = _header(person)
+
+    # The worker scales the (uncropped) person so its long side is max_process_side;
+    # keeping exactly that long side preserves every pixel the model will see
+    scale = min(1.0, limits["max_process_side"] / float(max(person_size)))
+    person_min = (math.ceil(person_size[0] * scale), math.ceil(person_size[1] * scale))
+    normalized_person = _normalize(person, person_min, transport)
+
+    # Garments are stretched to the person's target size, so they must cover it in both
+    # dimensions (take the larger of the targets for the original and normalised person
+    # in case rounding to the size multiple differs between them)
+    original_target = compute_target_size(person_size, limits)
+    normalized_target = compute_target_size(_header(normalized_person)[0], limits)
+    target_size = (max(original_target[0], normalized_target[0]), max(original_target[1], normalized_target[1]))
+    garments = {product_id: _normalize(garment, target_size, transport) for product_id, garment in garments.items()}
+    return normalized_person, garments
+
+
+async def normalize_inputs(person: ImageBlob, garments: Dict[str, ImageBlob], limits: dict) -> Tuple[ImageBlob, Dict[str, ImageBlob]]:
+    """Normalise the person and garment images for upload (CPU work runs off the event loop)"""
+    return await asyncio.to_thread(_normalize_all, person, garments, limits)
@@ -0,0 +1,160 @@
+"""Persistent index of uploaded try-on results keyed by content hash and model version"""
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, Optional, Tuple
+from config import (
+    RESULT_CACHE_DB_PATH,
+    RESULT_CACHE_TTL_SECONDS,
+    RESULT_CACHE_MAX_ENTRIES,
+    RESULT_CACHE_MODEL_VERSION,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def model_version(limits: dict) -> Optional[str]:
+    """Model version results are valid for (config override, else what the worker reports);
+    None when the worker reported none, in which case the cache must not be used"""
+    version = RESULT_CACHE_MODEL_VERSION or limits.get("model_version")
+    return str(version) if version else None
+
+
+def shared_model_version(endpoint_limits: Iterable[dict]) -> Optional[str]:
+    """Model version every GPU endpoint serves, so a result is valid whichever one computed it.
+
+    None when an endpoint reports no version, or when the endpoints disagree on
+    the version or on the resolution they run at (result_key would then not
+    identify the result)."""
+    endpoint_limits = list(endpoint_limits)
+    versions = {model_version(limits) for limits in endpoint_limits}
+    sides = {limits["max_process_side"] for limits in endpoint_limits}
+    if len(versions) != 1 or len(sides) != 1:
+        return None
+    return versions.pop()
+
+
+def result_key(tryon_key: str, limits: dict) -> str:
+    """Cache key: the garment's tryon_key plus the resolution the worker runs at"""
+    return hashlib.sha256(f"{tryon_key}\n{limits['max_process_side']}".encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """SQLite table of result key -> Cloudinary URL, with a TTL, an entry cap and a model version.
+
+    Entries are also dropped when their Cloudinary public_id is overwritten by a
+    different result, since the stored URL would then show the new image."""
+
+    def __init__(self, db_path: str, ttl_seconds: float, max_entries: int):
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS results (
+                result_key TEXT PRIMARY KEY,
+                model_version TEXT NOT NULL,
+                public_id TEXT NOT NULL,
+                secure_url TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_results_public_id ON results (public_id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_results_accessed ON results (accessed_at)")
+        self._purged_versions = set()
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "expired": 0, "invalidated": 0, "evicted": 0}
+
+    def _purge_other_versions(self, version: str):
+        """Drop every result produced by a different model version (once per version per process)"""
+        if version in self._purged_versions:
+            return
+        cursor = self._conn.execute("DELETE FROM results WHERE model_version != ?", (version,))
+        if cursor.rowcount:
+            logger.info(f"Invalidated {cursor.rowcount} cached try-on result(s) from other model versions")
+            self.stats["invalidated"] += cursor.rowcount
+        self._purged_versions.add(version)
+
+    def _get_many(self, keys: Iterable[str], version: str) -> Dict[str, str]:
+        now = time.time()
+        found = {}
+        with self._lock:
+            self._purge_other_versions(version)
+            for key in keys:
+                row = self._conn.execute(
+                    "SELECT secure_url, created_at FROM results WHERE result_key = ? AND model_version = ?",
+                    (key, version),
+                ).fetchone()
+                if row is None:
+                    continue
+                if now - row[1] > self.ttl_seconds:
+                    self._conn.execute("DELETE FROM results WHERE result_key = ?", (key,))
+                    self.stats["expired"] += 1
+                    continue
+                self._conn.execute("UPDATE results SET accessed_at = ? WHERE result_key = ?", (now, key))
+                found[key] = row[0]
+        return found
+
+    def _put_many(self, entries: Iterable[Tuple[str, str, str]], version: str):
+        now = time.time()
+        with self._lock:
+            for key, public_id, secure_url in entries:
+                # The public_id now holds this result; other keys pointing at it are stale
+                cursor = self._conn.execute(
+                    "DELETE FROM results WHERE public_id = ? AND result_key != ?", (public_id, key)
+                )
+                self.stats["invalidated"] += cursor.rowcount
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO results (result_key, model_version, public_id, secure_url, created_at, accessed_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, version, public_id, secure_url, now, now),
+                )
+                self.stats["stores"] += 1
+            count = self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+            if count > self.max_entries:
+                cursor = self._conn.execute(
+                    "DELETE FROM results WHERE result_key IN "
+                    "(SELECT result_key FROM results ORDER BY accessed_at LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+                self.stats["evicted"] += cursor.rowcount
+
+    async def get_many(self, keys: Iterable[str], version: str) -> Dict[str, str]:
+        """Cached secure URLs for whichever of `keys` are present and fresh"""
+        keys = list(keys)
+        found = await asyncio.to_thread(self._get_many, keys, version)
+        self.stats["hits"] += len(found)
+        self.stats["misses"] += len(keys) - len(found)
+        return found
+
+    async def put_many(self, entries: Iterable[Tuple[str, str, str]], version: str):
+        """Record (result_key, public_id, secure_url) for freshly uploaded results"""
+        await asyncio.to_thread(self._put_many, list(entries), version)
+
+
+_cache: Optional[ResultCache] = None
+
+
+def get_result_cache() -> ResultCache:
+    global _cache
+    if _cache is None:
+        _cache = ResultCache(RESULT_CACHE_DB_PATH, RESULT_CACHE_TTL_SECONDS, RESULT_CACHE_MAX_ENTRIES)
+    return _cache
+
+
+def get_result_cache_stats() -> Dict[str, float]:
+    if _cache is None:
+        return {}
+    lookups = _cache.stats["hits"] + _cache.stats["misses"]
+    return {**_cache.stats, "hit_ratio": round(_cache.stats["hits"] / lookups, 3) if lookups else 0.0}
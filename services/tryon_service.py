@@ -1,96 +1,285 @@
 """Virtual try-on processing service"""
-from typing import Dict
-from PIL import Image
+import asyncio
+import time
+from typing import Callable, Dict, Optional, Tuple
 import logging
-from services.image_service import download_image
-from services.modal_service import process_tryon_batch_with_modal
-from services.cloudinary_service import upload_to_cloudinary
+from services.image_service import ImageBlob, fetch_image
+from services.modal_service import process_tryon_batch_with_modal, get_worker_limits, plan_batch_size, tryon_key
+from services.preprocess_service import normalize_inputs
+from services.result_cache_service import get_result_cache, result_key, shared_model_version
+from services.cloudinary_service import upload_to_cloudinary, public_id_for
 from services.garment_description_service import generate_garment_description
-from config import MODAL_ENDPOINT
+from config import MODAL_ENDPOINT, MODAL_ENDPOINTS, GATEWAY_PREPROCESS, RESULT_CACHE_ENABLED
+from utils.job_context import stage
 
 logger = logging.getLogger(__name__)
 
+# GPU results currently being computed, by tryon_key; concurrent jobs needing the
+# same (person, garment, description, parameters) attach here instead of re-running it
+_in_flight_results: Dict[str, "asyncio.Future[ImageBlob]"] = {}
 
-async def process_virtual_tryon(user_id: str, garment_images: Dict[str, str], person_image: str) -> Dict[str, str]:
-    """Download images, process try-on using batch endpoint, and save results in batches of 2"""
+coalesce_stats = {"garments_computed": 0, "garments_coalesced": 0}
+
+
+def _forget_result(key: str, future: "asyncio.Future[ImageBlob]"):
+    if _in_flight_results.get(key) is future:
+        del _in_flight_results[key]
+    if not future.cancelled():
+        future.exception()  # mark retrieved: nobody may have attached
+
+
+async def _prepare_garment(product_id: str, garment_url: str) -> Tuple[ImageBlob, str]:
+    """Download one garment image and generate its description"""
+    logger.debug("Downloading garment %s from: %s", product_id, garment_url)
+    with stage("download"):
+        garment_blob = await fetch_image(garment_url)
+    
+    # Generate description for this garment using OpenAI
+    with stage("describe"):
+        description = await generate_garment_description(garment_blob)
+    logger.info("Generated description for %s: %s", product_id, description)
+    return garment_blob, description
+
+
+async def _download_person(person_image: str) -> ImageBlob:
+    logger.debug("Downloading person image from: %s", person_image)
+    with stage("download"):
+        return await fetch_image(person_image)
+
+
+async def _upload_result(user_id: str, product_id: str, result_img: ImageBlob, batch_num: int) -> str:
+    with stage("upload"):
+        secure_url = await upload_to_cloudinary(result_img, user_id, product_id)
+    logger.info("Uploaded processed image for product: %s (batch %d)", product_id, batch_num)
+    return secure_url
+
+
+async def _upload_attached(user_id: str, product_id: str, future: "asyncio.Future[ImageBlob]") -> Dict[str, str]:
+    """Wait for an identical try-on running elsewhere and upload its result under this user's id"""
+    try:
+        with stage("tryon"):
+            # Shield so cancelling this job does not cancel the result others wait for
+            result_img = await asyncio.shield(future)
+    except Exception as e:
+        logger.warning(f"Shared try-on for product {product_id} failed: {str(e)}")
+        return {}
+    return {product_id: await _upload_result(user_id, product_id, result_img, 0)}
+
+
+async def _process_batch(
+    batch_num: int,
+    batch_count: int,
+    user_id: str,
+    person: ImageBlob,
+    batch_dict: Dict[str, ImageBlob],
+    batch_descriptions: Dict[str, str],
+    publish: Optional[Callable[[str, ImageBlob], None]] = None,
+    subscription_type: str = "trial",
+) -> Dict[str, str]:
+    """Run one batch through Modal and upload its results; returns {product_id: secure_url}
+
+    `publish` is called with each result before it is uploaded (shares it with attached jobs)."""
+    logger.info(f"Processing batch {batch_num}: {len(batch_dict)} garments (products: {list(batch_dict)})")
+    
+    # Upload each result to Cloudinary as soon as Modal hands it over (uploads run
+    # in parallel, bounded by the Cloudinary semaphore)
+    upload_tasks: Dict[str, asyncio.Task] = {}
+    
+    def start_upload(product_id: str, result_img: ImageBlob):
+        if publish is not None:
+            publish(product_id, result_img)
+        upload_tasks[product_id] = asyncio.create_task(_upload_result(user_id, product_id, result_img, batch_num))
+    
+    try:
+        if MODAL_ENDPOINT:
+            with stage("tryon"):
+                await process_tryon_batch_with_modal(
+                    person, batch_dict, batch_descriptions, on_result=start_upload,
+                    tier=subscription_type, user_id=user_id,
+                )
+        else:
+            logger.warning("Modal endpoint not configured. Using placeholder.")
+            # Fallback: return original person image for each product
+            for product_id in batch_dict.keys():
+                start_upload(product_id, person)
+        
+        secure_urls = await asyncio.gather(*upload_tasks.values())
+    except BaseException:
+        for task in upload_tasks.values():
+            task.cancel()
+        raise
+    processed_images = dict(zip(upload_tasks.keys(), secure_urls))
+    
+    logger.info(f"Completed batch {batch_num} of {batch_count}")
+    return processed_images
+
+
+async def process_virtual_tryon(
+    user_id: str,
+    garment_images: Dict[str, str],
+    person_image: str,
+    subscription_type: str = "trial",
+) -> Dict[str, str]:
+    """Download images, process try-on using batch endpoint in concurrent batches, and save results.
+
+    `subscription_type` sets the priority of the job's Modal batches."""
     logger.info(f"Starting try-on processing for user: {user_id}")
+    job_start = time.perf_counter()
     
-    # Download person image
-    logger.info(f"Downloading person image from: {person_image}")
-    person_img = await download_image(person_image)
+    # Download the person image while the garments are being prepared, and
+    # download/describe all garments concurrently (bounded by the per-host
+    # download and OpenAI semaphores)
+    person_task = asyncio.create_task(_download_person(person_image))
+    garment_tasks = [
+        asyncio.create_task(_prepare_garment(product_id, garment_url))
+        for product_id, garment_url in garment_images.items()
+    ]
+    try:
+        with stage("prepare"):
+            prepared = await asyncio.gather(*garment_tasks)
+            person_blob = await person_task
+    except BaseException:
+        for task in [person_task, *garment_tasks]:
+            task.cancel()
+        raise
+    prepare_seconds = time.perf_counter() - job_start
+    logger.info(f"Prepared {len(prepared)} garments and person image in {prepare_seconds:.2f}s")
     
-    # Download all garment images and generate descriptions
+    # Images stay encoded: Modal receives the original bytes
     garment_img_dict = {}
     garment_descriptions = {}
-    for product_id, garment_url in garment_images.items():
-        logger.info(f"Downloading garment {product_id} from: {garment_url}")
-        garment_img = await download_image(garment_url)
-        garment_img_dict[product_id] = garment_img
-        
-        # Generate description for this garment using OpenAI
-        logger.info(f"Generating description for garment {product_id}...")
-        description = await generate_garment_description(garment_img)
+    for product_id, (garment_blob, description) in zip(garment_images.keys(), prepared):
+        garment_img_dict[product_id] = garment_blob
         garment_descriptions[product_id] = description
-        logger.info(f"Generated description for {product_id}: {description}")
+    
+    if GATEWAY_PREPROCESS and MODAL_ENDPOINT:
+        # Fix EXIF orientation and shrink oversized photos to what the worker will
+        # actually use, so fewer bytes are uploaded and decoded on the GPU box
+        with stage("normalize"):
+            limits = await get_worker_limits(MODAL_ENDPOINT)
+            person_blob, garment_img_dict = await normalize_inputs(person_blob, garment_img_dict, limits)
+    
+    tryon_keys = {
+        product_id: tryon_key(person_blob, garment_blob, garment_descriptions[product_id])
+        for product_id, garment_blob in garment_img_dict.items()
+    }
+    
+    # Results already uploaded for identical inputs skip Modal and Cloudinary entirely
+    cached_urls: Dict[str, str] = {}
+    result_keys: Dict[str, str] = {}
+    version = None
+    if RESULT_CACHE_ENABLED and MODAL_ENDPOINT:
+        try:
+            with stage("result_cache"):
+                # Any endpoint may serve a batch, so all of them must run the same model
+                endpoint_limits = await asyncio.gather(*(get_worker_limits(endpoint) for endpoint in MODAL_ENDPOINTS))
+                version = shared_model_version(endpoint_limits)
+                if version is not None:
+                    result_keys = {product_id: result_key(key, endpoint_limits[0]) for product_id, key in tryon_keys.items()}
+                    found = await get_result_cache().get_many(set(result_keys.values()), version)
+                else:
+                    # Unknown model version (a worker unreachable, or a rollout in progress):
+                    # neither read, store nor purge
+                    logger.warning("GPU endpoints report no common model version, skipping the result cache")
+                    found = {}
+            cached_urls = {product_id: found[key] for product_id, key in result_keys.items() if key in found}
+        except Exception as e:
+            logger.warning(f"Result cache lookup failed, computing all garments: {str(e)}")
+            result_keys = {}
+        if cached_urls:
+            logger.info(f"Result cache hit for {len(cached_urls)} garment(s): {list(cached_urls)}")
+    
+    # Attach to identical garment try-ons already running (in this or another job);
+    # the rest are computed here and published for others to attach to
+    loop = asyncio.get_running_loop()
+    owned: Dict[str, "asyncio.Future[ImageBlob]"] = {}
+    attached: Dict[str, "asyncio.Future[ImageBlob]"] = {}
+    for product_id, key in tryon_keys.items():
+        if product_id in cached_urls:
+            continue
+        pending = _in_flight_results.get(key)
+        if pending is not None:
+            attached[product_id] = pending
+            continue
+        future = loop.create_future()
+        future.add_done_callback(lambda done, key=key: _forget_result(key, done))
+        _in_flight_results[key] = future
+        owned[product_id] = future
+    coalesce_stats["garments_computed"] += len(owned)
+    coalesce_stats["garments_coalesced"] += len(attached)
+    if attached:
+        logger.info(f"Attached {len(attached)} garment(s) to identical in-flight try-ons: {list(attached)}")
+    garment_img_dict = {product_id: garment_img_dict[product_id] for product_id in owned}
+    
+    def publish(product_id: str, result_img: ImageBlob):
+        future = owned.get(product_id)
+        if future is not None and not future.done():
+            future.set_result(result_img)
     
     total_garments = len(garment_img_dict)
-    processed_images = {}
     
-    # If more than 2 images, process in batches of 2
-    if total_garments > 2:
-        logger.info(f"Processing {total_garments} garments in batches of 2")
-        
-        # Convert dict to list of tuples for easier batching
-        garment_items = list(garment_img_dict.items())
-        batch_size = 2
-        
-        # Process in batches
-        for batch_num in range(0, total_garments, batch_size):
-            batch = garment_items[batch_num:batch_num + batch_size]
-            batch_dict = dict(batch)
-            batch_product_ids = [product_id for product_id, _ in batch]
-            
-            logger.info(f"Processing batch {batch_num // batch_size + 1}: {len(batch_dict)} garments (products: {batch_product_ids})")
-            
-            # Get descriptions for this batch
-            batch_descriptions = {product_id: garment_descriptions[product_id] for product_id in batch_dict.keys()}
-            
-            # Process this batch
-            if MODAL_ENDPOINT:
-                result_images = await process_tryon_batch_with_modal(
-                    person_img, batch_dict, MODAL_ENDPOINT, batch_descriptions
-                )
-            else:
-                logger.warning("Modal endpoint not configured. Using placeholder.")
-                # Fallback: return original person image for each product
-                result_images = {product_id: person_img.copy() for product_id in batch_dict.keys()}
-            
-            # Upload batch results to Cloudinary immediately
-            for product_id, result_img in result_images.items():
-                secure_url = await upload_to_cloudinary(result_img, user_id, product_id)
-                processed_images[product_id] = secure_url
-                logger.info(f"Uploaded processed image for product: {product_id} (batch {batch_num // batch_size + 1})")
-            
-            logger.info(f"Completed batch {batch_num // batch_size + 1} of {(total_garments + batch_size - 1) // batch_size}")
-    else:
-        # Process all at once if 2 or fewer images
-        logger.info(f"Processing {total_garments} garments in single batch")
-        
-        if MODAL_ENDPOINT:
-            result_images = await process_tryon_batch_with_modal(
-                person_img, garment_img_dict, MODAL_ENDPOINT, garment_descriptions
-            )
+    # Split into batches sized from recent Modal timings and submit them all at
+    # once; the shared adaptive limiter in modal_service decides how many run concurrently
+    garment_items = list(garment_img_dict.items())
+    batch_size = plan_batch_size(total_garments)
+    batches = [dict(garment_items[i:i + batch_size]) for i in range(0, total_garments, batch_size)]
+    logger.info(f"Processing {total_garments} garments in {len(batches)} batch(es) of up to {batch_size}")
+    
+    batch_tasks = [
+        asyncio.create_task(_process_batch(
+            batch_num, len(batches), user_id, person_blob, batch_dict,
+            {product_id: garment_descriptions[product_id] for product_id in batch_dict},
+            publish,
+            subscription_type,
+        ))
+        for batch_num, batch_dict in enumerate(batches, start=1)
+    ]
+    attached_tasks = [
+        asyncio.create_task(_upload_attached(user_id, product_id, future))
+        for product_id, future in attached.items()
+    ]
+    try:
+        # A batch that fails outright only loses its own garments
+        batch_results = await asyncio.gather(*batch_tasks, *attached_tasks, return_exceptions=True)
+    except BaseException:
+        for task in [*batch_tasks, *attached_tasks]:
+            task.cancel()
+        raise
+    finally:
+        # Garments that produced no result: release anyone attached to them
+        for product_id, future in owned.items():
+            if not future.done():
+                future.set_exception(RuntimeError(f"Try-on for product {product_id} produced no result"))
+    
+    uploaded = {}
+    batch_errors = []
+    for index, result in enumerate(batch_results):
+        if isinstance(result, BaseException):
+            if not isinstance(result, Exception):
+                raise result
+            what = f"Batch {index + 1} of {len(batches)}" if index < len(batches) else "Shared try-on upload"
+            logger.error(f"{what} failed for user {user_id}: {str(result)}")
+            batch_errors.append(result)
         else:
-            logger.warning("Modal endpoint not configured. Using placeholder.")
-            # Fallback: return original person image for each product
-            result_images = {product_id: person_img.copy() for product_id in garment_img_dict.keys()}
-        
-        # Upload all processed images to Cloudinary
-        for product_id, result_img in result_images.items():
-            secure_url = await upload_to_cloudinary(result_img, user_id, product_id)
-            processed_images[product_id] = secure_url
-            logger.info(f"Uploaded processed image for product: {product_id}")
+            uploaded.update(result)
+    if batch_errors and not uploaded and not cached_urls:
+        raise batch_errors[0]
+    if result_keys and uploaded:
+        try:
+            await get_result_cache().put_many(
+                [(result_keys[product_id], public_id_for(user_id, product_id), url) for product_id, url in uploaded.items()],
+                version,
+            )
+        except Exception as e:
+            logger.warning(f"Could not record results in the result cache: {str(e)}")
+    uploaded.update(cached_urls)
+    # Keep the caller's product order
+    processed_images = {product_id: uploaded[product_id] for product_id in garment_images if product_id in uploaded}
     
-    logger.info(f"Completed processing for user: {user_id} - {len(processed_images)} images processed")
+    total_seconds = time.perf_counter() - job_start
+    logger.info(
+        f"Completed processing for user: {user_id} - {len(processed_images)} images processed "
+        f"in {total_seconds:.2f}s (prepare {prepare_seconds:.2f}s, try-on and upload {total_seconds - prepare_seconds:.2f}s)"
+    )
     return processed_images
 
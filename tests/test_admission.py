@@ -0,0 +1,64 @@
+"""Concurrent submissions cannot overshoot the admission backlog limit"""
+import asyncio
+import os
+
+import pytest
+from fastapi import HTTPException
+
+import services.admission_service as admission_service
+from services.admission_service import AdmissionController
+from services.job_service import JobQueue, JobStore
+
+
+def test_concurrent_submissions_respect_the_backlog_limit(tmp_path, monkeypatch):
+    monkeypatch.setattr(admission_service, "ADMISSION_MAX_PENDING_GARMENTS", 4)
+    monkeypatch.setattr(admission_service, "ADMISSION_KEY_BURST", 100)
+    monkeypatch.setattr(admission_service, "ADMISSION_USER_BURST", 100)
+
+    async def handler(**payload):
+        return payload
+
+    # Workers are never started, so every admitted job stays pending
+    queue = JobQueue(JobStore(os.path.join(tmp_path, "jobs.db")), handler, worker_count=1, max_attempts=1)
+    admission = AdmissionController(queue)
+
+    async def submit(index):
+        try:
+            return await admission.submit("key", f"user-{index}", {"index": index}, cost=1)
+        except HTTPException as e:
+            return e.status_code
+
+    async def scenario():
+        return await asyncio.gather(*(submit(index) for index in range(10)))
+
+    results = asyncio.run(scenario())
+
+    assert sum(1 for result in results if isinstance(result, tuple)) == 4
+    assert results.count(503) == 6
+    assert asyncio.run(queue.pending_cost()) == 4
+    assert admission.stats["admitted"] == 4
+    assert admission.stats["rejected_backlog"] == 6
+
+
+def test_duplicate_submission_is_not_charged(tmp_path, monkeypatch):
+    monkeypatch.setattr(admission_service, "ADMISSION_KEY_BURST", 1)
+    monkeypatch.setattr(admission_service, "ADMISSION_USER_BURST", 1)
+
+    async def handler(**payload):
+        return payload
+
+    queue = JobQueue(JobStore(os.path.join(tmp_path, "jobs.db")), handler, worker_count=1, max_attempts=1)
+    admission = AdmissionController(queue)
+
+    async def scenario():
+        first = await admission.submit("key", "user", {"index": 1})
+        again = await admission.submit("key", "user", {"index": 1})
+        with pytest.raises(HTTPException) as rejected:
+            await admission.submit("key", "user", {"index": 2})
+        return first, again, rejected.value.status_code
+
+    first, again, status = asyncio.run(scenario())
+
+    assert first[1] is True
+    assert again == (first[0], False)
+    assert status == 429
@@ -0,0 +1,13 @@
+"""Parsing of MODAL_ENDPOINTS entries"""
+from config import _weighted_endpoint
+
+
+def test_weight_after_the_last_equals_sign():
+    assert _weighted_endpoint("https://a.modal.run/=2") == ("https://a.modal.run", 2.0)
+    assert _weighted_endpoint(" https://a.modal.run ") == ("https://a.modal.run", 1.0)
+    assert _weighted_endpoint("https://a.modal.run=") == ("https://a.modal.run", 1.0)
+
+
+def test_query_string_is_part_of_the_url():
+    assert _weighted_endpoint("https://a.modal.run?token=abc") == ("https://a.modal.run?token=abc", 1.0)
+    assert _weighted_endpoint("https://a.modal.run?token=abc=0.5") == ("https://a.modal.run?token=abc", 0.5)
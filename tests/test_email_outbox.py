@@ -0,0 +1,41 @@
+"""Email outbox senders keep running through unexpected errors"""
+import asyncio
+import os
+
+import services.email_outbox_service as outbox_service
+from services.email_outbox_service import EMAIL_SENT, EmailOutbox, EmailOutboxStore
+
+
+def test_raising_send_does_not_stop_the_sender(tmp_path, monkeypatch):
+    monkeypatch.setattr(outbox_service, "SENDER_ERROR_BACKOFF_SECONDS", 0.01)
+    store = EmailOutboxStore(os.path.join(tmp_path, "outbox.db"))
+    outbox = EmailOutbox(store, sender_count=1, batch_size=10, max_attempts=5, rate_per_second=0, retry_backoff=0)
+    calls = []
+
+    async def send(batch_id, rows):
+        calls.append([row["id"] for row in rows])
+        if len(calls) == 1:
+            raise RuntimeError("unexpected")
+        for row in rows:
+            store.mark_sent(row["id"], "resend-id")
+
+    monkeypatch.setattr(outbox, "_send", send)
+
+    async def scenario():
+        await outbox.start()
+        try:
+            await outbox.enqueue("email-1", {"to": "a@example.com"})
+            for _ in range(200):
+                if len(calls) >= 2:
+                    break
+                await asyncio.sleep(0.01)
+        finally:
+            await outbox.stop()
+
+    asyncio.run(scenario())
+
+    assert calls == [["email-1"], ["email-1"]]
+    assert outbox.stats["sender_errors"] == 1
+    state = EmailOutboxStore(os.path.join(tmp_path, "outbox.db"))
+    row = state._conn.execute("SELECT state FROM emails WHERE id = ?", ("email-1",)).fetchone()
+    assert row["state"] == EMAIL_SENT
@@ -0,0 +1,29 @@
+"""Freshness of cached images follows RFC 9111"""
+from email.utils import formatdate
+
+import pytest
+
+from services.image_cache_service import freshness_lifetime
+
+DATE = formatdate(1_700_000_000, usegmt=True)
+
+
+def test_explicit_freshness():
+    assert freshness_lifetime("public, max-age=600") == 600
+    assert freshness_lifetime("no-store") is None
+    assert freshness_lifetime("no-cache, max-age=600") == 0
+    assert freshness_lifetime(None, expires=formatdate(1_700_000_300, usegmt=True), date=DATE) == 300
+    assert freshness_lifetime(None, expires="0", date=DATE) == 0
+
+
+def test_heuristic_is_a_tenth_of_the_age_and_capped(monkeypatch):
+    monkeypatch.setattr("services.image_cache_service.IMAGE_CACHE_FRESH_SECONDS", 3600.0)
+    hour_old = formatdate(1_700_000_000 - 3600, usegmt=True)
+    year_old = formatdate(1_700_000_000 - 365 * 86400, usegmt=True)
+    assert freshness_lifetime(None, date=DATE, last_modified=hour_old) == pytest.approx(360)
+    assert freshness_lifetime(None, date=DATE, last_modified=year_old) == 3600
+
+
+def test_no_freshness_information_always_revalidates():
+    assert freshness_lifetime(None) == 0
+    assert freshness_lifetime("public", date=DATE) == 0
@@ -0,0 +1,44 @@
+"""Job queue workers keep running through unexpected errors"""
+import asyncio
+import os
+
+import services.job_service as job_service
+from services.job_service import JOB_COMPLETED, JobQueue, JobStore
+
+
+def test_store_error_does_not_stop_the_worker(tmp_path, monkeypatch):
+    monkeypatch.setattr(job_service, "WORKER_ERROR_BACKOFF_SECONDS", 0.01)
+    store = JobStore(os.path.join(tmp_path, "jobs.db"))
+    claim_next = store.claim_next
+    claims = []
+
+    def flaky_claim_next(priority_boost=0.0):
+        claims.append(priority_boost)
+        if len(claims) == 1:
+            raise RuntimeError("database is locked")
+        return claim_next(priority_boost)
+
+    monkeypatch.setattr(store, "claim_next", flaky_claim_next)
+
+    async def handler(value):
+        return {"value": value}
+
+    queue = JobQueue(store, handler, worker_count=1, max_attempts=3)
+
+    async def scenario():
+        job_id, _ = await queue.submit({"value": 1})
+        await queue.start()
+        try:
+            for _ in range(200):
+                job = await queue.get(job_id)
+                if job["state"] == JOB_COMPLETED:
+                    return job
+                await asyncio.sleep(0.01)
+        finally:
+            await queue.stop()
+
+    job = asyncio.run(scenario())
+
+    assert job["state"] == JOB_COMPLETED
+    assert job["result"] == {"value": 1}
+    assert queue.stats["worker_errors"] == 1
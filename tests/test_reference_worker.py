@@ -0,0 +1,100 @@
+"""Smoke test: the CPU reference worker serves real try-ons under uvicorn"""
+import io
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import zipfile
+
+import httpx
+import pytest
+from PIL import Image
+
+pytest.importorskip("torch")
+pytest.importorskip("torchvision")
+pytest.importorskip("diffusers")
+pytest.importorskip("transformers")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STARTUP_TIMEOUT = 180.0
+REQUEST_TIMEOUT = 300.0
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _jpeg(size, color) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", size, color).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+@pytest.fixture(scope="module")
+def worker_url():
+    port = _free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "reference_worker:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=ROOT,
+        env={**os.environ, "REFERENCE_MAX_PROCESS_SIDE": "256"},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while True:
+            assert process.poll() is None, "reference worker exited during startup"
+            try:
+                if httpx.get(f"{url}/health", timeout=2.0).status_code == 200:
+                    break
+            except httpx.TransportError:
+                pass
+            assert time.monotonic() < deadline, "reference worker did not become healthy"
+            time.sleep(0.5)
+        yield url
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def test_tryon_returns_png(worker_url):
+    response = httpx.post(
+        f"{worker_url}/tryon",
+        files={
+            "human_image": ("person.jpg", _jpeg((300, 400), (200, 150, 120)), "image/jpeg"),
+            "garment_image": ("garment.jpg", _jpeg((300, 300), (20, 50, 200)), "image/jpeg"),
+        },
+        data={"garment_description": "blue shirt", "denoise_steps": "20", "seed": "1"},
+        timeout=REQUEST_TIMEOUT,
+    )
+    assert response.status_code == 200, response.text
+    assert response.headers["content-type"] == "image/png"
+    assert Image.open(io.BytesIO(response.content)).size[0] > 0
+
+
+def test_batch_returns_zip_with_manifest(worker_url):
+    garment = _jpeg((300, 300), (20, 50, 200))
+    response = httpx.post(
+        f"{worker_url}/tryon/batch",
+        files=[
+            ("human_image", ("person.jpg", _jpeg((300, 400), (200, 150, 120)), "image/jpeg")),
+            ("garment_images", ("a.jpg", garment, "image/jpeg")),
+            ("garment_images", ("b.jpg", garment, "image/jpeg")),
+        ],
+        data={"garment_descriptions": "blue shirt,red shirt", "denoise_steps": "20", "seed": "1"},
+        timeout=REQUEST_TIMEOUT,
+    )
+    assert response.status_code == 200, response.text
+    archive = zipfile.ZipFile(io.BytesIO(response.content))
+    manifest = json.loads(archive.read("manifest.json"))
+    assert [entry["status"] for entry in manifest["garments"]] == ["ok", "ok"]
+    for entry in manifest["garments"]:
+        assert Image.open(io.BytesIO(archive.read(entry["file"]))).format == "PNG"
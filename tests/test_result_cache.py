@@ -0,0 +1,22 @@
+"""The result cache is only used while every GPU endpoint runs the same model"""
+from services.result_cache_service import shared_model_version
+
+
+def test_endpoints_agreeing_share_their_version():
+    limits = {"max_process_side": 1024, "model_version": "v2"}
+    assert shared_model_version([limits, dict(limits)]) == "v2"
+
+
+def test_mixed_or_unknown_versions_disable_the_cache():
+    assert shared_model_version([
+        {"max_process_side": 1024, "model_version": "v1"},
+        {"max_process_side": 1024, "model_version": "v2"},
+    ]) is None
+    assert shared_model_version([
+        {"max_process_side": 1024, "model_version": "v2"},
+        {"max_process_side": 1024},
+    ]) is None
+    assert shared_model_version([
+        {"max_process_side": 1024, "model_version": "v2"},
+        {"max_process_side": 768, "model_version": "v2"},
+    ]) is None
@@ -0,0 +1,744 @@
+"""
+IDM-VTON worker logic shared by the Modal deployment and the CPU reference worker.
+
+`TryOnWorker` holds person preprocessing, diffusion and the FastAPI app. Subclasses
+load the models: `modal_deploy.TryOnModel` loads the real SDXL weights on a GPU,
+`reference_worker.ReferenceTryOnModel` builds tiny random modules that run on CPU.
+This module must not import modal.
+"""
+
+# Reported by GET /limits; clients key cached try-on results on it, so bump it
+# whenever the weights or the inference pipeline change
+MODEL_VERSION = "yisol/IDM-VTON@main"
+
+
+def pil_to_binary_mask(pil_image, threshold=0):
+    import numpy as np
+    from PIL import Image
+
+    np_image = np.array(pil_image)
+    grayscale_image = Image.fromarray(np_image).convert("L")
+    binary_mask = np.array(grayscale_image) > threshold
+    mask = np.zeros(binary_mask.shape, dtype=np.uint8)
+    for i in range(binary_mask.shape[0]):
+        for j in range(binary_mask.shape[1]):
+            if binary_mask[i, j] == True:
+                mask[i, j] = 1
+    mask = (mask * 255).astype(np.uint8)
+    output_mask = Image.fromarray(mask)
+    return output_mask
+
+
+class TryOnWorker:
+    """Preprocessing, diffusion and HTTP API; `load_models()` (in a subclass) sets the models and helpers."""
+
+    model_version = MODEL_VERSION
+    # Preprocessed person images kept per container. A gateway resubmitting the failed
+    # garments of a batch sends the same person again and skips segmentation, pose
+    # and DensePose when the retry lands on this container.
+    preprocess_cache_size = 4
+
+    def _compute_target_size(self, region_size):
+        """Compute model resolution (multiples of 8) that preserves region aspect ratio."""
+        width, height = region_size
+        if width <= 0 or height <= 0:
+            return self.default_size
+
+        long_side = max(width, height)
+        scale = self.max_process_side / float(long_side)
+        scaled_w = width * scale
+        scaled_h = height * scale
+
+        target_width = max(64, int(round(scaled_w / 8.0)) * 8)
+        target_height = max(64, int(round(scaled_h / 8.0)) * 8)
+        return target_width, target_height
+
+    def _auto_crop_with_yolo(self, image):
+        """Detect the person with YOLO and return a tight crop plus metadata."""
+        import numpy as np
+
+        if not hasattr(self, "person_detector"):
+            return None
+
+        np_image = np.array(image.convert("RGB"))[:, :, ::-1]  # RGB -> BGR for YOLO
+        results = self.person_detector.predict(
+            source=np_image,
+            classes=[0],  # person class
+            conf=self.detector_confidence,
+            verbose=False,
+            device=self.device,
+        )
+
+        if not results:
+            return None
+
+        boxes = results[0].boxes
+        if boxes is None or boxes.xyxy is None or boxes.xyxy.shape[0] == 0:
+            return None
+
+        confidences = boxes.conf.detach().cpu().numpy()
+        best_idx = int(confidences.argmax())
+        x1, y1, x2, y2 = boxes.xyxy[best_idx].detach().cpu().numpy()
+
+        width, height = image.size
+        margin = 0.08
+        box_w = x2 - x1
+        box_h = y2 - y1
+        if box_w <= 0 or box_h <= 0:
+            return None
+
+        x1 -= box_w * margin
+        y1 -= box_h * margin
+        x2 += box_w * margin
+        y2 += box_h * margin
+
+        x1 = max(0, x1)
+        y1 = max(0, y1)
+        x2 = min(width, x2)
+        y2 = min(height, y2)
+
+        if (x2 - x1) < 10 or (y2 - y1) < 10:
+            return None
+
+        crop_box = (
+            int(round(x1)),
+            int(round(y1)),
+            int(round(x2)),
+            int(round(y2)),
+        )
+        cropped = image.crop(crop_box)
+
+        return cropped, {
+            "left": crop_box[0],
+            "top": crop_box[1],
+            "right": crop_box[2],
+            "bottom": crop_box[3],
+            "crop_size": cropped.size,
+            "original": image.copy(),
+        }
+
+    def preprocess_human_image(self, dict, is_checked, is_checked_crop):
+        """Preprocess human image once - segmentation, pose, mask (reusable for batch)."""
+        from PIL import Image
+        from torchvision.transforms.functional import to_pil_image
+        
+        human_img_orig = dict["background"].convert("RGB")
+        crop_info = None
+        work_img = human_img_orig
+
+        if is_checked_crop:
+            yolo_result = self._auto_crop_with_yolo(human_img_orig)
+            if yolo_result:
+                work_img, crop_info = yolo_result
+            else:
+                width, height = human_img_orig.size
+                target_width = int(min(width, height * (3 / 4)))
+                target_height = int(min(height, width * (4 / 3)))
+                left = (width - target_width) / 2
+                top = (height - target_height) / 2
+                right = (width + target_width) / 2
+                bottom = (height + target_height) / 2
+                work_img = human_img_orig.crop((left, top, right, bottom))
+                crop_info = {
+                    "left": left,
+                    "top": top,
+                    "right": right,
+                    "bottom": bottom,
+                    "crop_size": work_img.size,
+                    "original": human_img_orig.copy(),
+                }
+
+            if crop_info and "original" not in crop_info:
+                crop_info["original"] = human_img_orig.copy()
+
+        target_size = self._compute_target_size(work_img.size)
+        human_img = work_img.resize(target_size)
+        if crop_info:
+            crop_info["crop_size"] = work_img.size
+
+        if is_checked:
+            keypoints = self.openpose_model(human_img.resize((384, 512)))
+            model_parse, _ = self.parsing_model(human_img.resize((384, 512)))
+            mask, mask_gray = self.get_mask_location(
+                "hd", "upper_body", model_parse, keypoints
+            )
+            mask = mask.resize(target_size)
+        else:
+            if dict.get("layers") and len(dict["layers"]) > 0:
+                mask = self.pil_to_binary_mask(
+                    dict["layers"][0].convert("RGB").resize(target_size)
+                )
+            else:
+                # Fallback: create a simple mask if no layers provided
+                mask = Image.new("L", target_size, 255)
+
+        mask_gray = (1 - self.tensor_transform(mask)) * self.tensor_transform(human_img)
+        mask_gray = to_pil_image((mask_gray + 1.0) / 2.0)
+
+        # DensePose processing (expensive - only do once)
+        human_img_arg = self._apply_exif_orientation(human_img.resize((384, 512)))
+        human_img_arg = self.convert_PIL_to_numpy(human_img_arg, format="BGR")
+
+        args = self.apply_net.create_argument_parser().parse_args(
+            (
+                "show",
+                "./configs/densepose_rcnn_R_50_FPN_s1x.yaml",
+                "./ckpt/densepose/model_final_162be9.pkl",
+                "dp_segm",
+                "-v",
+                "--opts",
+                "MODEL.DEVICE",
+                "cuda",
+            )
+        )
+        pose_img = args.func(args, human_img_arg)
+        pose_img = pose_img[:, :, ::-1]
+        pose_img = Image.fromarray(pose_img).resize(target_size)
+
+        return {
+            "human_img": human_img,
+            "mask": mask,
+            "mask_gray": mask_gray,
+            "pose_img": pose_img,
+            "crop_info": crop_info,
+            "target_size": target_size,
+        }
+
+    def preprocess_person(self, person_key, dict, is_checked, is_checked_crop):
+        """preprocess_human_image memoised on `person_key` (hash of the uploads) and the flags.
+
+        Returns (preprocessed_data, cache_hit). Cached data is shared between requests
+        and must not be modified."""
+        key = (person_key, bool(is_checked), bool(is_checked_crop))
+        with self._preprocess_lock:
+            cached = self._preprocess_cache.get(key)
+            if cached is not None:
+                self._preprocess_cache.move_to_end(key)
+                return cached, True
+        with self._model_lock:
+            preprocessed = self.preprocess_human_image(dict, is_checked, is_checked_crop)
+        with self._preprocess_lock:
+            self._preprocess_cache[key] = preprocessed
+            while len(self._preprocess_cache) > self.preprocess_cache_size:
+                self._preprocess_cache.popitem(last=False)
+        return preprocessed, False
+
+    def run_diffusion_only(self, preprocessed_data, garm_img, garment_des, denoise_steps, seed):
+        """Run only the diffusion part with pre-processed human data.
+
+        Holds the model lock: the pipeline (scheduler timesteps, UNet, VAE) is shared
+        by every request and is not safe to run from two threads at once."""
+        with self._model_lock:
+            return self._run_diffusion(preprocessed_data, garm_img, garment_des, denoise_steps, seed)
+
+    def _run_diffusion(self, preprocessed_data, garm_img, garment_des, denoise_steps, seed):
+        import torch
+        from PIL import Image
+        
+        self.openpose_model.preprocessor.body_estimation.model.to(self.device)
+        self.pipe.to(self.device)
+        self.pipe.unet_encoder.to(self.device)
+
+        target_size = preprocessed_data.get("target_size", self.default_size)
+        garm_img = garm_img.convert("RGB").resize(target_size)
+        human_img = preprocessed_data["human_img"]
+        mask = preprocessed_data["mask"]
+        pose_img = preprocessed_data["pose_img"]
+        crop_info = preprocessed_data["crop_info"]
+
+        with torch.no_grad():
+            with torch.cuda.amp.autocast():
+                print(f"[run_diffusion_only] Using garment description: {garment_des[:150]}..." if len(garment_des) > 150 else f"[run_diffusion_only] Using garment description: {garment_des}")
+                prompt = "a beautiful female model wearing " + garment_des + ", professional fashion photography, high quality"
+                print(f"[run_diffusion_only] Generated prompt: {prompt[:200]}..." if len(prompt) > 200 else f"[run_diffusion_only] Generated prompt: {prompt}")
+                negative_prompt = (
+                    "monochrome, lowres, bad anatomy, worst quality, low quality, deformed, distorted, blurry"
+                )
+                with torch.inference_mode():
+                    (
+                        prompt_embeds,
+                        negative_prompt_embeds,
+                        pooled_prompt_embeds,
+                        negative_pooled_prompt_embeds,
+                    ) = self.pipe.encode_prompt(
+                        prompt,
+                        num_images_per_prompt=1,
+                        do_classifier_free_guidance=True,
+                        negative_prompt=negative_prompt,
+                    )
+
+                    prompt = "a high quality photo of " + garment_des + ", fashion photography, detailed texture"
+                    print(f"[run_diffusion_only] Generated cloth prompt: {prompt[:200]}..." if len(prompt) > 200 else f"[run_diffusion_only] Generated cloth prompt: {prompt}")
+                    negative_prompt = (
+                        "monochrome, lowres, bad anatomy, worst quality, low quality, deformed, distorted, blurry"
+                    )
+                    if not isinstance(prompt, self.List):
+                        prompt = [prompt] * 1
+                    if not isinstance(negative_prompt, self.List):
+                        negative_prompt = [negative_prompt] * 1
+                    with torch.inference_mode():
+                        (
+                            prompt_embeds_c,
+                            _,
+                            _,
+                            _,
+                        ) = self.pipe.encode_prompt(
+                            prompt,
+                            num_images_per_prompt=1,
+                            do_classifier_free_guidance=False,
+                            negative_prompt=negative_prompt,
+                        )
+
+                    pose_img_tensor = (
+                        self.tensor_transform(pose_img).unsqueeze(0).to(self.device, torch.float16)
+                    )
+                    garm_tensor = (
+                        self.tensor_transform(garm_img).unsqueeze(0).to(self.device, torch.float16)
+                    )
+                    print(f"[run_diffusion_only] Using seed: {seed}")
+                    generator = (
+                        torch.Generator(self.device).manual_seed(int(seed))
+                        if seed is not None and seed >= 0
+                        else None
+                    )
+                    if generator:
+                        print(f"[run_diffusion_only] Generator initialized with seed {seed}")
+                    else:
+                        print(f"[run_diffusion_only] Using random seed (generator=None)")
+                    images = self.pipe(
+                        prompt_embeds=prompt_embeds.to(self.device, torch.float16),
+                        negative_prompt_embeds=negative_prompt_embeds.to(
+                            self.device, torch.float16
+                        ),
+                        pooled_prompt_embeds=pooled_prompt_embeds.to(
+                            self.device, torch.float16
+                        ),
+                        negative_pooled_prompt_embeds=negative_pooled_prompt_embeds.to(
+                            self.device, torch.float16
+                        ),
+                        num_inference_steps=int(denoise_steps),
+                        generator=generator,
+                        strength=1.0,
+                        pose_img=pose_img_tensor.to(self.device, torch.float16),
+                        text_embeds_cloth=prompt_embeds_c.to(self.device, torch.float16),
+                        cloth=garm_tensor.to(self.device, torch.float16),
+                        mask_image=mask,
+                        image=human_img,
+                        height=int(target_size[1]),
+                        width=int(target_size[0]),
+                        ip_adapter_image=garm_img,
+                        guidance_scale=2.0,
+                    )[0]
+
+        if crop_info:
+            out_img = images[0].resize(crop_info["crop_size"])
+            # Paste into a copy: the preprocessed data may be cached and reused
+            result = crop_info["original"].copy()
+            result.paste(out_img, (int(crop_info["left"]), int(crop_info["top"])))
+            return result
+        else:
+            return images[0]
+
+    def start_tryon(
+        self, dict, garm_img, garment_des, is_checked, is_checked_crop, denoise_steps, seed
+    ):
+        """Run the try-on pipeline (full process - for single requests)."""
+        with self._model_lock:
+            preprocessed = self.preprocess_human_image(dict, is_checked, is_checked_crop)
+        output_image = self.run_diffusion_only(preprocessed, garm_img, garment_des, denoise_steps, seed)
+        return output_image, preprocessed["mask_gray"]
+
+    def build_api(self):
+        """FastAPI app that accepts file uploads and returns actual image files (served by `api()` on Modal)."""
+        from fastapi import FastAPI, File, UploadFile, Form, Header, HTTPException
+        from fastapi.responses import Response
+        from PIL import Image
+        from io import BytesIO
+        from collections import OrderedDict
+        from contextlib import contextmanager
+        import hashlib
+        import os
+        import re
+        import threading
+        import time
+
+        api_app = FastAPI(title="IDM-VTON API", version="1.0.0")
+        self._preprocess_cache = OrderedDict()
+        self._preprocess_lock = threading.Lock()
+        # Serialises model work (preprocessing models and the diffusion pipeline) across
+        # requests; the streaming route runs it in worker threads
+        self._model_lock = threading.Lock()
+
+        @api_app.post("/tryon")
+        async def run_tryon(
+            human_image: UploadFile = File(..., description="Human image file (required)"),
+            garment_image: UploadFile = File(..., description="Garment image file (required)"),
+            garment_description: str = Form(None, description="Text description of the garment (optional)"),
+            auto_mask: bool = Form(None, description="Use auto-generated mask (optional, defaults to True)"),
+            auto_crop: bool = Form(None, description="Auto-crop and resize the human image (optional, defaults to False)"),
+            denoise_steps: int = Form(None, ge=20, le=40, description="Denoising steps (optional, defaults to 30)"),
+            seed: int = Form(None, ge=-1, description="Random seed (optional, defaults to 42)"),
+            mask_image: UploadFile = File(None, description="Optional mask image (only used when auto_mask is false)"),
+        ):
+            try:
+                # Apply defaults for optional parameters
+                garment_desc = garment_description if garment_description else "a beautiful sweater, professional fashion photography, high quality"
+                use_auto_mask = auto_mask if auto_mask is not None else True
+                use_auto_crop = auto_crop if auto_crop is not None else False
+                steps = denoise_steps if denoise_steps is not None else 30
+                use_seed = seed if seed is not None else 42
+                
+                # Read uploaded images
+                human_img_data = await human_image.read()
+                garment_img_data = await garment_image.read()
+                
+                human_img = Image.open(BytesIO(human_img_data)).convert("RGB")
+                garment_img = Image.open(BytesIO(garment_img_data)).convert("RGB")
+
+                input_dict = {"background": human_img}
+                
+                # Handle optional mask image (only if auto_mask is False)
+                if not use_auto_mask and mask_image and mask_image.filename:
+                    mask_img_data = await mask_image.read()
+                    mask_img = Image.open(BytesIO(mask_img_data)).convert("RGB")
+                    input_dict["layers"] = [mask_img]
+
+                # Run try-on using the shared model instance
+                output_image, _ = self.start_tryon(
+                    input_dict,
+                    garment_img,
+                    garment_desc,
+                    use_auto_mask,
+                    use_auto_crop,
+                    steps,
+                    use_seed,
+                )
+
+                # Return output image as PNG (no mask)
+                output_buffer = BytesIO()
+                output_image.save(output_buffer, format="PNG")
+                output_buffer.seek(0)
+                
+                return Response(
+                    content=output_buffer.getvalue(),
+                    media_type="image/png",
+                    headers={"Content-Disposition": "attachment; filename=output.png"}
+                )
+
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=f"Error processing request: {str(e)}")
+
+        def parse_garment_descriptions(garment_descriptions):
+            """Parse descriptions given as a JSON array or a comma-separated string."""
+            import json
+
+            if not garment_descriptions:
+                print("No garment_descriptions provided, will use defaults")
+                return None
+            print(f"Received garment_descriptions parameter: {garment_descriptions[:200]}..." if len(garment_descriptions) > 200 else f"Received garment_descriptions parameter: {garment_descriptions}")
+            try:
+                # Try parsing as JSON array first (handles descriptions with commas)
+                descriptions_list = json.loads(garment_descriptions)
+                if not isinstance(descriptions_list, list):
+                    raise ValueError("JSON must be an array")
+                print(f"Successfully parsed {len(descriptions_list)} descriptions from JSON")
+                for idx, desc in enumerate(descriptions_list):
+                    print(f"  Parsed description {idx + 1}: {desc[:100]}..." if len(desc) > 100 else f"  Parsed description {idx + 1}: {desc}")
+            except (json.JSONDecodeError, ValueError) as e:
+                print(f"Failed to parse as JSON, trying comma-separated: {e}")
+                # Fall back to comma-separated string
+                descriptions_list = [desc.strip() for desc in garment_descriptions.split(",")]
+                print(f"Parsed {len(descriptions_list)} descriptions from comma-separated string")
+            return descriptions_list
+
+        def description_for(descriptions_list, idx):
+            if descriptions_list and idx < len(descriptions_list):
+                garment_desc = descriptions_list[idx]
+                print(f"Using provided description for garment {idx + 1}: {garment_desc[:100]}..." if len(garment_desc) > 100 else f"Using provided description for garment {idx + 1}: {garment_desc}")
+            else:
+                garment_desc = "a beautiful sweater, professional fashion photography, high quality"  # Default if no description provided
+                print(f"Using DEFAULT description for garment {idx + 1} (no description provided or index out of range)")
+            return garment_desc
+
+        async def read_batch_request(human_image, garment_images, auto_mask, auto_crop, denoise_steps, seed, mask_image):
+            """Apply defaults and read all uploads up front (shared by the batch endpoints)."""
+            # Apply defaults for optional parameters
+            use_auto_mask = auto_mask if auto_mask is not None else True
+            use_auto_crop = auto_crop if auto_crop is not None else False
+            steps = denoise_steps if denoise_steps is not None else 30
+            use_seed = seed if seed is not None else 42
+            print(f"Received parameters: seed={use_seed}, denoise_steps={steps}, auto_mask={use_auto_mask}, auto_crop={use_auto_crop}")
+
+            # Read human image once
+            human_img_data = await human_image.read()
+            human_img = Image.open(BytesIO(human_img_data)).convert("RGB")
+            person_hash = hashlib.sha256(human_img_data)
+
+            input_dict = {"background": human_img}
+
+            # Handle optional mask image (only if auto_mask is False)
+            if not use_auto_mask and mask_image and mask_image.filename:
+                mask_img_data = await mask_image.read()
+                person_hash.update(mask_img_data)
+                mask_img = Image.open(BytesIO(mask_img_data)).convert("RGB")
+                input_dict["layers"] = [mask_img]
+
+            garment_datas = [await garment_file.read() for garment_file in garment_images]
+            return {
+                "input_dict": input_dict,
+                "person_key": person_hash.hexdigest(),
+                "garment_datas": garment_datas,
+                "auto_mask": use_auto_mask,
+                "auto_crop": use_auto_crop,
+                "steps": steps,
+                "seed": use_seed,
+            }
+
+        def encode_png(image):
+            output_buffer = BytesIO()
+            image.save(output_buffer, format="PNG")
+            return output_buffer.getvalue()
+
+        class SpanRecorder:
+            """Records spans as OTLP/JSON dicts continuing the caller's W3C traceparent.
+
+            The spans are returned to the gateway with the results, which exports them;
+            without a valid traceparent nothing is recorded."""
+
+            def __init__(self, traceparent):
+                match = re.match(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$", (traceparent or "").strip().lower())
+                self.trace_id = match.group(1) if match else None
+                self.parents = [match.group(2)] if match else []
+                self.spans = []
+
+            @contextmanager
+            def span(self, name, **attributes):
+                if self.trace_id is None:
+                    yield
+                    return
+                span = {
+                    "traceId": self.trace_id,
+                    "spanId": os.urandom(8).hex(),
+                    "parentSpanId": self.parents[-1],
+                    "name": name,
+                    "kind": 2,  # SPAN_KIND_SERVER
+                    "startTimeUnixNano": str(time.time_ns()),
+                    "attributes": [{"key": key, "value": {"stringValue": str(value)}} for key, value in attributes.items()],
+                    "status": {"code": 1},
+                }
+                self.parents.append(span["spanId"])
+                try:
+                    yield
+                except Exception as e:
+                    span["status"] = {"code": 2, "message": str(e)}
+                    raise
+                finally:
+                    self.parents.pop()
+                    span["endTimeUnixNano"] = str(time.time_ns())
+                    self.spans.append(span)
+
+        @api_app.post("/tryon/batch")
+        async def run_tryon_batch(
+            human_image: UploadFile = File(..., description="Human image file (required)"),
+            garment_images: list[UploadFile] = File(..., description="Multiple garment image files (required)"),
+            garment_descriptions: str = Form(None, description="Comma-separated descriptions for each garment, or JSON array like '[\"desc1\", \"desc2\"]' (optional)"),
+            auto_mask: bool = Form(None, description="Use auto-generated mask (optional, defaults to True)"),
+            auto_crop: bool = Form(None, description="Auto-crop and resize the human image (optional, defaults to False)"),
+            denoise_steps: int = Form(None, ge=20, le=40, description="Denoising steps (optional, defaults to 30)"),
+            seed: int = Form(None, ge=-1, description="Random seed (optional, defaults to 42)"),
+            mask_image: UploadFile = File(None, description="Optional mask image (only used when auto_mask is false)"),
+            traceparent: str = Header(None, description="W3C trace context; worker spans are returned in trace_spans.json"),
+        ):
+            """Process one person image with multiple garment images and return all results.
+            OPTIMIZED: Preprocesses person image once, then runs diffusion for each garment."""
+            import json
+            import zipfile
+            
+            recorder = SpanRecorder(traceparent)
+            try:
+                zip_buffer = BytesIO()
+                with recorder.span("POST /tryon/batch", garments=len(garment_images)):
+                    batch = await read_batch_request(human_image, garment_images, auto_mask, auto_crop, denoise_steps, seed, mask_image)
+
+                    # PREPROCESS HUMAN IMAGE ONCE (expensive operations: segmentation, pose, mask)
+                    # This saves significant time and processing power for batch requests
+                    print(f"Preprocessing human image once for {len(garment_images)} garments...")
+                    with recorder.span("preprocess_human_image"):
+                        preprocessed_data, preprocess_cached = self.preprocess_person(
+                            batch["person_key"], batch["input_dict"], batch["auto_mask"], batch["auto_crop"]
+                        )
+                    print(f"Human image preprocessing complete (cached: {preprocess_cached}). Processing garments...")
+
+                    # Parse garment descriptions if provided
+                    # Supports both comma-separated string and JSON array format
+                    descriptions_list = parse_garment_descriptions(garment_descriptions)
+                    
+                    # Process each garment image (only diffusion, no re-preprocessing)
+                    # manifest.json lists every garment's status so clients can resubmit only failures
+                    manifest = {"preprocess_cached": preprocess_cached, "garments": []}
+                    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+                        for idx, garment_img_data in enumerate(batch["garment_datas"]):
+                            try:
+                                # Read garment image
+                                garment_img = Image.open(BytesIO(garment_img_data)).convert("RGB")
+                                
+                                # Get description for this garment
+                                garment_desc = description_for(descriptions_list, idx)
+                                
+                                # Run ONLY diffusion (human image already preprocessed)
+                                print(f"Processing garment {idx + 1}/{len(garment_images)} with description: {garment_desc[:100]}..." if len(garment_desc) > 100 else f"Processing garment {idx + 1}/{len(garment_images)} with description: {garment_desc}")
+                                with recorder.span("run_diffusion_only", index=idx + 1):
+                                    output_image = self.run_diffusion_only(
+                                        preprocessed_data,
+                                        garment_img,
+                                        garment_desc,
+                                        batch["steps"],
+                                        batch["seed"],
+                                    )
+                                
+                                # Save to zip with descriptive filename
+                                filename = f"output_{idx + 1}_{garment_desc.replace(' ', '_')}.png"
+                                with recorder.span("encode_png", index=idx + 1):
+                                    zip_file.writestr(filename, encode_png(output_image))
+                                manifest["garments"].append({"index": idx + 1, "status": "ok", "file": filename})
+                                
+                            except Exception as e:
+                                # If one garment fails, continue with others
+                                error_filename = f"error_{idx + 1}.txt"
+                                error_message = f"Error processing garment {idx + 1}: {str(e)}"
+                                zip_file.writestr(error_filename, error_message)
+                                manifest["garments"].append({"index": idx + 1, "status": "error", "error": error_message})
+                        zip_file.writestr("manifest.json", json.dumps(manifest))
+
+                if recorder.spans:
+                    with zipfile.ZipFile(zip_buffer, 'a', zipfile.ZIP_DEFLATED) as zip_file:
+                        zip_file.writestr("trace_spans.json", json.dumps(recorder.spans))
+                
+                zip_buffer.seek(0)
+                
+                return Response(
+                    content=zip_buffer.getvalue(),
+                    media_type="application/zip",
+                    headers={"Content-Disposition": "attachment; filename=tryon_batch_results.zip"}
+                )
+
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=f"Error processing batch request: {str(e)}")
+
+        @api_app.post("/tryon/batch/stream")
+        async def run_tryon_batch_stream(
+            human_image: UploadFile = File(..., description="Human image file (required)"),
+            garment_images: list[UploadFile] = File(..., description="Multiple garment image files (required)"),
+            garment_descriptions: str = Form(None, description="Comma-separated descriptions for each garment, or JSON array like '[\"desc1\", \"desc2\"]' (optional)"),
+            auto_mask: bool = Form(None, description="Use auto-generated mask (optional, defaults to True)"),
+            auto_crop: bool = Form(None, description="Auto-crop and resize the human image (optional, defaults to False)"),
+            denoise_steps: int = Form(None, ge=20, le=40, description="Denoising steps (optional, defaults to 30)"),
+            seed: int = Form(None, ge=-1, description="Random seed (optional, defaults to 42)"),
+            mask_image: UploadFile = File(None, description="Optional mask image (only used when auto_mask is false)"),
+            traceparent: str = Header(None, description="W3C trace context; worker spans are returned in the end frame"),
+        ):
+            """Same inputs as /tryon/batch, but streams each garment result as soon as it is ready.
+
+            The body is a sequence of frames: a 4-byte big-endian header length, a UTF-8 JSON
+            header, then `header["length"]` payload bytes. Frames are a "start" frame, one
+            "result" frame per garment (index, status, timings, PNG payload or error) in
+            completion order, and a final "end" frame (carrying the worker's trace spans, if any)."""
+            import asyncio
+            import json
+            import struct
+            import time
+            from fastapi.responses import StreamingResponse
+
+            def frame(header, payload=b""):
+                header = dict(header, length=len(payload))
+                header_bytes = json.dumps(header).encode("utf-8")
+                return struct.pack(">I", len(header_bytes)) + header_bytes + payload
+
+            recorder = SpanRecorder(traceparent)
+            request_start = time.perf_counter()
+            # Read every upload before streaming starts; the request body is gone afterwards
+            with recorder.span("read_batch_request"):
+                batch = await read_batch_request(human_image, garment_images, auto_mask, auto_crop, denoise_steps, seed, mask_image)
+            descriptions_list = parse_garment_descriptions(garment_descriptions)
+
+            async def generate():
+                end = {"type": "end", "status": "ok"}
+                with recorder.span("POST /tryon/batch/stream", garments=len(batch["garment_datas"])):
+                    try:
+                        # Blocking model work runs in a thread so each frame is flushed as soon as it is yielded
+                        print(f"Preprocessing human image once for {len(batch['garment_datas'])} garments (streaming)...")
+                        preprocess_start = time.perf_counter()
+                        with recorder.span("preprocess_human_image"):
+                            preprocessed_data, preprocess_cached = await asyncio.to_thread(
+                                self.preprocess_person, batch["person_key"], batch["input_dict"], batch["auto_mask"], batch["auto_crop"]
+                            )
+                    except Exception as e:
+                        end = {"type": "end", "status": "error", "error": f"Error preprocessing human image: {str(e)}"}
+                    else:
+                        yield frame({
+                            "type": "start",
+                            "count": len(batch["garment_datas"]),
+                            "preprocess_cached": preprocess_cached,
+                            "timings": {"preprocess": time.perf_counter() - preprocess_start},
+                        })
+
+                        for idx, garment_img_data in enumerate(batch["garment_datas"]):
+                            timings = {}
+                            try:
+                                garment_img = Image.open(BytesIO(garment_img_data)).convert("RGB")
+                                garment_desc = description_for(descriptions_list, idx)
+                                diffusion_start = time.perf_counter()
+                                with recorder.span("run_diffusion_only", index=idx + 1):
+                                    output_image = await asyncio.to_thread(
+                                        self.run_diffusion_only,
+                                        preprocessed_data,
+                                        garment_img,
+                                        garment_desc,
+                                        batch["steps"],
+                                        batch["seed"],
+                                    )
+                                timings["diffusion"] = time.perf_counter() - diffusion_start
+                                encode_start = time.perf_counter()
+                                with recorder.span("encode_png", index=idx + 1):
+                                    payload = await asyncio.to_thread(encode_png, output_image)
+                                timings["encode"] = time.perf_counter() - encode_start
+                            except Exception as e:
+                                # If one garment fails, continue with others
+                                yield frame({
+                                    "type": "result",
+                                    "index": idx + 1,
+                                    "status": "error",
+                                    "error": f"Error processing garment {idx + 1}: {str(e)}",
+                                    "timings": timings,
+                                })
+                                continue
+                            yield frame(
+                                {"type": "result", "index": idx + 1, "status": "ok", "content_type": "image/png", "timings": timings},
+                                payload,
+                            )
+
+                end["timings"] = {"total": time.perf_counter() - request_start}
+                if recorder.spans:
+                    end["spans"] = recorder.spans
+                yield frame(end)
+
+            return StreamingResponse(generate(), media_type="application/x-tryon-frames")
+
+        @api_app.get("/health")
+        async def health():
+            return {"status": "healthy", "models_loaded": True}
+
+        @api_app.get("/limits")
+        async def limits():
+            """Resolution limits and accepted encodings, so clients can downscale inputs safely."""
+            return {
+                # The person image (or its auto-crop) is resized so its long side equals this,
+                # garments are resized to the same target size (see _compute_target_size)
+                "max_process_side": self.max_process_side,
+                "size_multiple": 8,
+                "default_size": list(self.default_size),
+                "input_formats": ["image/png", "image/jpeg", "image/webp"],
+                "model_version": self.model_version,
+            }
+
+        return api_app
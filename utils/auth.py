@@ -22,3 +22,7 @@ async def verify_api_key(credentials: HTTPAuthorizationCredentials = Security(se
         )
     return True
 
+
+async def get_api_key(credentials: HTTPAuthorizationCredentials = Security(security)) -> str:
+    """The bearer token the request was made with (identifies the caller for rate limiting)"""
+    return credentials.credentials
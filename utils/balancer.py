@@ -0,0 +1,85 @@
+"""Weighted load balancing across equivalent endpoints"""
+import random
+from typing import Callable, Dict, Iterable, List, Optional
+from utils.hedging import LatencyHistory
+
+
+class _Endpoint:
+    def __init__(self, url: str, weight: float, history: int):
+        self.url = url
+        self.weight = weight
+        self.in_flight = 0
+        self.latency: Optional[float] = None  # EWMA of normalised latency
+        self.history = LatencyHistory(history, 1)
+        self.stats = {"requests": 0, "succeeded": 0, "failed": 0}
+
+
+class EndpointBalancer:
+    """Power-of-two-choices over weighted endpoints.
+
+    Two distinct candidates are drawn in proportion to their weights, and the one
+    with the lower score wins. The score is (outstanding requests + 1) × EWMA
+    latency / weight. An endpoint with no latency yet is scored with the mean of
+    the others, so it gets traffic without being flooded. Latencies are
+    normalised by the caller (e.g. seconds per garment). Health is decided
+    outside: `pick` only considers endpoints the `available` predicate accepts."""
+
+    def __init__(self, weights: Dict[str, float], decay: float = 0.2, history: int = 200):
+        self.decay = decay
+        self.endpoints = {url: _Endpoint(url, weight, history) for url, weight in weights.items() if weight > 0}
+
+    def _score(self, endpoint: _Endpoint, default_latency: float) -> float:
+        latency = endpoint.latency if endpoint.latency is not None else default_latency
+        return (endpoint.in_flight + 1) * latency / endpoint.weight
+
+    def pick(self, available: Callable[[str], bool] = lambda url: True, avoid: Iterable[str] = ()) -> Optional[str]:
+        """Endpoint for the next request, preferring ones not in `avoid`; None if none is available"""
+        candidates = [endpoint for endpoint in self.endpoints.values() if available(endpoint.url)]
+        preferred = [endpoint for endpoint in candidates if endpoint.url not in set(avoid)]
+        candidates = preferred or candidates
+        if not candidates:
+            return None
+        if len(candidates) == 1:
+            return candidates[0].url
+        first = random.choices(candidates, weights=[endpoint.weight for endpoint in candidates])[0]
+        rest = [endpoint for endpoint in candidates if endpoint is not first]
+        second = random.choices(rest, weights=[endpoint.weight for endpoint in rest])[0]
+        known = [endpoint.latency for endpoint in self.endpoints.values() if endpoint.latency is not None]
+        default_latency = sum(known) / len(known) if known else 1.0
+        return min((first, second), key=lambda endpoint: self._score(endpoint, default_latency)).url
+
+    def start(self, url: str):
+        endpoint = self.endpoints[url]
+        endpoint.in_flight += 1
+        endpoint.stats["requests"] += 1
+
+    def finish(self, url: str, latency: Optional[float] = None, failed: bool = False):
+        """Record the end of a request: `latency` for a success, `failed` for an endpoint error
+        (neither for a request that was cancelled or refused as invalid)"""
+        endpoint = self.endpoints[url]
+        endpoint.in_flight -= 1
+        if failed:
+            endpoint.stats["failed"] += 1
+        elif latency is not None:
+            endpoint.stats["succeeded"] += 1
+            endpoint.history.record(latency)
+            endpoint.latency = latency if endpoint.latency is None else (
+                (1 - self.decay) * endpoint.latency + self.decay * latency
+            )
+
+    def urls(self) -> List[str]:
+        return list(self.endpoints)
+
+    def snapshot(self) -> Dict[str, Dict[str, Optional[float]]]:
+        """Per-endpoint weight, in-flight requests, counters and latency (EWMA, p50, p95)"""
+        return {
+            url: {
+                "weight": endpoint.weight,
+                "in_flight": endpoint.in_flight,
+                **endpoint.stats,
+                "latency_ewma": round(endpoint.latency, 3) if endpoint.latency is not None else None,
+                "latency_p50": endpoint.history.percentile(50),
+                "latency_p95": endpoint.history.percentile(95),
+            }
+            for url, endpoint in self.endpoints.items()
+        }
@@ -0,0 +1,77 @@
+"""Batch size chosen from a latency model fitted on recent batch timings"""
+import math
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+
+class BatchSizer:
+    """Picks how many garments go into one worker request.
+
+    Recent successful requests are fitted by least squares to
+    seconds = overhead + per_garment × garments, where overhead is the
+    per-request cost (upload, person preprocessing, model dispatch). The batch
+    size is the largest one predicted to finish within `target_seconds`,
+    clamped to [1, `max_size`]. A job is then split into equal chunks of at most
+    that size, so a job of 5 with a size of 4 runs as 3 + 2 rather than 4 + 1.
+
+    `default_size` is used until `min_samples` requests were recorded. While all
+    recorded requests had the same size, overhead cannot be told apart from
+    per-garment time, so the whole request time is charged per garment. This
+    under-estimates the size, and the differently sized batches that follow
+    complete the fit."""
+
+    def __init__(self, target_seconds: float, max_size: int, default_size: int, min_samples: int, history: int = 200):
+        self.target_seconds = target_seconds
+        self.max_size = max(1, max_size)
+        self.default_size = min(max(1, default_size), self.max_size)
+        self.min_samples = max(2, min_samples)
+        self._samples: Deque[Tuple[int, float]] = deque(maxlen=max(history, self.min_samples))
+        self.stats = {"default": 0, "model": 0}
+
+    def record(self, garments: int, seconds: float):
+        if garments > 0:
+            self._samples.append((garments, seconds))
+
+    def model(self) -> Optional[Tuple[float, float]]:
+        """(overhead, per_garment) seconds, None until `min_samples` requests were recorded"""
+        if len(self._samples) < self.min_samples:
+            return None
+        count = len(self._samples)
+        mean_n = sum(n for n, _ in self._samples) / count
+        mean_s = sum(s for _, s in self._samples) / count
+        var_n = sum((n - mean_n) ** 2 for n, _ in self._samples)
+        slope = sum((n - mean_n) * (s - mean_s) for n, s in self._samples) / var_n if var_n else 0.0
+        if slope <= 0:
+            # One batch size only, or noise swamping the garment term
+            return 0.0, mean_s / mean_n
+        overhead = mean_s - slope * mean_n
+        if overhead < 0:
+            return 0.0, mean_s / mean_n
+        return overhead, slope
+
+    def size_for(self, garments: int) -> Tuple[int, str]:
+        """Batch size for a job of `garments` garments, and whether it came from the "model" or the "default" """
+        fitted = self.model()
+        if fitted is None:
+            size, basis = self.default_size, "default"
+        else:
+            overhead, per_garment = fitted
+            fits = (self.target_seconds - overhead) / per_garment if per_garment > 0 else self.max_size
+            size, basis = min(max(1, int(fits)), self.max_size), "model"
+        self.stats[basis] += 1
+        if garments <= size:
+            return max(1, garments), basis
+        chunks = math.ceil(garments / size)
+        return math.ceil(garments / chunks), basis
+
+    def snapshot(self) -> Dict[str, Optional[float]]:
+        """Fitted model and how many sizes came from each basis"""
+        fitted = self.model()
+        return {
+            "samples": len(self._samples),
+            "target_seconds": self.target_seconds,
+            "overhead_seconds": round(fitted[0], 3) if fitted else None,
+            "per_garment_seconds": round(fitted[1], 3) if fitted else None,
+            "max_size": self.max_size,
+            **{f"sized_by_{basis}": count for basis, count in self.stats.items()},
+        }
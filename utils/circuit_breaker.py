@@ -0,0 +1,66 @@
+"""Circuit breaker: stop calling an endpoint that keeps failing"""
+import time
+from typing import Dict, Union
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an endpoint whose circuit is open"""
+
+
+class CircuitBreaker:
+    """Fails calls fast while a downstream endpoint is down.
+
+    closed: calls go through; `failure_threshold` consecutive failures open the circuit.
+    open: calls raise CircuitOpenError for `reset_timeout` seconds.
+    half-open: a single probe call goes through; its success closes the circuit
+    and its failure opens it again."""
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self.stats = {"opened": 0, "rejected": 0}
+
+    def available(self) -> bool:
+        """Whether before_call() would let a call through now (does not change the state)"""
+        if self.state == "closed":
+            return True
+        if self.state == "open":
+            return time.monotonic() - self._opened_at >= self.reset_timeout
+        return not self._probing
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may go through now"""
+        if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self.state = "half_open"
+            self._probing = False
+        if self.state == "open" or (self.state == "half_open" and self._probing):
+            self.stats["rejected"] += 1
+            retry_in = max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+            raise CircuitOpenError(f"Circuit for {self.name} is open (retry in {retry_in:.0f}s)")
+        if self.state == "half_open":
+            self._probing = True
+
+    def record_success(self):
+        self.failures = 0
+        self.state = "closed"
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == "half_open" or (self.state == "closed" and self.failures >= self.failure_threshold):
+            self.state = "open"
+            self._opened_at = time.monotonic()
+            self._probing = False
+            self.stats["opened"] += 1
+
+    def record_abandoned(self):
+        """The call ended without a verdict (cancelled); a half-open circuit may probe again"""
+        self._probing = False
+
+    def snapshot(self) -> Dict[str, Union[str, int]]:
+        return {"state": self.state, "consecutive_failures": self.failures, **self.stats}
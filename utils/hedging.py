@@ -0,0 +1,89 @@
+"""Hedged requests: duplicate a slow call and keep whichever copy answers first"""
+import asyncio
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+# An attempt receives a `claim()` callback (see `hedged`)
+Attempt = Callable[[Callable[[], bool]], Awaitable[T]]
+
+
+class LatencyHistory:
+    """Sliding window of recent latencies; hedging starts at one of its percentiles"""
+
+    def __init__(self, size: int, min_samples: int):
+        self.min_samples = max(1, min_samples)
+        self._samples: Deque[float] = deque(maxlen=max(size, self.min_samples))
+
+    def record(self, seconds: float):
+        self._samples.append(seconds)
+
+    def percentile(self, percent: float) -> Optional[float]:
+        """Nearest-rank percentile, None until `min_samples` latencies were recorded"""
+        if len(self._samples) < self.min_samples:
+            return None
+        ordered = sorted(self._samples)
+        rank = min(len(ordered) - 1, max(0, int(round(percent / 100 * len(ordered))) - 1))
+        return ordered[rank]
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+
+class HedgeLost(Exception):
+    """Raised by an attempt whose claim() failed because the other attempt won"""
+
+
+async def hedged(
+    primary: Attempt,
+    hedge_after: Optional[float],
+    start_hedge: Callable[[Callable[[], bool]], Optional[Awaitable[T]]],
+) -> Tuple[T, bool]:
+    """Run `primary`; if it has not claimed its result after `hedge_after` seconds,
+    ask `start_hedge` for a duplicate attempt (it returns None to decline) and
+    keep whichever attempt claims first. The other one is cancelled.
+
+    Each attempt gets a `claim()` callback and must call it before its first
+    visible side effect and before returning. claim() returns False to the loser,
+    which should then raise HedgeLost. If every attempt fails, the primary's
+    error is raised. Returns (result, whether the hedge won)."""
+    winner = []
+    tasks: Dict[str, asyncio.Task] = {}
+
+    def claim_for(name: str) -> Callable[[], bool]:
+        def claim() -> bool:
+            if not winner:
+                winner.append(name)
+                for other, task in tasks.items():
+                    if other != name:
+                        task.cancel()
+            return winner[0] == name
+        return claim
+
+    tasks["primary"] = asyncio.create_task(primary(claim_for("primary")))
+    try:
+        if hedge_after is not None:
+            done, _ = await asyncio.wait([tasks["primary"]], timeout=hedge_after)
+            if not done and not winner:
+                hedge = start_hedge(claim_for("hedge"))
+                if hedge is not None:
+                    tasks["hedge"] = asyncio.create_task(hedge)
+
+        errors: Dict[str, BaseException] = {}
+        pending = set(tasks.values())
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for name, task in tasks.items():
+                if task not in done or task.cancelled():
+                    continue
+                if task.exception() is None:
+                    return task.result(), name == "hedge"
+                if not isinstance(task.exception(), HedgeLost):
+                    errors[name] = task.exception()
+        raise errors.get("primary") or errors.get("hedge") or HedgeLost("Every attempt lost or was cancelled")
+    finally:
+        for task in tasks.values():
+            task.cancel()
+        # Let the cancelled attempts release their connections and limiter slots
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
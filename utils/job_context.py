@@ -0,0 +1,60 @@
+"""Per-job context shared across pipeline stages"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+from utils.metrics import STAGE_ERRORS, STAGE_SECONDS
+from utils.tracing import start_span
+
+
+@dataclass
+class JobContext:
+    """State carried through one try-on job (set by the job worker)"""
+    job_id: str
+    timings: Dict[str, float] = field(default_factory=dict)
+    tier: str = "unknown"
+    started_at: float = field(default_factory=time.monotonic)
+    garment_retries: int = 0  # failed garments resubmitted to the GPU worker
+
+
+current_job: ContextVar[Optional[JobContext]] = ContextVar("current_job", default=None)
+
+
+@contextmanager
+def stage(name: str):
+    """Time a pipeline stage: adds the elapsed seconds to the current job's timings,
+    records them (and any exception) in the stage metrics and traces the stage as a span"""
+    start = time.perf_counter()
+    job = current_job.get()
+    tier = current_tier()
+    try:
+        with start_span(name, tier=tier):
+            yield
+    except Exception:
+        STAGE_ERRORS.labels(name, tier).inc()
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.labels(name, tier).observe(elapsed)
+        if job is not None:
+            job.timings[name] = job.timings.get(name, 0.0) + elapsed
+
+
+def current_tier() -> str:
+    """Subscription tier of the job running in this context ("none" outside a job)"""
+    job = current_job.get()
+    return job.tier if job is not None else "none"
+
+
+def job_time_left(limit: float) -> float:
+    """Seconds until the current job has run for `limit` seconds (`limit` outside a job)"""
+    job = current_job.get()
+    if job is None:
+        return limit
+    return limit - (time.monotonic() - job.started_at)
+
+
+def record_error(name: str):
+    """Count an error a stage handled without raising (e.g. a fallback was used)"""
+    STAGE_ERRORS.labels(name, current_tier()).inc()
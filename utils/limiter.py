@@ -0,0 +1,92 @@
+"""Adaptive (AIMD) concurrency limiter"""
+import asyncio
+import time
+from collections import deque
+from typing import Deque, Dict, Optional
+
+
+class AdaptiveLimiter:
+    """Caps in-flight requests with a limit that adapts to the downstream's health.
+
+    Additive increase: every healthy completion adds 1/limit, so the limit grows
+    by about one per round of `limit` requests. Multiplicative decrease: an
+    overload signal (429, 5xx, timeout) multiplies the limit by `backoff`, at
+    most once per `cooldown` seconds so a burst of failures counts once.
+    Completions slower than `latency_target` hold the limit steady."""
+
+    def __init__(
+        self,
+        initial: int,
+        minimum: int,
+        maximum: int,
+        latency_target: float,
+        backoff: float = 0.5,
+        cooldown: float = 5.0,
+    ):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._last_decrease = 0.0
+        self.stats = {"increases": 0, "decreases": 0}
+
+    def has_capacity(self) -> bool:
+        return self.in_flight < int(self.limit)
+
+    def try_acquire(self) -> bool:
+        if not self.has_capacity():
+            return False
+        self.in_flight += 1
+        return True
+
+    async def acquire(self):
+        if not self._waiters and self.try_acquire():
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Slot was handed over just as we were cancelled: give it back
+                self.in_flight -= 1
+                self._wake()
+            else:
+                self._waiters.remove(waiter)
+            raise
+
+    def release(self, latency: Optional[float] = None, overloaded: bool = False):
+        """Return a slot. `latency` is the normalised request latency, None if unknown."""
+        self.in_flight -= 1
+        now = time.monotonic()
+        if overloaded:
+            if now - self._last_decrease >= self.cooldown:
+                self.limit = max(self.minimum, self.limit * self.backoff)
+                self._last_decrease = now
+                self.stats["decreases"] += 1
+        elif latency is not None and latency <= self.latency_target:
+            previous = int(self.limit)
+            self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            if int(self.limit) > previous:
+                self.stats["increases"] += 1
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self.has_capacity():
+            waiter = self._waiters.popleft()
+            if waiter.done():
+                continue
+            self.in_flight += 1
+            waiter.set_result(None)
+
+    def snapshot(self) -> Dict[str, float]:
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "waiting": len(self._waiters),
+            **self.stats,
+        }
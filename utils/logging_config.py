@@ -0,0 +1,145 @@
+"""Process logging: records are queued by the caller and written by a listener thread.
+
+The caller only pays for the level check, sampling, attaching the job/trace ids
+and merging the message arguments; formatting and handler I/O happen on the
+listener thread."""
+import atexit
+import itertools
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+from datetime import datetime, timezone
+from typing import Dict, Optional
+from config import LOG_FORMAT, LOG_LEVEL, LOG_QUEUE_SIZE, LOG_SAMPLE_RATES
+from utils.job_context import current_job
+from utils.tracing import current_span
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(job_id)s - %(message)s"
+
+logging_stats = {"sampled_out": 0, "dropped": 0}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class ContextFilter(logging.Filter):
+    """Stamps each record with the current job id and trace id ("-" outside a job/trace).
+
+    Runs on the calling side, where the context variables are set."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        job = current_job.get()
+        span = current_span.get()
+        record.job_id = job.job_id if job is not None else "-"
+        record.trace_id = span.trace_id if span is not None else "-"
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps 1 in every round(1 / rate) INFO/DEBUG records of a logger (and its children).
+
+    Warnings and errors are never sampled."""
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.every = {name: max(1, round(1 / rate)) if rate > 0 else 0 for name, rate in rates.items()}
+        self._counters: Dict[str, "itertools.count[int]"] = {}
+
+    def _every_for(self, name: str) -> Optional[int]:
+        while name:
+            if name in self.every:
+                return self.every[name]
+            name = name.rpartition(".")[0]
+        return None
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.INFO:
+            return True
+        every = self._every_for(record.name)
+        if every is None or every == 1:
+            return True
+        counter = self._counters.setdefault(record.name, itertools.count())
+        if every and next(counter) % every == 0:
+            return True
+        logging_stats["sampled_out"] += 1
+        return False
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "job_id": getattr(record, "job_id", "-"),
+            "trace_id": getattr(record, "trace_id", "-"),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Drops records when the queue is full instead of blocking the caller, and
+    leaves formatting to the listener (only the message and traceback are rendered here)"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        message = record.getMessage()
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg, record.args, record.exc_info = message, None, None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            logging_stats["dropped"] += 1
+
+
+class _QueueListener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # Block (unlike records) so stopping works even when the queue is full
+        self.queue.put(self._sentinel)
+
+
+def configure_logging():
+    """Route the root logger through a queue to a stderr handler on a listener thread (idempotent)"""
+    global _listener
+    if _listener is not None:
+        return
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT))
+
+    handler = _QueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    if LOG_SAMPLE_RATES:
+        handler.addFilter(SamplingFilter(LOG_SAMPLE_RATES))
+    handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+
+    _listener = _QueueListener(handler.queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def get_logging_stats() -> Dict[str, int]:
+    return dict(logging_stats)
@@ -0,0 +1,26 @@
+"""Prometheus metric definitions shared by the pipeline"""
+from prometheus_client import Counter, Gauge, Histogram
+
+# Stage latencies span from milliseconds (cache hits) to many minutes (GPU batches)
+STAGE_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200, 3600)
+
+STAGE_SECONDS = Histogram(
+    "tryon_stage_seconds", "Time spent in each pipeline stage", ["stage", "tier"], buckets=STAGE_BUCKETS
+)
+STAGE_ERRORS = Counter("tryon_stage_errors_total", "Errors raised or absorbed in each pipeline stage", ["stage", "tier"])
+JOBS_FINISHED = Counter("tryon_jobs_finished_total", "Try-on jobs finished, by outcome", ["tier", "state"])
+BYTES_TRANSFERRED = Counter(
+    "tryon_bytes_total", "Payload bytes exchanged with external services", ["direction", "peer"]
+)
+MODAL_RESILIENCE = Counter(
+    "tryon_modal_resilience_total", "Hedged requests, retries and circuit-breaker rejections of Modal batches", ["event"]
+)
+MODAL_ENDPOINT_IN_FLIGHT = Gauge("tryon_modal_endpoint_in_flight", "Batch requests in flight per GPU endpoint", ["endpoint"])
+MODAL_ENDPOINT_SECONDS = Histogram(
+    "tryon_modal_endpoint_seconds", "Batch request duration per GPU endpoint and outcome", ["endpoint", "outcome"],
+    buckets=STAGE_BUCKETS,
+)
+MODAL_BATCH_SIZE = Histogram(
+    "tryon_modal_batch_size", "Garments per Modal batch chosen for a job, by what decided it", ["basis"],
+    buckets=(1, 2, 3, 4, 6, 8, 12, 16),
+)
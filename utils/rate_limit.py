@@ -0,0 +1,60 @@
+"""Token-bucket rate limiting"""
+import time
+from typing import Dict
+
+
+class TokenBucket:
+    """Refills `rate` tokens per second up to `burst`"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self, tokens: float = 1.0) -> float:
+        """Take tokens if available and return 0; otherwise return seconds until they will be"""
+        self._refill(time.monotonic())
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return 0.0
+        if self.rate <= 0:
+            return float("inf")
+        return (tokens - self.tokens) / self.rate
+
+    def refund(self, tokens: float = 1.0):
+        """Give back tokens taken for a request that was not carried out"""
+        self._refill(time.monotonic())
+        self.tokens = min(self.burst, self.tokens + tokens)
+
+    def is_full(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.burst
+
+
+class KeyedTokenBuckets:
+    """One TokenBucket per key; full (idle) buckets are dropped once there are more than `max_keys`"""
+
+    def __init__(self, rate: float, burst: float, max_keys: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets: Dict[str, TokenBucket] = {}
+
+    def try_take(self, key: str, tokens: float = 1.0) -> float:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.max_keys:
+                self._buckets = {k: b for k, b in self._buckets.items() if not b.is_full()}
+            bucket = TokenBucket(self.rate, self.burst)
+            self._buckets[key] = bucket
+        return bucket.try_take(tokens)
+
+    def refund(self, key: str, tokens: float = 1.0):
+        bucket = self._buckets.get(key)
+        if bucket is not None:
+            bucket.refund(tokens)
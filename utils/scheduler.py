@@ -0,0 +1,151 @@
+"""Weighted-fair, priority-aware admission in front of an AdaptiveLimiter"""
+import asyncio
+import time
+from collections import defaultdict, deque
+from typing import Deque, Dict, Iterable, Optional, Tuple
+from utils.limiter import AdaptiveLimiter
+
+
+def wait_summary(waits: Iterable[float]) -> Dict[str, float]:
+    """p50/p95/max of recorded wait times (seconds)"""
+    ordered = sorted(waits)
+    if not ordered:
+        return {"wait_p50": 0.0, "wait_p95": 0.0, "wait_max": 0.0}
+    return {
+        "wait_p50": round(ordered[len(ordered) // 2], 3),
+        "wait_p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3),
+        "wait_max": round(ordered[-1], 3),
+    }
+
+
+class _Waiter:
+    __slots__ = ("tier", "user_id", "enqueued_at", "future")
+
+    def __init__(self, tier: str, user_id: Optional[str], future: asyncio.Future):
+        self.tier = tier
+        self.user_id = user_id
+        self.enqueued_at = time.monotonic()
+        self.future = future
+
+
+class PriorityScheduler:
+    """Hands out the limiter's slots to waiters from several tiers.
+
+    Tiers share slots in proportion to their weights (stride scheduling: each
+    grant advances the tier's pass by 1/weight and the tier with the lowest
+    pass goes next; a tier that was idle rejoins at the current virtual time so
+    it cannot bank credit). A user never holds more than `per_user_limit` slots.
+    Any waiter older than `max_wait` seconds is served first, oldest first, so a
+    low tier cannot starve however busy the others are."""
+
+    def __init__(
+        self,
+        limiter: AdaptiveLimiter,
+        weights: Dict[str, float],
+        per_user_limit: int,
+        max_wait: float,
+        history: int = 1000,
+    ):
+        self.limiter = limiter
+        self.weights = {tier: max(weight, 0.01) for tier, weight in weights.items()}
+        # Unknown tiers are scheduled with the lowest weight
+        self.default_tier = min(self.weights, key=self.weights.get)
+        self.per_user_limit = max(1, per_user_limit)
+        self.max_wait = max_wait
+        self._queues: Dict[str, Deque[_Waiter]] = {tier: deque() for tier in self.weights}
+        self._pass: Dict[str, float] = {tier: 0.0 for tier in self.weights}
+        self._virtual_time = 0.0
+        self._user_in_flight: Dict[str, int] = defaultdict(int)
+        self._waits: Dict[str, Deque[float]] = {tier: deque(maxlen=history) for tier in self.weights}
+        self.stats = {tier: {"admitted": 0, "aged": 0} for tier in self.weights}
+
+    def tier_for(self, tier: Optional[str]) -> str:
+        return tier if tier in self.weights else self.default_tier
+
+    async def acquire(self, tier: Optional[str], user_id: Optional[str] = None):
+        tier = self.tier_for(tier)
+        queue = self._queues[tier]
+        if not queue:
+            self._pass[tier] = max(self._pass[tier], self._virtual_time)
+        waiter = _Waiter(tier, user_id, asyncio.get_running_loop().create_future())
+        queue.append(waiter)
+        self._dispatch()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Slot was granted just as we were cancelled: give it back
+                self.release(tier, user_id)
+            elif waiter in queue:
+                queue.remove(waiter)
+            raise
+        self._waits[tier].append(time.monotonic() - waiter.enqueued_at)
+
+    def try_acquire_spare(self) -> bool:
+        """Take a slot only if nobody is queued for one (for optional work such as hedged requests).
+        Return it with release(tier) and no user_id."""
+        if any(self._queues.values()):
+            return False
+        return self.limiter.try_acquire()
+
+    def release(self, tier: Optional[str], user_id: Optional[str] = None, latency: Optional[float] = None, overloaded: bool = False):
+        """Return a slot (see AdaptiveLimiter.release) and admit the next waiter(s)"""
+        if user_id is not None:
+            self._user_in_flight[user_id] -= 1
+            if self._user_in_flight[user_id] <= 0:
+                del self._user_in_flight[user_id]
+        self.limiter.release(latency=latency, overloaded=overloaded)
+        self._dispatch()
+
+    def _eligible(self, queue: Deque[_Waiter]) -> Optional[_Waiter]:
+        """First waiter in the queue whose user is under the per-user cap"""
+        for waiter in queue:
+            if waiter.user_id is None or self._user_in_flight.get(waiter.user_id, 0) < self.per_user_limit:
+                return waiter
+        return None
+
+    def _next(self) -> Optional[Tuple[str, _Waiter]]:
+        candidates = {}
+        for tier, queue in self._queues.items():
+            waiter = self._eligible(queue)
+            if waiter is not None:
+                candidates[tier] = waiter
+        if not candidates:
+            return None
+        now = time.monotonic()
+        aged = [(waiter.enqueued_at, tier) for tier, waiter in candidates.items() if now - waiter.enqueued_at >= self.max_wait]
+        if aged:
+            tier = min(aged)[1]
+            self.stats[tier]["aged"] += 1
+        else:
+            tier = min(candidates, key=lambda t: (self._pass[t], -self.weights[t]))
+        return tier, candidates[tier]
+
+    def _dispatch(self):
+        while self.limiter.has_capacity():
+            picked = self._next()
+            if picked is None:
+                return
+            tier, waiter = picked
+            self._queues[tier].remove(waiter)
+            if waiter.future.done():
+                continue  # cancelled while queued
+            self.limiter.try_acquire()
+            self._virtual_time = self._pass[tier]
+            self._pass[tier] += 1.0 / self.weights[tier]
+            if waiter.user_id is not None:
+                self._user_in_flight[waiter.user_id] += 1
+            self.stats[tier]["admitted"] += 1
+            waiter.future.set_result(None)
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """Per-tier queue length, admissions and wait-time percentiles (seconds)"""
+        return {
+            tier: {
+                "weight": self.weights[tier],
+                "waiting": len(self._queues[tier]),
+                **self.stats[tier],
+                **wait_summary(waits),
+            }
+            for tier, waits in self._waits.items()
+        }
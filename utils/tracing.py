@@ -0,0 +1,235 @@
+"""Lightweight tracing: W3C trace context propagation and OTLP/JSON span export.
+
+Spans are written by a background thread, one OTLP ExportTraceServiceRequest
+(JSON encoding) per line of TRACE_EXPORT_PATH and/or POSTed to an OTLP/HTTP
+collector at TRACE_OTLP_ENDPOINT. Spans received from the GPU worker are
+exported the same way, so one trace covers both services."""
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import httpx
+from config import (
+    TRACE_ENABLED,
+    TRACE_EXPORT_PATH,
+    TRACE_EXPORT_MAX_BYTES,
+    TRACE_EXPORT_BACKUPS,
+    TRACE_OTLP_ENDPOINT,
+    TRACE_SERVICE_NAME,
+)
+
+logger = logging.getLogger(__name__)
+
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+# OTLP status codes
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+
+def _attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+@dataclass
+class Span:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_span_id: Optional[str]
+    start_ns: int
+    end_ns: int = 0
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def to_otlp(self) -> Dict[str, Any]:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [_attribute(key, value) for key, value in self.attributes.items()],
+            "status": {"code": STATUS_ERROR, "message": self.error} if self.error else {"code": STATUS_OK},
+        }
+        if self.parent_span_id:
+            span["parentSpanId"] = self.parent_span_id
+        return span
+
+
+current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def parse_traceparent(header: Optional[str]) -> Optional[Tuple[str, str]]:
+    """(trace_id, parent span_id) from a W3C traceparent header, None if absent or invalid"""
+    match = _TRACEPARENT.match(header.strip().lower()) if header else None
+    return (match.group(1), match.group(2)) if match else None
+
+
+def traceparent() -> Optional[str]:
+    """W3C traceparent header for the current span (None outside a trace)"""
+    span = current_span.get()
+    return f"00-{span.trace_id}-{span.span_id}-01" if span is not None else None
+
+
+@contextmanager
+def start_span(name: str, parent: Optional[str] = None, **attributes: Any) -> Iterator[Optional[Span]]:
+    """Run the block in a new span, a child of the current span or of the `parent` traceparent.
+
+    Without either, the span starts a new trace."""
+    if not TRACE_ENABLED:
+        yield None
+        return
+    remote = parse_traceparent(parent)
+    local = current_span.get()
+    if remote is not None:
+        trace_id, parent_span_id = remote
+    elif local is not None:
+        trace_id, parent_span_id = local.trace_id, local.span_id
+    else:
+        trace_id, parent_span_id = os.urandom(16).hex(), None
+    span = Span(name, trace_id, os.urandom(8).hex(), parent_span_id, time.time_ns(), attributes=dict(attributes))
+    token = current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.error = str(e) or type(e).__name__
+        raise
+    finally:
+        span.end_ns = time.time_ns()
+        current_span.reset(token)
+        _exporter.export(TRACE_SERVICE_NAME, span.to_otlp())
+
+
+def export_remote_spans(service_name: str, spans: List[Dict[str, Any]]):
+    """Export spans recorded elsewhere (already in OTLP/JSON form), e.g. returned by the GPU worker"""
+    if TRACE_ENABLED:
+        for span in spans:
+            _exporter.export(service_name, span)
+
+
+class _SpanExporter:
+    """Batches spans on a daemon thread so exporting never blocks the event loop"""
+
+    def __init__(
+        self,
+        path: str,
+        endpoint: str,
+        max_bytes: int = 0,
+        backups: int = 0,
+        batch_size: int = 512,
+        interval: float = 1.0,
+    ):
+        self.path = path
+        self.endpoint = endpoint.rstrip("/")
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.batch_size = batch_size
+        self.interval = interval
+        self._queue: "queue.SimpleQueue[Optional[Tuple[str, Dict[str, Any]]]]" = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def export(self, service_name: str, span: Dict[str, Any]):
+        if not self.path and not self.endpoint:
+            return
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+                    self._thread.start()
+        self._queue.put((service_name, span))
+
+    def shutdown(self, timeout: float = 5.0):
+        """Flush queued spans and stop the thread"""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = []
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            if batch:
+                self._write(batch)
+
+    def _write(self, batch: List[Tuple[str, Dict[str, Any]]]):
+        by_service: Dict[str, List[Dict[str, Any]]] = {}
+        for service_name, span in batch:
+            by_service.setdefault(service_name, []).append(span)
+        request = {
+            "resourceSpans": [
+                {
+                    "resource": {"attributes": [_attribute("service.name", service_name)]},
+                    "scopeSpans": [{"scope": {"name": "tryon"}, "spans": spans}],
+                }
+                for service_name, spans in by_service.items()
+            ]
+        }
+        try:
+            if self.path:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                line = json.dumps(request) + "\n"
+                self._rotate(len(line))
+                with open(self.path, "a", encoding="utf-8") as trace_file:
+                    trace_file.write(line)
+            if self.endpoint:
+                httpx.post(f"{self.endpoint}/v1/traces", json=request, timeout=5.0).raise_for_status()
+        except Exception as e:
+            logger.warning(f"Could not export {len(batch)} span(s): {str(e)}")
+
+    def _rotate(self, incoming: int):
+        """Roll path -> path.1 -> ... -> path.<backups> once the file would exceed max_bytes
+        (like logging.handlers.RotatingFileHandler); with no backups the file is truncated"""
+        if self.max_bytes <= 0:
+            return
+        try:
+            if os.path.getsize(self.path) + incoming <= self.max_bytes:
+                return
+        except FileNotFoundError:
+            return
+        if self.backups <= 0:
+            os.remove(self.path)
+            return
+        for index in range(self.backups - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+
+_exporter = _SpanExporter(TRACE_EXPORT_PATH, TRACE_OTLP_ENDPOINT, TRACE_EXPORT_MAX_BYTES, TRACE_EXPORT_BACKUPS)
+
+
+def shutdown_tracing():
+    _exporter.shutdown()
@@ -0,0 +1,29 @@
+"""Background import of the vendor SDKs the services load lazily.
+
+The services import openai, cloudinary, resend and PIL on first use so the gateway
+binds its port without paying for them; warm_up() imports them in a thread right
+after startup so the first job does not pay either."""
+import asyncio
+import importlib
+import logging
+import time
+from typing import Any, Dict, Iterable
+
+logger = logging.getLogger(__name__)
+
+WARMUP_MODULES = ("openai", "cloudinary.uploader", "resend", "PIL.Image")
+
+warmup_state: Dict[str, Any] = {"done": False, "seconds": {}}
+
+
+async def warm_up(modules: Iterable[str] = WARMUP_MODULES):
+    """Import each module in a worker thread, recording how long it took"""
+    for name in modules:
+        start = time.perf_counter()
+        try:
+            await asyncio.to_thread(importlib.import_module, name)
+        except ImportError as e:
+            logger.warning(f"Could not warm up {name}: {str(e)}")
+        warmup_state["seconds"][name] = round(time.perf_counter() - start, 4)
+    warmup_state["done"] = True
+    logger.info(f"SDK warm-up finished in {sum(warmup_state['seconds'].values()):.2f}s")